@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+
+# Measures the dispatcher itself, by running `dispatch.py crawl` (i.e.,
+# client_crawl) end to end, against a temporary workspace, with every
+# client faked in process. ClientServer.connection() (and the connection
+# pool) hand out fake connections, and the asyncio engine's ssh is faked
+# too, so each "crawl" just waits for a latency drawn from a distribution,
+# and then fails (in a given way) at a given rate, or returns a result
+# like a real client would.
+#
+# Since the fake clients report how long they spent on each crawl, the
+# dispatcher's own overhead per crawl is measured by the dispatcher
+# itself (see add_round_trip).
+#
+# Run from the root of the repo as:
+#   python3 -m benchmarks.dispatch_crawl --clients 10 50 100 \
+#       --domains 20000 --latency lognormal:0.5:0.5 --fail ssh=0.01 \
+#       --output bench.json
+#
+# and compare the results of two commits with:
+#   python3 -m benchmarks.dispatch_crawl --compare old.json new.json
+
+import argparse
+import asyncio
+from contextlib import redirect_stderr
+from dataclasses import asdict, dataclass, replace
+from io import StringIO
+from ipaddress import IPv4Address
+import json
+import os
+from pathlib import Path
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Optional
+
+from invoke.exceptions import CommandTimedOut
+from invoke.runners import Result
+
+from benchmarks.reports import compare_reports, write_report
+from pgcrawl.aio import AsyncSSH
+from pgcrawl.client.args import DEFAULT_CRAWL_ARGS
+from pgcrawl.connections import ConnectionPool
+from pgcrawl.dispatch import DISPATCHER_DIR, WORK_DB_PATH
+from pgcrawl.dispatch.args import DEFAULT_DISPATCH_CRAWL_ARGS
+from pgcrawl.dispatch.commands import client_crawl
+from pgcrawl.dispatch.retries import DEFAULT_RETRY_POLICIES, RetryPolicy
+from pgcrawl.dispatch.store import State, WorkStore
+from pgcrawl.logging import Logger
+from pgcrawl.results import CrawlResult, Failure
+from pgcrawl.subprocesses import SSHResult
+from pgcrawl.timing import summarize_timings
+from pgcrawl.types import ClientServer, Engine, IPAddress, TrancoDomain
+from pgcrawl.types import UserName
+
+
+CRAWL_CMD = "./client.py crawl"
+# Only the first of these are seeded at once, so seeding a million
+# domains never holds them all in memory.
+SEED_BATCH_SIZE = 10_000
+
+
+# A distribution of the seconds a fake client takes to crawl a domain,
+# given as "const:SECS", "uniform:LOW:HIGH", "exp:MEAN" or
+# "lognormal:MEDIAN:SIGMA".
+@dataclass
+class Latency:
+    spec: str
+    kind: str
+    params: list[float]
+
+    @staticmethod
+    def parse(spec: str) -> "Latency":
+        kind, *params_str = spec.split(":")
+        num_params = {"const": 1, "uniform": 2, "exp": 1, "lognormal": 2}
+        try:
+            params = [float(x) for x in params_str]
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(f"Invalid latency: {spec}") from e
+        if num_params.get(kind) != len(params) or min(params) < 0:
+            raise argparse.ArgumentTypeError(f"Invalid latency: {spec}")
+        return Latency(spec, kind, params)
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "uniform":
+            return rng.uniform(self.params[0], self.params[1])
+        if self.kind == "exp":
+            return rng.expovariate(1 / max(self.params[0], 1e-9))
+        if self.kind == "lognormal":
+            return self.params[0] * rng.lognormvariate(0, self.params[1])
+        return self.params[0]
+
+
+def parse_failure_rate(value: str) -> tuple[Failure, float]:
+    try:
+        name, rate_str = value.split("=", 1)
+        return Failure(name), float(rate_str)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(
+            f"Invalid failure rate: {value}") from e
+
+
+# Decides what each fake crawl does, and keeps count of the time the fake
+# clients spent "crawling".
+class FakeClients:
+    latency: Latency
+    failure_rates: dict[Failure, float]
+    rng: random.Random
+    lock: threading.Lock
+    client_secs: float
+
+    def __init__(self, latency: Latency, failure_rates: dict[Failure, float],
+                 seed: int) -> None:
+        self.latency = latency
+        self.failure_rates = failure_rates
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.client_secs = 0.0
+
+    def next_crawl(self) -> tuple[float, Optional[Failure]]:
+        with self.lock:
+            secs = max(self.latency.sample(self.rng), 0.0)
+            self.client_secs += secs
+            roll = self.rng.random()
+        for failure, rate in self.failure_rates.items():
+            if roll < rate:
+                return secs, failure
+            roll -= rate
+        return secs, None
+
+    def crawl_output(self, secs: float,
+                     failure: Optional[Failure]) -> tuple[int, str]:
+        # What `client.py crawl` would print, and its exit code.
+        result = CrawlResult(True)
+        if failure:
+            result = CrawlResult.failed(failure, "fake failure")
+        result.timings = {"client": secs}
+        return (0 if result.success else 1), json.dumps(result.to_dict())
+
+
+@dataclass
+class FakeResult:
+    exited: int
+
+
+# Stands in for a fabric Connection, for one-shot commands.
+class FakeConnection:
+    clients: FakeClients
+
+    def __init__(self, clients: FakeClients) -> None:
+        self.clients = clients
+
+    def run(self, cmd: str, out_stream: StringIO, timeout: int,
+            **_: Any) -> FakeResult:
+        if CRAWL_CMD not in cmd:
+            return FakeResult(0)
+        secs, failure = self.clients.next_crawl()
+        time.sleep(min(secs, timeout))
+        if failure == Failure.SSH:
+            raise OSError("fake connection lost")
+        if failure == Failure.TIMEOUT or secs > timeout:
+            raise CommandTimedOut(Result(), timeout)
+        exit_code, output = self.clients.crawl_output(secs, failure)
+        out_stream.write(output + "\n")
+        return FakeResult(exit_code)
+
+    def open(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def install_fakes(clients: FakeClients) -> None:
+    # pylint: disable=unused-argument
+    fake_conn = FakeConnection(clients)
+
+    def connection(self: ClientServer) -> Any:
+        return fake_conn
+
+    def pool_connection(self: ConnectionPool, ip: IPAddress,
+                        user: str) -> Any:
+        return fake_conn
+
+    async def ssh_run(self: AsyncSSH, ip: IPAddress, cmd: str,
+                      timeout: int, logger: Logger) -> SSHResult:
+        if CRAWL_CMD not in cmd:
+            return SSHResult(0, "")
+        secs, failure = clients.next_crawl()
+        await asyncio.sleep(min(secs, timeout))
+        if failure == Failure.SSH:
+            return SSHResult(None, "", Failure.SSH)
+        if failure == Failure.TIMEOUT or secs > timeout:
+            return SSHResult(None, "", Failure.TIMEOUT)
+        return SSHResult(*clients.crawl_output(secs, failure))
+
+    async def ssh_connect(self: AsyncSSH, ip: IPAddress, timeout: int,
+                          logger: Logger) -> bool:
+        return True
+
+    setattr(ClientServer, "connection", connection)
+    setattr(ConnectionPool, "connection", pool_connection)
+    setattr(AsyncSSH, "run", ssh_run)
+    setattr(AsyncSSH, "connect", ssh_connect)
+
+
+@dataclass
+class BenchmarkResult:
+    # pylint: disable=too-many-instance-attributes
+    engine: str
+    clients: int
+    slots: int
+    domains: int
+    done: int
+    errors: int
+    seed_secs: float
+    wall_secs: float
+    cpu_secs: float
+    # Seconds the fake clients spent crawling, over every crawl
+    client_secs: float
+    crawls_per_sec: float
+    # Throughput as a share of what it'd be with no dispatch overhead
+    efficiency: float
+    # Percentiles of the dispatcher's own seconds per crawl
+    overhead_p50: float
+    overhead_p99: float
+    max_threads: int
+    max_rss_mb: float
+
+    def __str__(self) -> str:
+        return (f"{self.engine:>8} {self.clients:>8} {self.domains:>8} "
+                f"{self.wall_secs:>9.2f} {self.cpu_secs:>9.2f} "
+                f"{self.crawls_per_sec:>9.1f} {self.efficiency:>6.0%} "
+                f"{self.overhead_p50 * 1000:>8.2f} "
+                f"{self.overhead_p99 * 1000:>8.2f} {self.max_threads:>8} "
+                f"{self.max_rss_mb:>8.1f}")
+
+
+HEADER = (f"{'engine':>8} {'clients':>8} {'domains':>8} {'wall (s)':>9} "
+          f"{'cpu (s)':>9} {'crawls/s':>9} {'eff':>6} {'p50 (ms)':>8} "
+          f"{'p99 (ms)':>8} {'threads':>8} {'rss (mb)':>8}")
+
+
+def seed_domains(num_domains: int) -> float:
+    start = time.monotonic()
+    DISPATCHER_DIR.mkdir(parents=True, exist_ok=True)
+    store = WorkStore(WORK_DB_PATH)
+    for offset in range(0, num_domains, SEED_BATCH_SIZE):
+        store.add(TrancoDomain(rank, f"domain{rank}.test") for rank
+                  in range(offset + 1,
+                           min(offset + SEED_BATCH_SIZE, num_domains) + 1))
+    store.close()
+    return time.monotonic() - start
+
+
+def count_threads(stop_event: threading.Event, max_threads: list[int]) -> None:
+    while not stop_event.wait(0.1):
+        max_threads[0] = max(max_threads[0], threading.active_count())
+
+
+def run_crawl(engine: Engine, num_clients: int,
+              args: argparse.Namespace) -> tuple[float, float, int]:
+    # Returns the wall and CPU seconds the crawl took, and the most threads
+    # that were running at once.
+    ips: list[IPAddress] = [IPv4Address(f"10.0.{i // 256}.{i % 256}")
+                            for i in range(num_clients)]
+    # Failures are retried as they would be, but without waiting, so
+    # retries don't just measure the backoff.
+    policies = {failure: RetryPolicy(policy.max_retries)
+                for failure, policy in DEFAULT_RETRY_POLICIES.items()}
+    dispatch_args = replace(DEFAULT_DISPATCH_CRAWL_ARGS, slots=args.slots,
+                            resident=False, timeout=args.timeout,
+                            retry_policies=policies, engine=engine,
+                            show_status=False)
+
+    max_threads = [threading.active_count()]
+    stop_event = threading.Event()
+    counter = threading.Thread(target=count_threads,
+                               args=(stop_event, max_threads), daemon=True)
+    counter.start()
+    start_cpu = time.process_time()
+    start = time.monotonic()
+    # Failures are logged as errors, which aren't what's being measured.
+    with redirect_stderr(StringIO()):
+        client_crawl(ips, UserName("bench"), False, 0, dispatch_args,
+                     DEFAULT_CRAWL_ARGS, Logger("error"))
+    wall_secs = time.monotonic() - start
+    cpu_secs = time.process_time() - start_cpu
+    stop_event.set()
+    counter.join()
+    return wall_secs, cpu_secs, max_threads[0]
+
+
+def run_benchmark(engine: Engine, num_clients: int,
+                  args: argparse.Namespace) -> BenchmarkResult:
+    # Runs in (and leaves a workspace behind in) the current directory.
+    clients = FakeClients(args.latency, dict(args.fail), args.seed)
+    install_fakes(clients)
+    seed_secs = seed_domains(args.domains)
+    wall_secs, cpu_secs, max_threads = run_crawl(engine, num_clients, args)
+
+    store = WorkStore(WORK_DB_PATH)
+    counts = store.counts()
+    overheads = summarize_timings(list(store.iter_timings())).get(
+        "overhead", {})
+    store.close()
+    num_crawls = counts[State.DONE] + counts[State.ERROR]
+    ideal_secs = clients.client_secs / (num_clients * args.slots)
+    return BenchmarkResult(
+        engine.value, num_clients, args.slots, args.domains,
+        counts[State.DONE], counts[State.ERROR], seed_secs, wall_secs,
+        cpu_secs, clients.client_secs, num_crawls / max(wall_secs, 1e-9),
+        ideal_secs / max(wall_secs, 1e-9), overheads.get("p50", 0.0),
+        overheads.get("p99", 0.0), max_threads,
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+
+def run_in_subprocess(engine: Engine, num_clients: int,
+                      args: argparse.Namespace) -> BenchmarkResult:
+    # Each run gets a fresh process, and workspace, so memory use and
+    # state from one run don't bleed into the next.
+    repo_dir = Path(__file__).resolve().parent.parent
+    cmd = [sys.executable, "-m", "benchmarks.dispatch_crawl",
+           "--engine", engine.value,
+           "--clients", str(num_clients),
+           "--slots", str(args.slots),
+           "--domains", str(args.domains),
+           "--latency", args.latency.spec,
+           "--timeout", str(args.timeout),
+           "--seed", str(args.seed),
+           "--json"]
+    for failure, rate in args.fail:
+        cmd += ["--fail", f"{failure.value}={rate}"]
+    env = dict(os.environ, PYTHONPATH=str(repo_dir))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        rs = subprocess.run(cmd, capture_output=True, check=True,
+                            cwd=tmp_dir, env=env)
+    return BenchmarkResult(**json.loads(rs.stdout))
+
+
+def report_config(args: argparse.Namespace) -> dict[str, Any]:
+    return {
+        "slots": args.slots,
+        "domains": args.domains,
+        "latency": args.latency.spec,
+        "fail": {x.value: rate for x, rate in args.fail},
+        "timeout": args.timeout,
+        "seed": args.seed,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark `dispatch.py crawl` against fake clients.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        "--clients",
+        nargs="+",
+        type=int,
+        default=[10, 50, 100],
+        help="Numbers of fake clients to benchmark with.")
+    parser.add_argument(
+        "--slots",
+        type=int,
+        default=2,
+        help="Number of concurrent crawls to run per client.")
+    parser.add_argument(
+        "--domains",
+        type=int,
+        default=5000,
+        help="Number of domains to crawl in each run.")
+    parser.add_argument(
+        "--latency",
+        type=Latency.parse,
+        default="lognormal:0.2:0.5",
+        help="Distribution of the seconds each fake crawl takes, one of "
+             "const:SECS, uniform:LOW:HIGH, exp:MEAN or "
+             "lognormal:MEDIAN:SIGMA.")
+    parser.add_argument(
+        "--fail",
+        default=[],
+        action="append",
+        type=parse_failure_rate,
+        metavar="FAILURE=RATE",
+        help="Share of crawls that fail in a given way, e.g., ssh=0.01. Can "
+             "be given more than once. Failures are: "
+             + ", ".join(x.value for x in Failure) + ".")
+    parser.add_argument(
+        "--timeout",
+        type=int,
+        default=DEFAULT_DISPATCH_CRAWL_ARGS.timeout,
+        help="Seconds after which a fake crawl times out.")
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed for the fake clients' latencies and failures.")
+    parser.add_argument(
+        "--engine",
+        nargs="+",
+        choices=[x.value for x in Engine],
+        default=[x.value for x in Engine],
+        help="Dispatcher engines to benchmark.")
+    parser.add_argument(
+        "-o", "--output",
+        help="File to write the results to, as JSON, to compare with the "
+             "results of other commits (see --compare).")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("OLD", "NEW"),
+        help="Instead of benchmarking, compare two files written by "
+             "--output.")
+    parser.add_argument(
+        "--json",
+        default=False,
+        action="store_true",
+        help="Run a single engine and number of clients, in this process "
+             "and directory, and print the result as JSON.")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_reports(Path(args.compare[0]), Path(args.compare[1]),
+                        ["engine", "clients"],
+                        [("crawls_per_sec", "crawls/s", 1),
+                         ("overhead_p50", "p50 (ms)", 1000),
+                         ("max_rss_mb", "rss (mb)", 1)])
+        return
+
+    if args.json:
+        rs = run_benchmark(Engine(args.engine[0]), args.clients[0], args)
+        print(json.dumps(asdict(rs)))
+        return
+
+    print(HEADER)
+    results = []
+    for num_clients in args.clients:
+        for engine in args.engine:
+            rs = run_in_subprocess(Engine(engine), num_clients, args)
+            print(rs)
+            results.append(rs)
+    if args.output:
+        write_report(Path(args.output), report_config(args),
+                     [asdict(x) for x in results])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+
+# Compares how the threads and asyncio dispatcher engines cope with many
+# clients, without needing any. "SSH" runs a local fake ssh script, which
+# either runs a command (by sleeping), or, for `serve`, acts like a resident
+# `client.py serve` worker (that sleeps for each job). So each engine pays
+# for starting processes and talking to them, like it would for real
+# crawls, but nothing else.
+#
+# Run from the root of the repo as:
+#   python3 -m benchmarks.dispatch_engines --clients 10 50 200
+
+import argparse
+from dataclasses import asdict, dataclass
+from io import StringIO
+from ipaddress import IPv4Address
+import json
+from pathlib import Path
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, IO, Optional
+
+from pgcrawl.aio import AsyncClientServer, AsyncIPManager
+from pgcrawl.aio import AsyncPullScheduler
+from pgcrawl.connections import ConnectionPool
+from pgcrawl.dispatch.aio import AsyncResidentWorkers
+from pgcrawl.dispatch.workers import ResidentWorkers
+from pgcrawl.logging import Logger
+from pgcrawl.results import Failure
+from pgcrawl.scheduler import PullScheduler
+from pgcrawl.subprocesses import run_ssh_cmd
+from pgcrawl.threading import ThreadIPManager
+from pgcrawl.types import ClientServer, Engine, IPAddress, UserName
+from pgcrawl.types import WorkItem
+
+
+MODES = ["one-shot", "resident"]
+SERVE_CMD = "serve"
+
+# Jobs are JSON objects that end with the job's id, e.g. {..., "id": 3}.
+FAKE_SSH_SCRIPT = r"""#!/bin/sh
+for cmd; do
+    # Control commands (e.g., -O exit) return at once.
+    [ "$cmd" = "-O" ] && exit 0
+done
+if [ "$cmd" != "{serve_cmd}" ]; then
+    sleep {latency}
+    echo ok
+    exit 0
+fi
+while read -r line; do
+    case "$line" in
+        *'"ping"'*) ;;
+        *) sleep {latency} ;;
+    esac
+    id="${{line##*\"id\": }}"
+    id="${{id%%\}}*}}"
+    echo "{{\"id\": $id, \"success\": true, \"result\": true}}"
+done
+"""
+
+
+@dataclass
+class FakeResult:
+    exited: int
+
+
+# Stands in for a paramiko Channel, by running the fake ssh script.
+class FakeChannel:
+    fake_ssh: str
+    proc: Optional[subprocess.Popen[bytes]]
+    closed: bool
+
+    def __init__(self, fake_ssh: str) -> None:
+        self.fake_ssh = fake_ssh
+        self.proc = None
+        self.closed = False
+
+    def exec_command(self, cmd: str) -> None:
+        # pylint: disable=consider-using-with
+        self.proc = subprocess.Popen(
+            [self.fake_ssh, cmd], stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def makefile(self, _: str) -> IO[bytes]:
+        assert self.proc and self.proc.stdout
+        return self.proc.stdout
+
+    def settimeout(self, _: float) -> None:
+        pass
+
+    def sendall(self, data: bytes) -> None:
+        assert self.proc and self.proc.stdin
+        self.proc.stdin.write(data)
+        self.proc.stdin.flush()
+
+    def exit_status_ready(self) -> bool:
+        return self.proc is None or self.proc.poll() is not None
+
+    def recv_stderr_ready(self) -> bool:
+        return False
+
+    def close(self) -> None:
+        self.closed = True
+        if self.proc:
+            self.proc.kill()
+            self.proc.wait()
+
+
+# Stands in for a fabric Connection (and its paramiko Transport).
+class FakeConnection:
+    fake_ssh: str
+
+    def __init__(self, fake_ssh: str) -> None:
+        self.fake_ssh = fake_ssh
+
+    @property
+    def transport(self) -> "FakeConnection":
+        return self
+
+    def open_session(self) -> FakeChannel:
+        return FakeChannel(self.fake_ssh)
+
+    def run(self, cmd: str, out_stream: StringIO, **_: Any) -> FakeResult:
+        rs = subprocess.run([self.fake_ssh, cmd], capture_output=True,
+                            check=False)
+        out_stream.write(rs.stdout.decode("utf8"))
+        return FakeResult(rs.returncode)
+
+    def close(self) -> None:
+        pass
+
+
+class FakeConnectionPool(ConnectionPool):
+    fake_ssh: str
+
+    def __init__(self, fake_ssh: str, logger: Logger) -> None:
+        super().__init__(logger)
+        self.fake_ssh = fake_ssh
+
+    def connection(self, ip: IPAddress, user: UserName) -> Any:
+        return FakeConnection(self.fake_ssh)
+
+
+@dataclass
+class BenchmarkResult:
+    # pylint: disable=too-many-instance-attributes
+    engine: str
+    mode: str
+    clients: int
+    jobs: int
+    wall_secs: float
+    cpu_secs: float
+    max_threads: int
+    max_rss_mb: float
+
+    def __str__(self) -> str:
+        return (f"{self.engine:>8} {self.mode:>9} {self.clients:>8} "
+                f"{self.jobs:>8} {self.wall_secs:>9.2f} "
+                f"{self.cpu_secs:>9.2f} {self.max_threads:>8} "
+                f"{self.max_rss_mb:>8.1f}")
+
+
+HEADER = (f"{'engine':>8} {'mode':>9} {'clients':>8} {'jobs':>8} "
+          f"{'wall (s)':>9} {'cpu (s)':>9} {'threads':>8} {'rss (mb)':>8}")
+
+MAX_THREADS = [0]
+
+
+def count_threads() -> None:
+    MAX_THREADS[0] = max(MAX_THREADS[0], threading.active_count())
+
+
+def one_shot_job(server: ClientServer, timeout: int, logger: Logger) -> bool:
+    count_threads()
+    return run_ssh_cmd(server, "true", timeout, logger)
+
+
+async def async_one_shot_job(server: AsyncClientServer, timeout: int,
+                             logger: Logger) -> bool:
+    count_threads()
+    return (await server.run("true", timeout, logger)).is_success()
+
+
+def resident_job(server: ClientServer, workers: ResidentWorkers,
+                 timeout: int, logger: Logger) -> bool:
+    count_threads()
+    worker = workers.get(server, SERVE_CMD, timeout, logger)
+    if worker is None:
+        return False
+    rs = worker.call({"command": "crawl"}, timeout, logger)
+    return not isinstance(rs, Failure)
+
+
+async def async_resident_job(server: AsyncClientServer,
+                             workers: AsyncResidentWorkers, timeout: int,
+                             logger: Logger) -> bool:
+    count_threads()
+    worker = await workers.get(server, SERVE_CMD, timeout, logger)
+    if worker is None:
+        return False
+    rs = await worker.call({"command": "crawl"}, timeout, logger)
+    return not isinstance(rs, Failure)
+
+
+def run_threads(ips: list[IPAddress], num_jobs: int, mode: str, slots: int,
+                fake_ssh: str) -> int:
+    logger = Logger("error")
+    manager = ThreadIPManager(ips, "bench", 30, logger, slots)
+    manager.pool = FakeConnectionPool(fake_ssh, logger)
+    workers = ResidentWorkers()
+    if mode == "resident":
+        items = [WorkItem(resident_job, f"Job {i}", [workers])
+                 for i in range(num_jobs)]
+    else:
+        items = [WorkItem(one_shot_job, f"Job {i}", [])
+                 for i in range(num_jobs)]
+    scheduler = PullScheduler(manager, items)
+    num_done = sum(1 for x in scheduler.run() if x.is_success)
+    workers.close()
+    manager.close()
+    return num_done
+
+
+def run_asyncio(ips: list[IPAddress], num_jobs: int, mode: str, slots: int,
+                fake_ssh: str) -> int:
+    logger = Logger("error")
+    manager = AsyncIPManager(ips, "bench", 30, logger, slots,
+                             ssh_binary=fake_ssh)
+    workers = AsyncResidentWorkers(manager)
+    if mode == "resident":
+        items = [WorkItem(resident_job, f"Job {i}", [workers],
+                          async_resident_job) for i in range(num_jobs)]
+    else:
+        items = [WorkItem(one_shot_job, f"Job {i}", [], async_one_shot_job)
+                 for i in range(num_jobs)]
+    scheduler = AsyncPullScheduler(manager, items)
+    num_done = sum(1 for x in scheduler.run() if x.is_success)
+    workers.close()
+    manager.close()
+    return num_done
+
+
+def run_benchmark(engine: Engine, mode: str, num_clients: int,
+                  args: argparse.Namespace,
+                  fake_ssh: str) -> BenchmarkResult:
+    ips: list[IPAddress] = [IPv4Address(f"10.0.{i // 256}.{i % 256}")
+                            for i in range(num_clients)]
+    num_jobs = num_clients * args.jobs
+    start_cpu = time.process_time()
+    start = time.monotonic()
+    run = run_asyncio if engine == Engine.ASYNCIO else run_threads
+    num_done = run(ips, num_jobs, mode, args.slots, fake_ssh)
+    if num_done != num_jobs:
+        print(f"{num_jobs - num_done} jobs failed", file=sys.stderr)
+    return BenchmarkResult(
+        engine.value, mode, num_clients, num_jobs,
+        time.monotonic() - start, time.process_time() - start_cpu,
+        MAX_THREADS[0],
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+
+def run_in_subprocess(engine: Engine, mode: str, num_clients: int,
+                      args: argparse.Namespace) -> BenchmarkResult:
+    # Each run gets a fresh process, so thread counts and memory use from
+    # one run don't bleed into the next.
+    cmd = [sys.executable, "-m", "benchmarks.dispatch_engines",
+           "--engine", engine.value,
+           "--mode", mode,
+           "--clients", str(num_clients),
+           "--jobs", str(args.jobs),
+           "--slots", str(args.slots),
+           "--latency", str(args.latency),
+           "--json"]
+    rs = subprocess.run(cmd, capture_output=True, check=True)
+    return BenchmarkResult(**json.loads(rs.stdout))
+
+
+def write_fake_ssh(tmp_dir: Path, latency: float) -> str:
+    fake_ssh = tmp_dir / "ssh"
+    fake_ssh.write_text(FAKE_SSH_SCRIPT.format(serve_cmd=SERVE_CMD,
+                                               latency=latency))
+    fake_ssh.chmod(0o755)
+    return str(fake_ssh)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the dispatcher engines against fake clients.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        "--clients",
+        nargs="+",
+        type=int,
+        default=[10, 50, 200],
+        help="Numbers of fake clients to benchmark with.")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=10,
+        help="Number of jobs to run per client.")
+    parser.add_argument(
+        "--slots",
+        type=int,
+        default=2,
+        help="Number of concurrent jobs to run per client.")
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.2,
+        help="Number of seconds each fake job takes.")
+    parser.add_argument(
+        "--mode",
+        nargs="+",
+        choices=MODES,
+        default=MODES,
+        help="Whether to run each job as its own SSH command (i.e., "
+             "--one-shot), or on a resident worker.")
+    parser.add_argument(
+        "--engine",
+        choices=[x.value for x in Engine],
+        help="Only run this engine, in this process.")
+    parser.add_argument(
+        "--json",
+        default=False,
+        action="store_true",
+        help="Print results as JSON.")
+    args = parser.parse_args()
+
+    if not args.engine:
+        print(HEADER)
+        for mode in args.mode:
+            for num_clients in args.clients:
+                for engine in Engine:
+                    print(run_in_subprocess(engine, mode, num_clients, args))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fake_ssh = write_fake_ssh(Path(tmp_dir), args.latency)
+        for mode in args.mode:
+            for num_clients in args.clients:
+                rs = run_benchmark(Engine(args.engine), mode, num_clients,
+                                   args, fake_ssh)
+                print(json.dumps(asdict(rs)) if args.json else rs)
+
+
+if __name__ == "__main__":
+    main()
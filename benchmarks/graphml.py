@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+
+# Writes synthetic graphs, shaped like the GraphML PageGraph writes (every
+# node before any edge, and the node and edge types, and frame ids, that
+# queries use), so the query engine can be measured offline, at any size.
+# Graphs are written as they're generated, so a multi-gigabyte graph never
+# needs more than a few megabytes of memory. Along with each graph, its
+# sizes, and what it was generated to contain in each child frame, are
+# written to a file next to it (see GraphInfo). PageGraph's names are
+# spelled out here, rather than imported from pgcrawl.client.queries, so
+# that what's generated doesn't depend on what the queries expect.
+#
+# Run from the root of the repo as:
+#   python3 -m benchmarks.graphml --nodes 1000000 --frames 50 \
+#       --requests 100000 --js-calls 500000 -o graph.graphml.gz
+
+import argparse
+from dataclasses import asdict, dataclass
+import json
+from pathlib import Path
+import random
+from typing import IO, Iterator, Optional
+
+from pgcrawl.client.compression import Codec, DEFAULT_COMPRESS_LEVEL
+from pgcrawl.types import JSONDict
+
+
+EXPECTED_SUFFIX = ".expected.json"
+# Number of elements to write at once
+WRITE_BATCH_SIZE = 4096
+
+HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<graphml xmlns="http://graphml.graphdrawing.org/xmlns" \
+xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" \
+xsi:schemaLocation="http://graphml.graphdrawing.org/xmlns \
+http://graphml.graphdrawing.org/xmlns/1.0/graphml.xsd">
+"""
+GRAPH_START = "<graph id=\"G\" edgedefault=\"directed\">\n"
+FOOTER = "</graph>\n</graphml>\n"
+
+NODE_TYPE_ATTR = "node type"
+EDGE_TYPE_ATTR = "edge type"
+FRAME_ID_ATTR = "frame id"
+
+# (key id, what it's for, attribute name)
+KEYS = [
+    ("d0", "node", NODE_TYPE_ATTR),
+    ("d1", "node", FRAME_ID_ATTR),
+    ("d2", "node", "tag name"),
+    ("d3", "node", "url"),
+    ("d4", "node", "method"),
+    ("d5", "edge", EDGE_TYPE_ATTR),
+    ("d6", "edge", FRAME_ID_ATTR),
+    ("d7", "edge", "args"),
+    ("d8", "edge", "request id"),
+]
+
+DOM_ROOT_TYPE = "DOM root"
+FRAME_OWNER_TYPE = "frame owner"
+HTML_ELEMENT_TYPE = "HTML element"
+TEXT_NODE_TYPE = "text node"
+SCRIPT_TYPE = "script"
+RESOURCE_TYPE = "resource"
+BUILTIN_TYPE = "JS builtin"
+# Types of the nodes that aren't DOM roots or iframes, and how often each
+# appears.
+NODE_WEIGHTS = {
+    HTML_ELEMENT_TYPE: 50,
+    TEXT_NODE_TYPE: 20,
+    SCRIPT_TYPE: 10,
+    RESOURCE_TYPE: 10,
+    BUILTIN_TYPE: 10,
+}
+TAG_NAMES = ["div", "span", "a", "img", "p", "li", "script", "link"]
+BUILTINS = ["Document.createElement", "Node.appendChild", "fetch",
+            "Storage.getItem", "Date.now", "Math.random"]
+CROSS_DOM_EDGE = "cross DOM"
+CREATE_NODE_EDGE = "create node"
+INSERT_NODE_EDGE = "insert node"
+REQUEST_START_EDGE = "request start"
+JS_CALL_EDGE = "js call"
+
+
+# What a child frame was generated to contain
+@dataclass
+class FrameContents:
+    requests: int = 0
+    js_calls: int = 0
+    # Elements (including iframes) created in the frame, and inserted into
+    # its document
+    elements: int = 0
+
+
+@dataclass
+class GraphSpec:
+    nodes: int
+    frames: int
+    requests: int
+    js_calls: int
+    seed: int = 0
+
+    def scaled(self, scale: float) -> "GraphSpec":
+        # Scales everything but the number of frames.
+        return GraphSpec(max(int(self.nodes * scale), self.frames * 2),
+                         self.frames, int(self.requests * scale),
+                         int(self.js_calls * scale), self.seed)
+
+
+# What's recorded next to each graph
+@dataclass
+class GraphInfo:
+    spec: GraphSpec
+    raw_bytes: int
+    graph_bytes: int
+    # What each child frame contains, keyed by the id of its DOM root, as
+    # {"requests": ..., "js": ..., "html": ...}
+    expected: JSONDict
+
+
+def frame_id(frame: int) -> str:
+    return f"{frame + 1:032X}"
+
+
+def root_id(frame: int) -> str:
+    return f"n{frame}"
+
+
+def iframe_id(frames: int, subframe: int) -> str:
+    # Each subframe is embedded by an <iframe> element in an earlier frame,
+    # and those elements come right after the DOM roots.
+    return f"n{frames + subframe - 1}"
+
+
+def data(key: str, value: str) -> str:
+    return f"<data key=\"{key}\">{value}</data>"
+
+
+# The nodes of a graph (other than its DOM roots and iframes), in order,
+# as (id, type, frame). Since it's the same for the same spec, it's
+# generated again for the edges, instead of being kept.
+def plan_nodes(spec: GraphSpec) -> Iterator[tuple[str, str, int]]:
+    rng = random.Random(spec.seed)
+    types = list(NODE_WEIGHTS)
+    weights = list(NODE_WEIGHTS.values())
+    first = spec.frames * 2 - 1
+    for index in range(first, spec.nodes):
+        node_type = rng.choices(types, weights)[0]
+        yield f"n{index}", node_type, rng.randrange(spec.frames)
+
+
+def parent_frame(spec: GraphSpec, subframe: int) -> int:
+    return random.Random(spec.seed + subframe).randrange(subframe)
+
+
+def node_elements(spec: GraphSpec, rng: random.Random) -> Iterator[str]:
+    for frame in range(spec.frames):
+        yield (f"<node id=\"{root_id(frame)}\">{data('d0', DOM_ROOT_TYPE)}"
+               f"{data('d1', frame_id(frame))}</node>\n")
+    for subframe in range(1, spec.frames):
+        parent = parent_frame(spec, subframe)
+        yield (f"<node id=\"{iframe_id(spec.frames, subframe)}\">"
+               f"{data('d0', FRAME_OWNER_TYPE)}"
+               f"{data('d1', frame_id(parent))}{data('d2', 'iframe')}"
+               "</node>\n")
+    for node_id, node_type, frame in plan_nodes(spec):
+        extra = ""
+        if node_type == HTML_ELEMENT_TYPE:
+            extra = data("d2", rng.choice(TAG_NAMES))
+        elif node_type == RESOURCE_TYPE:
+            url = f"https://cdn{rng.randrange(100)}.example/{node_id}.js"
+            extra = data("d3", url) + data("d4", "GET")
+        elif node_type == BUILTIN_TYPE:
+            extra = data("d3", rng.choice(BUILTINS))
+        yield (f"<node id=\"{node_id}\">{data('d0', node_type)}"
+               f"{data('d1', frame_id(frame))}{extra}</node>\n")
+
+
+def edge_elements(spec: GraphSpec, rng: random.Random,
+                  contents: list[FrameContents]) -> Iterator[str]:
+    # Also tallies what's generated in each frame.
+    edge_index = 0
+
+    def edge(source: str, target: str, edge_type: str,
+             frame: int | None, extra: str = "") -> str:
+        nonlocal edge_index
+        edge_index += 1
+        frame_data = data("d6", frame_id(frame)) if frame is not None else ""
+        return (f"<edge id=\"e{edge_index}\" source=\"{source}\" "
+                f"target=\"{target}\">{data('d5', edge_type)}{frame_data}"
+                f"{extra}</edge>\n")
+
+    for subframe in range(1, spec.frames):
+        parent = parent_frame(spec, subframe)
+        contents[parent].elements += 1
+        node_id = iframe_id(spec.frames, subframe)
+        yield edge(root_id(parent), node_id, CREATE_NODE_EDGE, parent)
+        yield edge(root_id(parent), node_id, INSERT_NODE_EDGE, parent)
+        yield edge(node_id, root_id(subframe), CROSS_DOM_EDGE, None)
+
+    for node_id, node_type, frame in plan_nodes(spec):
+        if node_type != HTML_ELEMENT_TYPE:
+            continue
+        contents[frame].elements += 1
+        yield edge(root_id(frame), node_id, CREATE_NODE_EDGE, frame)
+        yield edge(root_id(frame), node_id, INSERT_NODE_EDGE, frame)
+
+    for request in range(spec.requests):
+        frame = rng.randrange(spec.frames)
+        contents[frame].requests += 1
+        yield edge(root_id(frame), root_id(frame), REQUEST_START_EDGE, frame,
+                   data("d8", str(request)))
+
+    for _ in range(spec.js_calls):
+        frame = rng.randrange(spec.frames)
+        contents[frame].js_calls += 1
+        args = ", ".join(str(rng.randrange(1 << 16))
+                         for _ in range(rng.randrange(4)))
+        yield edge(root_id(frame), root_id(frame), JS_CALL_EDGE, frame,
+                   data("d7", f"[{args}]"))
+
+
+def write_elements(elements: Iterator[str], out: IO[bytes]) -> int:
+    # Returns the number of (uncompressed) bytes written.
+    size = 0
+    batch = []
+    for element in elements:
+        batch.append(element)
+        if len(batch) == WRITE_BATCH_SIZE:
+            size += out.write("".join(batch).encode("utf8"))
+            batch = []
+    return size + out.write("".join(batch).encode("utf8"))
+
+
+def write_graph(spec: GraphSpec, out: IO[bytes]) -> tuple[JSONDict, int]:
+    # Returns what each child frame was generated to contain (see
+    # GraphInfo), and the size of the graph, uncompressed.
+    if spec.frames < 1 or spec.nodes < spec.frames * 2:
+        raise ValueError("Graphs need at least two nodes per frame")
+    rng = random.Random(spec.seed)
+    keys = "".join(
+        f"<key id=\"{key_id}\" for=\"{target}\" attr.name=\"{name}\" "
+        "attr.type=\"string\"/>\n" for key_id, target, name in KEYS)
+    size = write_elements(iter([HEADER, keys, GRAPH_START]), out)
+    size += write_elements(node_elements(spec, rng), out)
+    contents = [FrameContents() for _ in range(spec.frames)]
+    size += write_elements(edge_elements(spec, rng, contents), out)
+    size += write_elements(iter([FOOTER]), out)
+    expected = {root_id(x): {"requests": contents[x].requests,
+                             "js": contents[x].js_calls,
+                             "html": contents[x].elements}
+                for x in range(1, spec.frames)}
+    return expected, size
+
+
+def expected_path(path: Path) -> Path:
+    return path.with_name(path.name + EXPECTED_SUFFIX)
+
+
+def generate(spec: GraphSpec, path: Path, codec: Codec,
+             level: int = DEFAULT_COMPRESS_LEVEL) -> GraphInfo:
+    with codec.open_writer(path, level) as out:
+        expected, size = write_graph(spec, out)
+    info = GraphInfo(spec, size, path.stat().st_size, expected)
+    expected_path(path).write_text(json.dumps(asdict(info)), "utf8")
+    return info
+
+
+def read_info(path: Path) -> Optional[GraphInfo]:
+    # What was recorded about a graph when it was generated, if it was.
+    try:
+        info = json.loads(expected_path(path).read_text("utf8"))
+    except FileNotFoundError:
+        return None
+    info["spec"] = GraphSpec(**info["spec"])
+    return GraphInfo(**info)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Write a synthetic PageGraph graph.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        "--nodes",
+        type=int,
+        default=100_000,
+        help="Number of nodes in the graph.")
+    parser.add_argument(
+        "--frames",
+        type=int,
+        default=20,
+        help="Number of frames in the page (including the main frame).")
+    parser.add_argument(
+        "--requests",
+        type=int,
+        default=10_000,
+        help="Number of requests the page makes.")
+    parser.add_argument(
+        "--js-calls",
+        type=int,
+        default=50_000,
+        help="Number of calls the page's scripts make to JS builtins.")
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed for everything random about the graph.")
+    parser.add_argument(
+        "--codec",
+        choices=[x.value for x in Codec],
+        default=Codec.NONE.value,
+        help="How to compress the graph.")
+    parser.add_argument(
+        "-o", "--output",
+        required=True,
+        help="Path to write the graph to.")
+    args = parser.parse_args()
+    spec = GraphSpec(args.nodes, args.frames, args.requests, args.js_calls,
+                     args.seed)
+    generate(spec, Path(args.output), Codec(args.codec))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+
+# Measures the query path (i.e., what `client.py query` runs for each
+# domain, from reading the graph out of storage to the results), on
+# synthetic graphs (see benchmarks/graphml.py) of growing sizes. Each graph
+# is queried in a fresh process, so its peak memory use is its own, and
+# every result is checked against what the graph was generated to contain.
+# That only checks the engine holds up at scale; tests/test_queries.py
+# checks it against pagegraph-query.
+#
+# Run from the root of the repo as:
+#   python3 -m benchmarks.query_graphs --nodes 1000000 --frames 50 \
+#       --scales 1 4 16 --output bench.json
+#
+# and compare the results of two commits with:
+#   python3 -m benchmarks.query_graphs --compare old.json new.json
+
+import argparse
+from dataclasses import asdict, dataclass
+import json
+import os
+from pathlib import Path
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any
+
+from benchmarks.graphml import GraphInfo, GraphSpec, generate, read_info
+from benchmarks.reports import compare_reports, write_report
+from pgcrawl.client.actions import UrlRequest, graph_key, run_queries
+from pgcrawl.client.compression import Codec, DEFAULT_COMPRESS_LEVEL
+from pgcrawl.logging import Logger
+from pgcrawl.storage import open_storage
+
+
+REQUEST = UrlRequest("https://bench.test", 1)
+MB = 1 << 20
+
+
+@dataclass
+class BenchmarkResult:
+    # pylint: disable=too-many-instance-attributes
+    scale: float
+    nodes: int
+    frames: int
+    requests: int
+    js_calls: int
+    codec: str
+    raw_mb: float
+    graph_mb: float
+    # Median seconds to query the graph, over every repeat
+    secs: float
+    # Uncompressed megabytes of graph queried per second
+    mb_per_sec: float
+    ms_per_frame: float
+    # Memory used before the graph is queried (i.e., by the interpreter
+    # and imports), and at most while it is.
+    baseline_rss_mb: float
+    max_rss_mb: float
+    correct: bool
+
+    def __str__(self) -> str:
+        return (f"{self.scale:>6g} {self.nodes:>10} {self.raw_mb:>9.1f} "
+                f"{self.graph_mb:>9.1f} {self.secs:>9.2f} "
+                f"{self.mb_per_sec:>8.1f} {self.ms_per_frame:>9.2f} "
+                f"{self.baseline_rss_mb:>8.1f} {self.max_rss_mb:>8.1f} "
+                f"{'yes' if self.correct else 'NO':>7}")
+
+
+HEADER = (f"{'scale':>6} {'nodes':>10} {'raw (mb)':>9} {'file (mb)':>9} "
+          f"{'secs':>9} {'mb/s':>8} {'ms/frame':>9} {'base rss':>8} "
+          f"{'max rss':>8} {'correct':>7}")
+
+
+def max_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def graph_path(graph_dir: Path, codec: Codec) -> Path:
+    return graph_dir / graph_key(REQUEST.object_name(codec))
+
+
+def prepare_graph(spec: GraphSpec, graph_dir: Path, codec: Codec,
+                  level: int) -> GraphInfo:
+    # Graphs already in graph_dir are reused, if they were generated from
+    # the same spec, since the biggest take much longer to generate than
+    # to query.
+    path = graph_path(graph_dir, codec)
+    info = read_info(path)
+    if info is not None and info.spec == spec and path.exists():
+        return info
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return generate(spec, path, codec, level)
+
+
+def run_benchmark(scale: float, graph_dir: Path, codec: Codec,
+                  repeat: int) -> BenchmarkResult:
+    info = read_info(graph_path(graph_dir, codec))
+    if info is None:
+        raise FileNotFoundError(f"No graph in {graph_dir}")
+    baseline_rss_mb = max_rss_mb()
+    storage = open_storage(graph_dir.resolve().as_uri())
+    logger = Logger("error")
+    times = []
+    correct = True
+    for _ in range(repeat):
+        start = time.monotonic()
+        results = run_queries(REQUEST, storage, codec, None, None, logger)
+        times.append(time.monotonic() - start)
+        correct = correct and results == info.expected
+    secs = statistics.median(times)
+    spec = info.spec
+    return BenchmarkResult(
+        scale, spec.nodes, spec.frames, spec.requests, spec.js_calls,
+        codec.value, info.raw_bytes / MB, info.graph_bytes / MB, secs,
+        info.raw_bytes / MB / max(secs, 1e-9),
+        secs * 1000 / spec.frames, baseline_rss_mb, max_rss_mb(), correct)
+
+
+def run_in_subprocess(scale: float, graph_dir: Path,
+                      args: argparse.Namespace) -> BenchmarkResult:
+    repo_dir = Path(__file__).resolve().parent.parent
+    cmd = [sys.executable, "-m", "benchmarks.query_graphs",
+           "--scales", str(scale),
+           "--graph-dir", str(graph_dir),
+           "--codec", args.codec,
+           "--repeat", str(args.repeat),
+           "--json"]
+    env = dict(os.environ, PYTHONPATH=str(repo_dir))
+    rs = subprocess.run(cmd, capture_output=True, check=True, env=env)
+    return BenchmarkResult(**json.loads(rs.stdout))
+
+
+def run_scales(args: argparse.Namespace, graph_dir: Path
+               ) -> list[BenchmarkResult]:
+    base_spec = GraphSpec(args.nodes, args.frames, args.requests,
+                          args.js_calls, args.seed)
+    codec = Codec(args.codec)
+    results = []
+    print(HEADER)
+    for scale in args.scales:
+        scale_dir = graph_dir / f"scale-{scale:g}"
+        prepare_graph(base_spec.scaled(scale), scale_dir, codec, args.level)
+        rs = run_in_subprocess(scale, scale_dir, args)
+        print(rs)
+        results.append(rs)
+    return results
+
+
+def report_config(args: argparse.Namespace) -> dict[str, Any]:
+    return {
+        "nodes": args.nodes,
+        "frames": args.frames,
+        "requests": args.requests,
+        "js_calls": args.js_calls,
+        "seed": args.seed,
+        "codec": args.codec,
+        "level": args.level,
+        "repeat": args.repeat,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark querying synthetic PageGraph graphs.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        "--nodes",
+        type=int,
+        default=100_000,
+        help="Number of nodes in the graph, at scale 1.")
+    parser.add_argument(
+        "--frames",
+        type=int,
+        default=20,
+        help="Number of frames in the page, at every scale.")
+    parser.add_argument(
+        "--requests",
+        type=int,
+        default=10_000,
+        help="Number of requests the page makes, at scale 1.")
+    parser.add_argument(
+        "--js-calls",
+        type=int,
+        default=50_000,
+        help="Number of calls the page's scripts make, at scale 1.")
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed for everything random about the graphs.")
+    parser.add_argument(
+        "--scales",
+        nargs="+",
+        type=float,
+        default=[1, 4, 16],
+        help="What to multiply the nodes, requests and JS calls by, for "
+             "each graph.")
+    parser.add_argument(
+        "--codec",
+        choices=[x.value for x in Codec],
+        default=Codec.GZIP.value,
+        help="How to compress the graphs.")
+    parser.add_argument(
+        "--level",
+        type=int,
+        default=DEFAULT_COMPRESS_LEVEL,
+        help="Level to compress the graphs at.")
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of times to query each graph.")
+    parser.add_argument(
+        "--graph-dir",
+        help="Directory to keep the graphs in, to reuse them in later "
+             "runs. By default, they're deleted after each run.")
+    parser.add_argument(
+        "-o", "--output",
+        help="File to write the results to, as JSON, to compare with the "
+             "results of other commits (see --compare).")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("OLD", "NEW"),
+        help="Instead of benchmarking, compare two files written by "
+             "--output.")
+    parser.add_argument(
+        "--json",
+        default=False,
+        action="store_true",
+        help="Query the graph already in --graph-dir, in this process, and "
+             "print the result as JSON.")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_reports(Path(args.compare[0]), Path(args.compare[1]),
+                        ["scale", "codec"],
+                        [("secs", "secs", 1),
+                         ("mb_per_sec", "mb/s", 1),
+                         ("max_rss_mb", "rss (mb)", 1)])
+        return
+
+    if args.json:
+        rs = run_benchmark(args.scales[0], Path(args.graph_dir),
+                           Codec(args.codec), args.repeat)
+        print(json.dumps(asdict(rs)))
+        return
+
+    if args.graph_dir:
+        results = run_scales(args, Path(args.graph_dir))
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            results = run_scales(args, Path(tmp_dir))
+    if args.output:
+        write_report(Path(args.output), report_config(args),
+                     [asdict(x) for x in results])
+
+
+if __name__ == "__main__":
+    main()
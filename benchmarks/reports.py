@@ -0,0 +1,55 @@
+# Machine readable benchmark results, so results from different commits
+# can be compared. Each report is a JSON file like
+#   {"commit": "...", "created_at": "...", "config": {...},
+#    "results": [{...}, ...]}
+
+from datetime import datetime, timezone
+import json
+from pathlib import Path
+import subprocess
+import sys
+from typing import Any, Optional
+
+
+# (name of a result field, column header, and what to multiply it by)
+Metric = tuple[str, str, float]
+
+
+def git_commit() -> Optional[str]:
+    rs = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                        check=False, cwd=Path(__file__).resolve().parent)
+    return rs.stdout.decode("utf8").strip() if rs.returncode == 0 else None
+
+
+def write_report(path: Path, config: dict[str, Any],
+                 results: list[dict[str, Any]]) -> None:
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "config": config,
+        "results": results,
+    }
+    path.write_text(json.dumps(report, indent=2) + "\n", "utf8")
+
+
+def compare_reports(old_path: Path, new_path: Path, keys: list[str],
+                    metrics: list[Metric]) -> None:
+    # Prints each metric of the new report, and how much it changed from
+    # the old one, for results with the same keys in both.
+    old, new = (json.loads(x.read_text("utf8")) for x in [old_path, new_path])
+    if old["config"] != new["config"]:
+        print("Warning: the reports were run with different configs",
+              file=sys.stderr)
+    print(f"{str(old['commit'])[:10]} -> {str(new['commit'])[:10]}")
+    print(" ".join(f"{x:>8}" for x in keys) + " "
+          + " ".join(f"{header:>18}" for _, header, _ in metrics))
+    old_results = {tuple(x[k] for k in keys): x for x in old["results"]}
+    for rs in new["results"]:
+        prev = old_results.get(tuple(rs[k] for k in keys))
+        if not prev:
+            continue
+        cols = [f"{rs[k]!s:>8}" for k in keys]
+        for name, _, scale in metrics:
+            change = rs[name] / prev[name] - 1 if prev[name] else 0.0
+            cols.append(f"{rs[name] * scale:>9.2f} ({change:>+6.1%})")
+        print(" ".join(cols))
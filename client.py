@@ -3,25 +3,56 @@
 import argparse
 import json
 import sys
+from typing import Any
 
 import pgcrawl
 from pgcrawl.client.args import DEFAULT_CRAWL_ARGS, ClientCrawlArgs
 from pgcrawl.client.args import DEFAULT_QUERY_ARGS, ClientQueryArgs
-from pgcrawl.client.commands import crawl_url, query_graph
+from pgcrawl.client.commands import crawl_url, query_batch, query_graph
+from pgcrawl.client.commands import read_batch
+from pgcrawl.client.compression import Codec
+from pgcrawl.client.outbox import DEFAULT_UPLOAD_RETRIES, Outbox
+from pgcrawl.client.outbox import DEFAULT_UPLOAD_WORKERS
+from pgcrawl.client.query_pool import default_query_workers
+from pgcrawl.client.serve import serve
+from pgcrawl.client.slots import Slot
 from pgcrawl.logging import add_logger_argument, Logger
 from pgcrawl.types import JSONDict
 
 
-def crawl_cmd(args: argparse.Namespace, logger: Logger) -> bool:
+def crawl_cmd(args: argparse.Namespace, logger: Logger) -> dict[str, Any]:
     crawl_args = ClientCrawlArgs(args.client_code_path, args.binary_path,
-                                 args.s3_bucket, args.seconds,
-                                 args.timeout)
-    return crawl_url(ARGS.url, ARGS.rank, crawl_args, logger)
+                                 args.storage, args.seconds,
+                                 args.timeout, args.codec,
+                                 args.compress_level, args.spool_logs)
+    rs = crawl_url(args.url, args.rank, crawl_args, Slot(args.slot), None,
+                   logger)
+    return rs.to_dict()
 
 
 def query_cmd(args: argparse.Namespace, logger: Logger) -> JSONDict | bool:
-    query_args = ClientQueryArgs(args.s3_bucket, args.timeout)
-    return query_graph(ARGS.url, ARGS.rank, query_args, logger)
+    query_args = ClientQueryArgs(args.storage, args.timeout, args.codec,
+                                 not args.no_cache, args.graph_cache_bytes)
+    if args.batch:
+        if args.batch == "-":
+            graphs = read_batch(sys.stdin)
+        else:
+            with open(args.batch, "r", encoding="utf8") as batch_file:
+                graphs = read_batch(batch_file)
+        return query_batch(graphs, query_args, args.workers, sys.stdout,
+                           logger)
+    if args.url is None or args.rank is None:
+        raise ValueError("--url and --rank are required without --batch")
+    return query_graph(args.url, args.rank, query_args, logger)
+
+
+def serve_cmd(args: argparse.Namespace, logger: Logger) -> bool:
+    slot = Slot(args.slot)
+    outbox = None
+    if args.upload_workers > 0:
+        outbox = Outbox(slot.outbox_dir(), args.upload_workers,
+                        args.upload_retries, logger)
+    return serve(slot, sys.stdin, sys.stdout, outbox, logger)
 
 
 PARSER = argparse.ArgumentParser(
@@ -60,9 +91,33 @@ CLIENT_CRAWL_PARSER.add_argument(
     default=DEFAULT_CRAWL_ARGS.binary_path,
     help="The binary to use when calling pagegraph-crawl.")
 CLIENT_CRAWL_PARSER.add_argument(
-    "--s3-bucket",
-    default=DEFAULT_CRAWL_ARGS.s3_bucket,
-    help="The S3 bucket to write the resulting graphs into.")
+    "--storage", "--s3-bucket",
+    default=DEFAULT_CRAWL_ARGS.storage,
+    help="Where to write the resulting graphs to, either "
+         "s3://bucket[/prefix], file:///path, or the name of an S3 bucket.")
+CLIENT_CRAWL_PARSER.add_argument(
+    "--codec",
+    choices=[x.value for x in Codec],
+    default=DEFAULT_CRAWL_ARGS.codec,
+    help="How to compress the graph before uploading it.")
+CLIENT_CRAWL_PARSER.add_argument(
+    "--compress-level",
+    type=int,
+    default=DEFAULT_CRAWL_ARGS.compress_level,
+    help="Compression level to use with --codec (higher is smaller, but "
+         "slower).")
+CLIENT_CRAWL_PARSER.add_argument(
+    "--spool-logs",
+    default=False,
+    action="store_true",
+    help="Keep the browser's full output, gzip'ed, in the workspace's "
+         "crawl-logs directory (otherwise only its tail is kept).")
+CLIENT_CRAWL_PARSER.add_argument(
+    "--slot",
+    type=int,
+    default=0,
+    help="Which of the host's concurrent crawl slots to use. Each slot has "
+         "its own display, browser profile and temp directory.")
 CLIENT_CRAWL_PARSER.add_argument(
     "--client-code-path",
     default=pgcrawl.DEFAULT_CLIENT_CODE_PATH,
@@ -76,13 +131,24 @@ QUERY_PARSER = SUBPARSERS.add_parser(
     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 QUERY_PARSER.add_argument(
     "-u", "--url",
-    required=True,
     help="The URL that was recorded using the `crawl` command.")
 QUERY_PARSER.add_argument(
     "-r", "--rank",
-    required=True,
     type=int,
     help="The Tranco rank of the site at the time the list was generated.")
+QUERY_PARSER.add_argument(
+    "--batch",
+    metavar="FILE",
+    help="Query every graph listed in FILE (or stdin, if -), one \"RANK "
+         "URL\" or \"RANK,URL\" per line, instead of --url and --rank. "
+         "Each graph's results are written as a line of JSON as soon as "
+         "it's been queried (in whatever order they finish).")
+QUERY_PARSER.add_argument(
+    "--workers",
+    type=int,
+    default=default_query_workers(),
+    help="Number of graphs to query at once with --batch, each in a "
+         "process of its own.")
 QUERY_PARSER.add_argument(
     "-t", "--timeout",
     type=int,
@@ -90,22 +156,82 @@ QUERY_PARSER.add_argument(
     help="The maxim number of seconds we'll wait before assuming a query "
          "went wrong.")
 QUERY_PARSER.add_argument(
-    "--s3-bucket",
-    default=DEFAULT_QUERY_ARGS.s3_bucket,
-    help="The S3 bucket to write the resulting graphs into.")
+    "--storage", "--s3-bucket",
+    default=DEFAULT_QUERY_ARGS.storage,
+    help="Where to read the graph from, either s3://bucket[/prefix], "
+         "file:///path, or the name of an S3 bucket.")
+QUERY_PARSER.add_argument(
+    "--codec",
+    choices=[x.value for x in Codec],
+    default=DEFAULT_QUERY_ARGS.codec,
+    help="How the graph was compressed when it was crawled. Graphs only "
+         "stored uncompressed (e.g., crawled before graphs were "
+         "compressed) are queried regardless.")
+QUERY_PARSER.add_argument(
+    "--no-cache",
+    default=False,
+    action="store_true",
+    help="Query the graph again, even if results for it (and the current "
+         "version of the queries) are already cached.")
+QUERY_PARSER.add_argument(
+    "--graph-cache-bytes",
+    type=int,
+    default=DEFAULT_QUERY_ARGS.graph_cache_bytes,
+    help="Keep up to this many bytes of downloaded graphs on the client, "
+         "evicting the least recently used, so querying them again doesn't "
+         "download them again. 0 disables the cache.")
 add_logger_argument(QUERY_PARSER)
 QUERY_PARSER.set_defaults(func=query_cmd)
 
-try:
-    ARGS = PARSER.parse_args()
-    LOGGER = Logger(ARGS.log_level)
-    RESULT = ARGS.func(ARGS, LOGGER)
-except ValueError as e:
-    print(f"Invalid argument: {e}", file=sys.stderr)
-    sys.exit(1)
+SERVE_PARSER = SUBPARSERS.add_parser(
+    "serve",
+    help="Stay resident, reading crawl and query jobs from stdin and "
+         "writing results to stdout, one JSON object per line.",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+SERVE_PARSER.add_argument(
+    "--slot",
+    type=int,
+    default=0,
+    help="Which of the host's concurrent crawl slots to use for crawl jobs.")
+SERVE_PARSER.add_argument(
+    "--upload-workers",
+    type=int,
+    default=DEFAULT_UPLOAD_WORKERS,
+    help="Number of graphs to upload to S3 at once, in the background, "
+         "while the next crawl runs. If 0, each graph is uploaded before "
+         "its crawl job returns.")
+SERVE_PARSER.add_argument(
+    "--upload-retries",
+    type=int,
+    default=DEFAULT_UPLOAD_RETRIES,
+    help="Number of times to retry a failed upload before leaving the "
+         "graph in the outbox until the next worker starts.")
+add_logger_argument(SERVE_PARSER)
+SERVE_PARSER.set_defaults(func=serve_cmd)
+
+# Query workers (see QueryPool) are started as fresh processes that import
+# this script, which then mustn't run a command of its own.
+if __name__ == "__main__":
+    try:
+        ARGS = PARSER.parse_args()
+        LOGGER = Logger(ARGS.log_level)
+        RESULT = ARGS.func(ARGS, LOGGER)
+    except ValueError as e:
+        print(f"Invalid argument: {e}", file=sys.stderr)
+        sys.exit(1)
 
-if not RESULT:
-    sys.exit(1)
-else:
-    print(json.dumps(RESULT))
-    sys.exit(0)
+    if RESULT is False:
+        sys.exit(1)
+    elif RESULT is True:
+        # Commands that either wrote their own output (e.g., query
+        # --batch) or have none.
+        sys.exit(0)
+    else:
+        # Query results are printed even if they're empty (i.e., for pages
+        # without subframes), so they aren't mistaken for failures.
+        print(json.dumps(RESULT))
+        # Crawl results are always printed, so that the dispatcher can see
+        # why a crawl failed.
+        if isinstance(RESULT, dict) and RESULT.get("success") is False:
+            sys.exit(1)
+        sys.exit(0)
@@ -28,6 +28,12 @@ if not PG_CRAWL_SETUP.check_for_brave_binary(ARGS.binary, LOGGER):
     if not PG_CRAWL_SETUP.install_brave_binary(LOGGER):
         sys.exit(1)
 
+if not PG_CRAWL_SETUP.check_for_profile_template(LOGGER):
+    BINARY_PATH = ARGS.binary or pgcrawl.DEFAULT_CLIENT_BINARY_PATH
+    # Crawls still work without the template, just more slowly.
+    if not PG_CRAWL_SETUP.seed_profile_template(BINARY_PATH, LOGGER):
+        LOGGER.error("Unable to create a browser profile template")
+
 if not PG_CRAWL_SETUP.check_for_pagegraph_crawl(LOGGER):
     if not PG_CRAWL_SETUP.clone_brave_crawl(LOGGER):
         sys.exit(1)
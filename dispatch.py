@@ -2,13 +2,24 @@
 
 import argparse
 import ipaddress
+from pathlib import Path
 import sys
 
 from pgcrawl import DEFAULT_CLIENT_CODE_PATH, NAME
 from pgcrawl.client.args import ClientCrawlArgs, DEFAULT_CRAWL_ARGS
+from pgcrawl.client.args import ClientQueryArgs, DEFAULT_QUERY_ARGS
+from pgcrawl.client.compression import Codec
+from pgcrawl.dispatch.args import DEFAULT_DISPATCH_CRAWL_ARGS
+from pgcrawl.dispatch.args import DispatchCrawlArgs
+from pgcrawl.dispatch.args import DEFAULT_DISPATCH_QUERY_ARGS
+from pgcrawl.dispatch.args import DispatchQueryArgs
 from pgcrawl.dispatch.commands import Action, client_setup, client_crawl
+from pgcrawl.dispatch.commands import client_query, crawl_timings
+from pgcrawl.dispatch.retries import parse_retry_policy, retry_policies
+from pgcrawl.dispatch.store import State
 from pgcrawl.logging import add_logger_argument, Logger
-from pgcrawl.types import IPAddress, UserName
+from pgcrawl.results import Failure
+from pgcrawl.types import Engine, IPAddress, UserName
 
 
 def client_setup_cmd(args: argparse.Namespace, ips: list[IPAddress]) -> None:
@@ -28,18 +39,45 @@ def client_setup_cmd(args: argparse.Namespace, ips: list[IPAddress]) -> None:
     if args.full_setup:
         actions.append(Action.ALL)
     return client_setup(actions, ips, args.user, args.client_code_path,
-                        args.timeout, Logger(args.log_level))
+                        args.timeout, Logger(args.log_level),
+                        Engine(args.engine))
 
 
 def crawl_cmd(args: argparse.Namespace, ips: list[IPAddress]) -> None:
     client_crawl_args = ClientCrawlArgs(ARGS.client_code_path,
-        ARGS.binary_path, ARGS.s3_bucket, ARGS.pagegraph_secs,
-        ARGS.client_timeout)
+        ARGS.binary_path, ARGS.storage, ARGS.pagegraph_secs,
+        ARGS.client_timeout, ARGS.codec, ARGS.compress_level,
+        ARGS.spool_logs)
+    dispatch_args = DispatchCrawlArgs(args.slots, not args.one_shot,
+                                      args.resume, args.lease_secs,
+                                      args.timeout,
+                                      retry_policies(args.retry),
+                                      Engine(args.engine), not args.silent,
+                                      args.metrics_port)
     if args.limit != 0 and args.limit < len(ips):
         ips = ips[:args.limit]
+    # --silent drops the live status view, along with everything but
+    # errors.
+    log_level = "error" if args.silent else args.log_level
     return client_crawl(ips, args.user, args.summarize, args.limit,
-                        client_crawl_args, ARGS.timeout,
-                        Logger(args.log_level))
+                        dispatch_args, client_crawl_args, Logger(log_level))
+
+
+def query_cmd(args: argparse.Namespace, ips: list[IPAddress]) -> None:
+    client_query_args = ClientQueryArgs(args.storage, args.client_timeout,
+                                        args.codec, not args.no_cache,
+                                        args.graph_cache_bytes)
+    dispatch_args = DispatchQueryArgs(args.slots, not args.one_shot,
+                                      args.timeout, Path(args.output),
+                                      Engine(args.engine))
+    return client_query(ips, args.user, args.summarize, args.limit,
+                        dispatch_args, args.client_code_path,
+                        client_query_args, Logger(args.log_level))
+
+
+def timings_cmd(args: argparse.Namespace, _: list[IPAddress]) -> None:
+    state = State(args.state) if args.state != "all" else None
+    return crawl_timings(args.hours, state, Logger(args.log_level))
 
 
 PARSER = argparse.ArgumentParser(
@@ -112,6 +150,14 @@ CLIENT_SETUP_PARSER.add_argument(
     default=120,
     type=int,
     help="Maximum number of seconds to wait on a client to do anything.")
+CLIENT_SETUP_PARSER.add_argument(
+    "--engine",
+    default=Engine.THREADS.value,
+    choices=[x.value for x in Engine],
+    help="How to run commands on clients: with one thread and fabric "
+         "connection per client slot, or with every SSH session (through "
+         "the system ssh binary) multiplexed on one asyncio event loop, "
+         "which scales better to many clients.")
 add_logger_argument(CLIENT_SETUP_PARSER)
 CLIENT_SETUP_PARSER.set_defaults(func=client_setup_cmd)
 
@@ -140,14 +186,44 @@ CRAWL_PARSER.add_argument(
     type=int,
     help="Number of URLs to crawl (over all the IP addresses given.) If 0, "
          "then crawl without limit until all URLs are crawled.")
+CRAWL_PARSER.add_argument(
+    "--slots",
+    default=DEFAULT_DISPATCH_CRAWL_ARGS.slots,
+    type=int,
+    help="Number of concurrent crawls to run on each client.")
+CRAWL_PARSER.add_argument(
+    "--one-shot",
+    default=False,
+    action="store_true",
+    help="Start a new client.py process for every crawl, instead of keeping "
+         "a resident `client.py serve` process running for each slot.")
 CRAWL_PARSER.add_argument(
     "--binary-path", "-b",
     default=DEFAULT_CRAWL_ARGS.binary_path,
     help="Path to the PageGraph enabled Brave binary for pagegraph-crawl.")
 CRAWL_PARSER.add_argument(
-    "--s3-bucket",
-    default=DEFAULT_CRAWL_ARGS.s3_bucket,
-    help="The S3 bucket to write the resulting graphs into.")
+    "--storage", "--s3-bucket",
+    default=DEFAULT_CRAWL_ARGS.storage,
+    help="Where clients should write the resulting graphs to, either "
+         "s3://bucket[/prefix], file:///path (on each client), or the name "
+         "of an S3 bucket.")
+CRAWL_PARSER.add_argument(
+    "--codec",
+    choices=[x.value for x in Codec],
+    default=DEFAULT_CRAWL_ARGS.codec,
+    help="How clients should compress graphs before uploading them.")
+CRAWL_PARSER.add_argument(
+    "--compress-level",
+    type=int,
+    default=DEFAULT_CRAWL_ARGS.compress_level,
+    help="Compression level to use with --codec (higher is smaller, but "
+         "slower).")
+CRAWL_PARSER.add_argument(
+    "--spool-logs",
+    default=False,
+    action="store_true",
+    help="Have clients keep the browser's full output for every crawl, "
+         "gzip'ed (otherwise only its tail is kept).")
 CRAWL_PARSER.add_argument(
     "--pagegraph-secs",
     type=int,
@@ -164,20 +240,59 @@ CRAWL_PARSER.add_argument(
     help="Maximum number of seconds to wait on the client before quitting.")
 CRAWL_PARSER.add_argument(
     "--timeout",
-    default=DEFAULT_CRAWL_ARGS.timeout + 20,
+    default=DEFAULT_DISPATCH_CRAWL_ARGS.timeout,
     type=int,
     help="Maximum number of seconds overall to wait before quitting.")
+CRAWL_PARSER.add_argument(
+    "--resume",
+    default=False,
+    action="store_true",
+    help="Re-queue domains left underway by an earlier crawl that did not "
+         "finish (e.g., because the dispatcher crashed), and domains whose "
+         "uploads were never confirmed, before crawling.")
+CRAWL_PARSER.add_argument(
+    "--lease-secs",
+    default=DEFAULT_DISPATCH_CRAWL_ARGS.lease_secs,
+    type=int,
+    help="Number of seconds a domain stays leased to a client without the "
+         "lease being renewed. Leases are renewed while the crawl runs.")
+CRAWL_PARSER.add_argument(
+    "--engine",
+    default=Engine.THREADS.value,
+    choices=[x.value for x in Engine],
+    help="How to run commands on clients: with one thread and fabric "
+         "connection per client slot, or with every SSH session (through "
+         "the system ssh binary) multiplexed on one asyncio event loop, "
+         "which scales better to many clients.")
+CRAWL_PARSER.add_argument(
+    "--retry",
+    default=[],
+    action="append",
+    type=parse_retry_policy,
+    metavar="FAILURE=RETRIES[:BACKOFF[:EXTRA_SECS]]",
+    help="How to retry domains that fail in a given way, e.g., ssh=3:30 "
+         "retries SSH failures 3 times, waiting 30s, then 60s, then 120s, "
+         "and browser-timeout=1:0:10 retries browser timeouts once, with "
+         "10 more --pagegraph-secs. Can be given more than once. Failures "
+         "are: " + ", ".join(x.value for x in Failure) + ".")
+CRAWL_PARSER.add_argument(
+    "--metrics-port",
+    default=DEFAULT_DISPATCH_CRAWL_ARGS.metrics_port,
+    type=int,
+    help="If given, serve metrics about the crawl (in the Prometheus text "
+         "format) at http://127.0.0.1:PORT/metrics while it runs.")
 add_logger_argument(CRAWL_PARSER)
 CRAWL_PARSER.add_argument(
     "--silent",
     default=False,
     action="store_true",
-    help="Suppress all messages and logging.")
+    help="Suppress all messages and logging (other than errors), including "
+         "the live status view of the crawl's progress.")
 CRAWL_PARSER.set_defaults(func=crawl_cmd)
 
 QUERY_PARSER = SUBPARSERS.add_parser(
     "query",
-    help="Query a graph using pagegraph-query.",
+    help="Query the graphs of every crawled domain, using child servers.",
     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 QUERY_PARSER.add_argument(
     "ip",
@@ -194,10 +309,102 @@ QUERY_PARSER.add_argument(
     type=int,
     help="Number of graphs to query (over all the IP addresses given.) If 0, "
          "then crawl without limit until all graphs are queried.")
+QUERY_PARSER.add_argument(
+    "-s", "--summarize",
+    default=False,
+    action="store_true",
+    help="If passed, then don't query anything, but summarize what would "
+         "be done.")
+QUERY_PARSER.add_argument(
+    "-o", "--output",
+    default=str(DEFAULT_DISPATCH_QUERY_ARGS.output_path),
+    help="File to append each domain's results to, as one JSON object per "
+         "line, along with the format of the results. Domains that already "
+         "have results of the current format in it are skipped, so an "
+         "interrupted run can be resumed by running it again.")
+QUERY_PARSER.add_argument(
+    "--slots",
+    default=DEFAULT_DISPATCH_QUERY_ARGS.slots,
+    type=int,
+    help="Number of concurrent queries to run on each client.")
+QUERY_PARSER.add_argument(
+    "--one-shot",
+    default=False,
+    action="store_true",
+    help="Start a new client.py process for every query, instead of keeping "
+         "a resident `client.py serve` process running for each slot.")
+QUERY_PARSER.add_argument(
+    "--storage", "--s3-bucket",
+    default=DEFAULT_QUERY_ARGS.storage,
+    help="Where clients should read graphs from, either "
+         "s3://bucket[/prefix], file:///path (on each client), or the name "
+         "of an S3 bucket.")
+QUERY_PARSER.add_argument(
+    "--codec",
+    choices=[x.value for x in Codec],
+    default=DEFAULT_QUERY_ARGS.codec,
+    help="How the graphs were compressed when they were crawled. Graphs "
+         "only stored uncompressed (e.g., crawled before graphs were "
+         "compressed) are queried regardless.")
+QUERY_PARSER.add_argument(
+    "--no-cache",
+    default=False,
+    action="store_true",
+    help="Have clients query graphs again, even if results for them are "
+         "already cached.")
+QUERY_PARSER.add_argument(
+    "--graph-cache-bytes",
+    type=int,
+    default=DEFAULT_QUERY_ARGS.graph_cache_bytes,
+    help="Most bytes of downloaded graphs each client keeps, so querying "
+         "them again doesn't download them again. 0 disables the cache.")
+QUERY_PARSER.add_argument(
+    "--client-code-path",
+    default=DEFAULT_CLIENT_CODE_PATH,
+    help="Path to pagegraph-tranco-crawl code on the client.")
+QUERY_PARSER.add_argument(
+    "--client-timeout",
+    default=DEFAULT_QUERY_ARGS.timeout,
+    type=int,
+    help="Maximum number of seconds a client spends on a query.")
+QUERY_PARSER.add_argument(
+    "--timeout",
+    default=DEFAULT_DISPATCH_QUERY_ARGS.timeout,
+    type=int,
+    help="Maximum number of seconds to wait on a client to return a "
+         "query's results.")
+QUERY_PARSER.add_argument(
+    "--engine",
+    default=Engine.THREADS.value,
+    choices=[x.value for x in Engine],
+    help="How to run commands on clients: with one thread and fabric "
+         "connection per client slot, or with every SSH session (through "
+         "the system ssh binary) multiplexed on one asyncio event loop, "
+         "which scales better to many clients.")
+add_logger_argument(QUERY_PARSER)
+QUERY_PARSER.set_defaults(func=query_cmd)
+
+TIMINGS_PARSER = SUBPARSERS.add_parser(
+    "timings",
+    help="Summarize how long each phase of recent crawls took.",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+TIMINGS_PARSER.add_argument(
+    "--hours",
+    default=0,
+    type=float,
+    help="Only summarize crawls attempted in this many past hours. If 0, "
+         "then summarize every crawl with recorded timings.")
+TIMINGS_PARSER.add_argument(
+    "--state",
+    default="all",
+    choices=["all", State.DONE.value, State.ERROR.value],
+    help="Only summarize crawls that ended up in this state.")
+add_logger_argument(TIMINGS_PARSER)
+TIMINGS_PARSER.set_defaults(func=timings_cmd)
 
 try:
     ARGS = PARSER.parse_args()
-    IPS = [ipaddress.ip_address(x) for x in ARGS.ip]
+    IPS = [ipaddress.ip_address(x) for x in getattr(ARGS, "ip", [])]
     RESULT = ARGS.func(ARGS, IPS)
 except ValueError as e:
     print(f"Invalid argument: {e}", file=sys.stderr)
@@ -1,14 +1,19 @@
 #!/usr/bin/env python3
 
-# Script to populate the work tracking files in work-status, from
+# Script to populate the work tracking database in the workspace, from
 # a given tranco file.
 
 import argparse
-import csv
-import datetime
+from itertools import islice
+from pathlib import Path
+import sys
 
 import pgcrawl
-from pgcrawl.dispatch import ALL_DIRS, TODO_DIR
+from pgcrawl.dispatch import ALL_DIRS, WORK_DB_PATH
+from pgcrawl.dispatch import TODO_DIR, UNDERWAY_DIR, DONE_DIR, ERROR_DIR
+from pgcrawl.dispatch.store import State, WorkStore
+from pgcrawl.dispatch.tranco import import_tranco, open_tranco_file
+from pgcrawl.dispatch.tranco import read_tranco
 from pgcrawl.setup import mkdirs
 from pgcrawl.logging import add_logger_argument, Logger
 
@@ -20,28 +25,80 @@ PARSER = argparse.ArgumentParser(
     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 PARSER.add_argument(
     "filename",
-    help="Path to a version of a Tranco CSV (see https://tranco-list.eu/)")
+    nargs="?",
+    help="Path to a version of a Tranco CSV (see https://tranco-list.eu/), "
+         "which can also be gzip'ed or a zip archive.")
 PARSER.add_argument(
     "--num", "-n",
     type=int,
     default=15_000,
-    help="Number of entries from the given file to write to into the queue.")
+    help="Number of entries from the given file to write to into the queue. "
+         "If 0, then write every entry.")
+PARSER.add_argument(
+    "--from-rank",
+    type=int,
+    default=1,
+    help="Only write entries with at least this rank.")
+PARSER.add_argument(
+    "--to-rank",
+    type=int,
+    default=None,
+    help="Only write entries with at most this rank.")
+PARSER.add_argument(
+    "--sample",
+    type=float,
+    default=1.0,
+    help="Fraction of entries (between 0 and 1) to write, chosen at random "
+         "from the given ranks.")
+PARSER.add_argument(
+    "--seed",
+    type=int,
+    default=None,
+    help="Seed to use when sampling entries, so the same sample can be "
+         "drawn again.")
+PARSER.add_argument(
+    "--import-workspace",
+    default=False,
+    action="store_true",
+    help="Import the state of a workspace that tracks work with one file "
+         "per domain (in todo/, underway/, done/ and error/) into the "
+         "work database.")
 add_logger_argument(PARSER)
 
 
 ARGS = PARSER.parse_args()
 LOGGER = Logger(ARGS.log_level)
 
-mkdirs(ALL_DIRS, ARGS.quiet)
-
-with open(ARGS.filename, 'r', encoding="utf8") as csvfile:
-    reader = csv.reader(csvfile)
-    INDEX = 1
-    for (rank, domain) in reader:
-        file_name = f"{rank}_{domain}"
-        dest_file = TODO_DIR / file_name
-        dest_file.write_text(str(datetime.datetime.now()))
-        LOGGER.info(f"{INDEX} / {ARGS.num}: Wrote {dest_file}")
-        INDEX += 1
-        if INDEX > ARGS.num:
-            break
+if not ARGS.filename and not ARGS.import_workspace:
+    print("One of `filename` or --import-workspace is required.",
+          file=sys.stderr)
+    sys.exit(1)
+
+if not 0 < ARGS.sample <= 1:
+    print("--sample must be greater than 0 and at most 1.", file=sys.stderr)
+    sys.exit(1)
+
+mkdirs(ALL_DIRS, LOGGER)
+STORE = WorkStore(WORK_DB_PATH)
+
+if ARGS.import_workspace:
+    # Domains that were underway when the old workspace was abandoned were
+    # never recorded as finished, so they need to be crawled again.
+    for (import_dir, state) in [(DONE_DIR, State.DONE),
+                                (ERROR_DIR, State.ERROR),
+                                (UNDERWAY_DIR, State.TODO),
+                                (TODO_DIR, State.TODO)]:
+        NUM_IMPORTED = STORE.import_dir(import_dir, state)
+        LOGGER.info(f"Imported {NUM_IMPORTED} domains from {import_dir} "
+                    f"as {state.value}")
+
+if ARGS.filename:
+    with open_tranco_file(Path(ARGS.filename)) as csvfile:
+        records = read_tranco(csvfile, ARGS.from_rank, ARGS.to_rank,
+                              ARGS.sample, ARGS.seed)
+        if ARGS.num:
+            records = islice(records, ARGS.num)
+        import_tranco(STORE, records, LOGGER)
+        LOGGER.info(f"Wrote domains to {WORK_DB_PATH}")
+
+STORE.close()
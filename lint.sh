@@ -1,6 +1,6 @@
 #!/usr/bin/env bash
 
-LOCAL_SCRIPTS="client_setup.py dispatch_setup.py client.py dispatch.py pgcrawl/*.py pgcrawl/**/*.py"
+LOCAL_SCRIPTS="client_setup.py dispatch_setup.py client.py dispatch.py pgcrawl/*.py pgcrawl/**/*.py benchmarks/*.py tests/*.py"
 
 pylint $LOCAL_SCRIPTS
 mypy --strict $LOCAL_SCRIPTS
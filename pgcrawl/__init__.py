@@ -5,6 +5,7 @@ DEFAULT_CLIENT_BINARY_PATH = (
     "/opt/brave.com/brave-nightly/brave-browser-nightly")
 DEFAULT_CLIENT_CODE_PATH = "/home/ubuntu/pagegraph-tranco-crawl"
 DEFAULT_S3_BUCKET = "brave-research-crawling"
+DEFAULT_STORAGE = f"s3://{DEFAULT_S3_BUCKET}"
 
 NAME = "pagegraph-tranco-crawl"
 GIT_URL = "git@github.com:brave-experiments/pagegraph-tranco-crawl.git"
@@ -0,0 +1,365 @@
+import asyncio
+from asyncio.subprocess import Process
+from collections import deque
+from dataclasses import dataclass
+import os
+from pathlib import Path
+import shutil
+import sys
+import tempfile
+import time
+from typing import Iterable, Iterator, Optional
+
+from pgcrawl.connections import ConnectionPool
+from pgcrawl.logging import Logger
+from pgcrawl.metrics import DispatchMetrics
+from pgcrawl.results import Failure
+from pgcrawl.scheduler import DEFAULT_RESPONSE_WINDOW
+from pgcrawl.status import RunStatus
+from pgcrawl.subprocesses import SSHResult
+from pgcrawl.types import ClientServer, IPAddress, UserName, WorkItem
+from pgcrawl.types import WorkOutcome, WorkResponse
+
+
+# ssh exits with this code when it fails itself, instead of returning the
+# exit code of the remote command.
+SSH_ERROR_EXIT_CODE = 255
+# How long the shared (i.e., ControlMaster) connection to each client is
+# kept open after the last session on it ends.
+CONTROL_PERSIST_SECS = 60
+# Maximum number of seconds to wait when checking if a client is reachable
+REACHABLE_TIMEOUT = 15
+# Longest line that can be read from a session's stdout or stderr. Each
+# response from a resident worker is one line, including the job's whole
+# log (i.e., the tails of the browser's output), so it's well past
+# asyncio's default of 64 KiB.
+STREAM_LIMIT = 64 * (1 << 20)
+
+
+# Runs commands on clients with the system ssh binary, as asyncio
+# subprocesses. All the sessions to a client are multiplexed over one
+# ControlMaster connection, so the SSH handshake is paid once per client,
+# and no thread is needed per session.
+class AsyncSSH:
+    user: UserName
+    ssh_binary: str
+    control_dir: Path
+
+    def __init__(self, user: UserName, ssh_binary: str = "ssh") -> None:
+        self.user = user
+        self.ssh_binary = ssh_binary
+        # ControlPath has to be short, since it's a unix socket path.
+        self.control_dir = Path(tempfile.mkdtemp(prefix="pgcrawl-ssh-"))
+
+    def ssh_args(self, ip: IPAddress) -> list[str]:
+        options = [
+            "BatchMode=yes",
+            "ControlMaster=auto",
+            f"ControlPath={self.control_dir}/%C",
+            f"ControlPersist={CONTROL_PERSIST_SECS}",
+            "ServerAliveInterval=15",
+        ]
+        args = [self.ssh_binary]
+        for option in options:
+            args += ["-o", option]
+        return args + [f"{self.user}@{ip}"]
+
+    async def start(self, ip: IPAddress, cmd: str,
+                    logger: Logger) -> Process:
+        logger.debug(f"*  starting on {self.user}@{ip}: {cmd}")
+        return await asyncio.create_subprocess_exec(
+            *self.ssh_args(ip), cmd,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=STREAM_LIMIT)
+
+    async def run(self, ip: IPAddress, cmd: str, timeout: int,
+                  logger: Logger) -> SSHResult:
+        logger.debug(f"*  calling {self.user}@{ip}: {cmd}")
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *self.ssh_args(ip), cmd,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE)
+        except OSError as e:
+            logger.error(f"Unable to run {self.ssh_binary}: {e}")
+            return SSHResult(None, "", Failure.SSH)
+
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(),
+                                                    timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            logger.error(f"Timeout: command did not complete in {timeout}s")
+            return SSHResult(None, "", Failure.TIMEOUT)
+
+        output = stdout.decode("utf8", errors="replace")
+        if proc.returncode == SSH_ERROR_EXIT_CODE:
+            logger.error(stderr)
+            return SSHResult(None, output, Failure.SSH)
+        logger.debug(output)
+        if proc.returncode != 0:
+            logger.error(output)
+        return SSHResult(proc.returncode, output)
+
+    async def control(self, ip: IPAddress, command: str) -> int:
+        # Sends a control command (e.g., "check" or "exit") to the client's
+        # ControlMaster, returning ssh's exit code.
+        proc = await asyncio.create_subprocess_exec(
+            *self.ssh_args(ip)[:-1], "-O", command, f"{self.user}@{ip}",
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL)
+        return await proc.wait()
+
+    async def connect(self, ip: IPAddress, timeout: int,
+                      logger: Logger) -> bool:
+        # Opens the ControlMaster connection to the client, unless it's
+        # already open, so the handshake can be timed apart from commands.
+        if await self.control(ip, "check") == 0:
+            return True
+        return (await self.run(ip, "true", timeout, logger)).is_success()
+
+    async def exit_master(self, ip: IPAddress) -> None:
+        await self.control(ip, "exit")
+
+    async def close(self, ips: Iterable[IPAddress]) -> None:
+        await asyncio.gather(*[self.exit_master(ip) for ip in ips])
+        shutil.rmtree(self.control_dir, ignore_errors=True)
+
+
+def use_pidfd_child_watcher(loop: asyncio.AbstractEventLoop) -> None:
+    # Before python 3.12, asyncio waits on each subprocess from a thread of
+    # its own by default, which would mean one thread per SSH session.
+    if sys.version_info < (3, 12) and hasattr(os, "pidfd_open"):
+        watcher = asyncio.PidfdChildWatcher()
+        watcher.attach_loop(loop)
+        asyncio.set_child_watcher(watcher)
+
+
+# The asyncio engine's equivalent of ClientServer.
+@dataclass
+class AsyncClientServer:
+    ip: IPAddress
+    user: UserName
+    ssh: AsyncSSH
+    slot: int = 0
+
+    async def run(self, cmd: str, timeout: int,
+                  logger: Logger) -> SSHResult:
+        return await self.ssh.run(self.ip, cmd, timeout, logger)
+
+    async def connect(self, timeout: int, logger: Logger) -> bool:
+        return await self.ssh.connect(self.ip, timeout, logger)
+
+    def desc(self) -> str:
+        return f"{self.user}@{str(self.ip)}"
+
+    def slot_desc(self) -> str:
+        return f"{self.desc()}#{self.slot}"
+
+
+# Drop in replacement for ThreadIPManager that runs everything on a single
+# event loop. At most `slots` work items run on a client at once, however
+# many are started.
+class AsyncIPManager:
+    # pylint: disable=too-many-instance-attributes
+    ip_addresses: list[IPAddress]
+    user: UserName
+    timeout: int
+    logger: Logger
+    slots: int
+    ssh: AsyncSSH
+    loop: asyncio.AbstractEventLoop
+    semaphores: dict[IPAddress, asyncio.Semaphore]
+    # Only used for work items that have no async_func
+    pool: ConnectionPool
+    metrics: DispatchMetrics
+
+    def __init__(self, ips: list[IPAddress], user: UserName, timeout: int,
+                 logger: Logger, slots: int = 1,
+                 ssh_binary: str = "ssh",
+                 metrics: Optional[DispatchMetrics] = None) -> None:
+        self.ip_addresses = ips
+        self.user = user
+        self.timeout = timeout
+        self.logger = logger
+        self.slots = slots
+        self.ssh = AsyncSSH(user, ssh_binary)
+        self.loop = asyncio.new_event_loop()
+        use_pidfd_child_watcher(self.loop)
+        self.semaphores = {ip: asyncio.Semaphore(slots) for ip in ips}
+        self.pool = ConnectionPool(logger)
+        self.metrics = metrics or DispatchMetrics()
+
+    def worker_slots(self) -> list[tuple[IPAddress, int]]:
+        return [(ip, slot) for slot in range(self.slots)
+                for ip in self.ip_addresses]
+
+    def server(self, ip: IPAddress, slot: int) -> AsyncClientServer:
+        return AsyncClientServer(ip, self.user, self.ssh, slot)
+
+    async def call_on_slot(self, ip: IPAddress, slot: int,
+                           work: WorkItem) -> WorkOutcome:
+        # pylint: disable=broad-exception-caught
+        self.logger.info(f"({ip}) -> {work.message}")
+        outcome: WorkOutcome = False
+        async with self.semaphores[ip]:
+            self.metrics.started(ip)
+            start = time.monotonic()
+            try:
+                if work.async_func:
+                    outcome = await work.async_func(
+                        self.server(ip, slot), *work.args,
+                        timeout=self.timeout, logger=self.logger)
+                else:
+                    outcome = await asyncio.to_thread(
+                        work.func,
+                        ClientServer(ip, self.user, self.pool, slot),
+                        *work.args, timeout=self.timeout, logger=self.logger)
+            except Exception as e:
+                self.logger.error(f"({ip}) -> {e}")
+            self.metrics.finished(ip, outcome, time.monotonic() - start)
+        return outcome
+
+    async def is_reachable(self, ip: IPAddress) -> bool:
+        rs = await self.ssh.run(ip, "true", REACHABLE_TIMEOUT, self.logger)
+        if rs.failure:
+            self.logger.error(f"({ip}) -> unreachable")
+        return rs.failure is None
+
+    async def call_on_each(self, work_item: WorkItem) -> list[WorkResponse]:
+        async def call(ip: IPAddress) -> WorkResponse:
+            outcome = await self.call_on_slot(ip, 0, work_item)
+            return WorkResponse.from_outcome(ip, work_item, outcome)
+        return list(await asyncio.gather(
+            *[call(ip) for ip in self.ip_addresses]))
+
+    def run_on_each(self, work_item: WorkItem) -> list[WorkResponse]:
+        return self.loop.run_until_complete(self.call_on_each(work_item))
+
+    def num_workers(self) -> int:
+        return len(self.ip_addresses) * self.slots
+
+    def close(self) -> None:
+        self.loop.run_until_complete(self.ssh.close(self.ip_addresses))
+        self.loop.close()
+        self.pool.summarize()
+        self.pool.close()
+
+
+# The asyncio engine's equivalent of PullScheduler, with one task per
+# (ip, slot) instead of one thread. run() is a regular generator, which
+# runs the manager's event loop until the next responses are ready, so it
+# can be used anywhere a PullScheduler is.
+class AsyncPullScheduler:
+    # pylint: disable=too-many-instance-attributes
+    manager: AsyncIPManager
+    source: Iterator[WorkItem]
+    is_exhausted: bool
+    requeued: deque[WorkItem]
+    num_in_flight: int
+    dead_ips: set[IPAddress]
+    changed: asyncio.Condition
+    window: int
+    status: RunStatus
+
+    def __init__(self, manager: AsyncIPManager, source: Iterable[WorkItem],
+                 window: int = DEFAULT_RESPONSE_WINDOW,
+                 status: Optional[RunStatus] = None) -> None:
+        self.manager = manager
+        self.source = iter(source)
+        self.is_exhausted = False
+        self.requeued = deque()
+        self.num_in_flight = 0
+        self.dead_ips = set()
+        # Notified whenever work is finished or re-queued.
+        self.changed = asyncio.Condition()
+        self.window = window
+        self.status = status or RunStatus(manager.metrics)
+
+    async def next_item(self, ip: IPAddress) -> Optional[WorkItem]:
+        # Like PullScheduler.next_item(), slots wait on the work in flight
+        # once the source runs out, in case any of it is re-queued.
+        async with self.changed:
+            while ip not in self.dead_ips:
+                work_item = self.requeued.popleft() if self.requeued else None
+                if work_item is None and not self.is_exhausted:
+                    work_item = next(self.source, None)
+                    self.is_exhausted = work_item is None
+                if work_item is not None:
+                    self.num_in_flight += 1
+                    return work_item
+                if self.num_in_flight == 0:
+                    return None
+                await self.changed.wait()
+            return None
+
+    async def finish(self, work_item: WorkItem, requeue: bool) -> None:
+        async with self.changed:
+            self.num_in_flight -= 1
+            if requeue:
+                self.requeued.append(work_item)
+            self.changed.notify_all()
+
+    def all_retired(self) -> bool:
+        return len(self.dead_ips) == len(self.manager.ip_addresses)
+
+    async def work(self, ip: IPAddress, slot: int,
+                   responses: asyncio.Queue[Optional[WorkResponse]]) -> None:
+        try:
+            while (work_item := await self.next_item(ip)) is not None:
+                is_requeued = False
+                try:
+                    is_requeued = await self.run_item(ip, slot, work_item,
+                                                      responses)
+                finally:
+                    await self.finish(work_item, is_requeued)
+        finally:
+            await responses.put(None)
+
+    async def run_item(self, ip: IPAddress, slot: int, work_item: WorkItem,
+                       responses: asyncio.Queue[Optional[WorkResponse]]
+                       ) -> bool:
+        # Returns True if the client was retired, and the work item is to
+        # be re-queued.
+        outcome = await self.manager.call_on_slot(ip, slot, work_item)
+        work_response = WorkResponse.from_outcome(ip, work_item, outcome)
+        if (work_response.may_be_client_failure()
+                and not await self.manager.is_reachable(ip)):
+            self.manager.logger.error(
+                f"({ip}) -> retiring client, re-queuing {work_item.message}")
+            self.status.finished(requeued=True)
+            self.dead_ips.add(ip)
+            return True
+        self.status.finished()
+        await responses.put(work_response)
+        return False
+
+    def run(self) -> Iterator[WorkResponse]:
+        loop = self.manager.loop
+        responses: asyncio.Queue[Optional[WorkResponse]] = asyncio.Queue(
+            maxsize=self.window)
+        tasks = [loop.create_task(self.work(ip, slot, responses))
+                 for ip, slot in self.manager.worker_slots()]
+
+        num_running = len(tasks)
+        while num_running > 0:
+            # Everything that finished while the caller was busy with the
+            # last batch is handed over at once, instead of re-entering the
+            # event loop for each response.
+            batch = [loop.run_until_complete(responses.get())]
+            while not responses.empty():
+                batch.append(responses.get_nowait())
+            for work_response in batch:
+                if work_response is None:
+                    num_running -= 1
+                    continue
+                yield work_response
+        loop.run_until_complete(asyncio.gather(*tasks))
+
+    def unfinished(self) -> list[WorkItem]:
+        return list(self.requeued)
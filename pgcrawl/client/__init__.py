@@ -14,6 +14,14 @@ AWS_COMPLETE_DIR = CLIENT_DIR / "aws-complete"
 COMPLETE_DIR = CLIENT_DIR / "complete"
 ERROR_DIR = CLIENT_DIR / "error"
 TMP_DIR = CLIENT_DIR / "tmp"
+# Full (gzip'ed) browser output of each crawl, if asked for
+CRAWL_LOGS_DIR = CLIENT_DIR / "crawl-logs"
+# Graphs waiting to be uploaded to S3
+OUTBOX_DIR = CLIENT_DIR / "outbox"
+# Results of earlier queries, by the digest of the graph they were run on
+QUERY_CACHE_DIR = CLIENT_DIR / "query-cache"
+# Graphs downloaded for earlier queries, by their digest
+GRAPH_CACHE_DIR = CLIENT_DIR / "graph-cache"
 
 DIRS_TO_WRITE = [
     WORKSPACE_DIR,
@@ -27,9 +35,16 @@ DIRS_TO_WRITE = [
     AWS_COMPLETE_DIR,
     COMPLETE_DIR,
     ERROR_DIR,
-    TMP_DIR
+    TMP_DIR,
+    CRAWL_LOGS_DIR,
+    OUTBOX_DIR,
+    QUERY_CACHE_DIR,
+    GRAPH_CACHE_DIR
 ]
 
 PAGEGRAPH_CRAWL_DIR = CLIENT_DIR / "pagegraph-crawl"
+# A browser profile that's already been through first run, which each crawl
+# starts from a copy of.
+PROFILE_TEMPLATE_DIR = CLIENT_DIR / "profile-template"
 PAGEGRAPH_QUERY_ENV_DIR = CLIENT_DIR / "pagegraph-query"
 PAGEGRAPH_QUERY_PROJECT_DIR = PAGEGRAPH_QUERY_ENV_DIR / "pagegraph-query"
@@ -1,22 +1,49 @@
 from dataclasses import dataclass
 from datetime import datetime
-import os
-import signal
+from pathlib import Path
 from subprocess import Popen, TimeoutExpired, PIPE
+import time
 import urllib.parse
-from typing import Optional, TYPE_CHECKING
+import xml.etree.ElementTree as ET
+from typing import IO, Optional, TYPE_CHECKING, cast
 
 from pgcrawl.client import AWS_COMPLETE_DIR, AWS_ERROR_DIR, AWS_START_DIR
 from pgcrawl.client import CRAWLING_COMPLETE_DIR, CRAWLING_ERROR_DIR
 from pgcrawl.client import CRAWLING_START_DIR, PAGEGRAPH_CRAWL_DIR
-from pgcrawl.client import RECEIVED_DIR, TMP_DIR, ERROR_DIR, COMPLETE_DIR
-from pgcrawl.client import PAGEGRAPH_QUERY_ENV_DIR, PAGEGRAPH_QUERY_PROJECT_DIR
-from pgcrawl.subprocesses import call_output, call
+from pgcrawl.client import CRAWL_LOGS_DIR, PROFILE_TEMPLATE_DIR
+from pgcrawl.client import RECEIVED_DIR, ERROR_DIR, COMPLETE_DIR
+from pgcrawl.client.capture import OutputCapture
+from pgcrawl.client.compression import Codec, compress_graph
+from pgcrawl.client.compression import DECOMPRESS_ERRORS
+from pgcrawl.client.graph_cache import TeeReader
+from pgcrawl.client.queries import query_frames
+from pgcrawl.client.slots import process_exe_name, process_group_members
+from pgcrawl.client.query_cache import DigestReader, digest_key, file_digest
+from pgcrawl.client.query_cache import read_stored_digest
+from pgcrawl.results import CrawlResult, Failure, classify_browser_error
+from pgcrawl.storage import StorageError, open_storage
+from pgcrawl.timing import PhaseTimer
+from pgcrawl.types import JSONDict
 
 if TYPE_CHECKING:
-    from pathlib import Path
+    from pgcrawl.client.args import ClientCrawlArgs
+    from pgcrawl.client.graph_cache import GraphCache
+    from pgcrawl.client.outbox import Outbox
+    from pgcrawl.client.query_cache import QueryCache
+    from pgcrawl.client.slots import Slot
     from pgcrawl.logging import Logger
-    from pgcrawl.types import Url
+    from pgcrawl.storage import Storage
+
+
+# Seconds to wait for the browser's output to be read, once its process
+# group has been killed.
+CAPTURE_CLOSE_TIMEOUT = 5
+# The executables that run in a crawl's process group before the browser
+# is started: node (which npm runs in too), and the shell npm runs the
+# crawl script with.
+NODE_STARTUP_EXES = {"node", "nodejs", "sh", "bash", "dash"}
+# How often to check if node has started the browser yet
+BROWSER_START_POLL_SECS = 0.05
 
 
 @dataclass
@@ -42,6 +69,16 @@ class UrlRequest:
     def graph_name(self) -> str:
         return f"{self.file_name()}.graphml"
 
+    def object_name(self, codec: Codec) -> str:
+        return self.graph_name() + codec.extension()
+
+    @staticmethod
+    def from_graph_name(graph_name: str) -> "UrlRequest":
+        # Also accepts the names of compressed graphs.
+        file_name = graph_name.split(".graphml", 1)[0]
+        rank, domain = file_name.split("_", 1)
+        return UrlRequest(f"http://{domain}", int(rank))
+
 
 def write_log(dir_path: "Path", req: UrlRequest,
               msg: None | str = None) -> None:
@@ -53,173 +90,329 @@ def write_log(dir_path: "Path", req: UrlRequest,
     dest_path.write_text(text)
 
 
-def crawl(req: UrlRequest, output_path: "Path", binary_path: str,
-          pagegraph_time: int, timeout: int, logger: "Logger") -> bool:
-    # pylint: disable=consider-using-with,subprocess-popen-preexec-fn
-    crawl_args = [
-        "npm", "run", "crawl", "--",
-        "-b", binary_path,
+def pagegraph_crawl_cmd() -> list[str]:
+    # Running the built script directly, when it is present, skips paying
+    # for npm's own startup on every crawl.
+    built_script = PAGEGRAPH_CRAWL_DIR / "built" / "run.js"
+    if built_script.is_file():
+        return ["node", str(built_script.absolute())]
+    return ["npm", "run", "crawl", "--"]
+
+
+def crawl_cmd(req: UrlRequest, output_path: "Path",
+              args: "ClientCrawlArgs") -> list[str]:
+    # The browser is run on this slot's own display (instead of
+    # pagegraph-crawl starting its own Xvfb), so that concurrent crawls
+    # on the same host don't step on each other.
+    crawl_args = pagegraph_crawl_cmd() + [
+        "-b", args.binary_path,
         "-o", str(output_path.absolute()),
         "-u", req.url,
-        "-t", str(pagegraph_time),
+        "-t", str(args.pagegraph_secs),
+        "--interactive",
     ]
-
+    # pagegraph-crawl copies the template into the slot's profiles
+    # directory (which is in memory, when possible), instead of the
+    # browser building a new profile from scratch.
+    if (PROFILE_TEMPLATE_DIR / "Default").is_dir():
+        crawl_args += ["--existing-profile",
+                       str(PROFILE_TEMPLATE_DIR.absolute())]
+    return crawl_args
+
+
+def wait_for_browser(rs: "Popen[bytes]", deadline: float) -> None:
+    # Returns once anything other than node (or npm's shell) is running in
+    # the crawl's process group, i.e., once the browser has been started,
+    # or once the crawl has exited or the deadline has passed.
+    while rs.poll() is None and time.monotonic() < deadline:
+        exes = map(process_exe_name, process_group_members(rs.pid))
+        if any(x and x not in NODE_STARTUP_EXES for x in exes):
+            return
+        time.sleep(BROWSER_START_POLL_SECS)
+
+
+def start_crawl(req: UrlRequest, crawl_args: list[str], slot: "Slot",
+                spool_path: Optional["Path"], logger: "Logger"
+                ) -> tuple["Popen[bytes]", OutputCapture]:
+    # pylint: disable=consider-using-with
+    args_combined = " ".join(crawl_args)
+    write_log(CRAWLING_START_DIR, req, args_combined)
+    logger.debug(" - " + args_combined)
+    # The crawl (and the browser) get a process group of their own, so
+    # they can be cleaned up without touching the slot's display.
+    rs = Popen(crawl_args, stdout=PIPE, stderr=PIPE, env=slot.env(),
+               start_new_session=True, cwd=PAGEGRAPH_CRAWL_DIR)
+    slot.record_process_group(rs.pid)
+    assert rs.stdout
+    assert rs.stderr
+    # Output is read while the crawl runs, so a chatty page or browser can
+    # never fill a pipe and stall the crawl.
+    capture = OutputCapture({"stdout": rs.stdout, "stderr": rs.stderr},
+                            spool_path=spool_path)
+    return rs, capture
+
+
+def crawl(req: UrlRequest, output_path: "Path", args: "ClientCrawlArgs",
+          slot: "Slot", timer: PhaseTimer, logger: "Logger") -> CrawlResult:
+    crawl_args = crawl_cmd(req, output_path, args)
     output_text = ""
     error_text = ""
-    is_success = False
+    failure = None
+    with timer.phase("prepare"):
+        if not slot.prepare(logger):
+            error_message = f"No display for slot {slot.index}"
+            write_log(CRAWLING_ERROR_DIR, req, error_message)
+            return CrawlResult.failed(Failure.DISPLAY, error_message)
+
+    capture = None
+    spool_path = None
+    if args.spool_logs:
+        spool_path = CRAWL_LOGS_DIR / f"{req.file_name()}.log.gz"
     try:
-        args_combined = " ".join(crawl_args)
-        write_log(CRAWLING_START_DIR, req, args_combined)
-        logger.debug(" - " + args_combined)
-        rs = Popen(crawl_args, stdout=PIPE, stderr=PIPE,
-                   preexec_fn=os.setsid, cwd=PAGEGRAPH_CRAWL_DIR)
-        rs.wait(timeout=timeout)
-        assert rs.stdout
-        assert rs.stderr
-        output_text = rs.stdout.read().decode("utf8")
-        error_text = rs.stderr.read().decode("utf8")
-        is_success = rs.returncode == 0
+        deadline = time.monotonic() + args.timeout
+        # Starting node (and npm), up until node starts the browser
+        with timer.phase("node_startup"):
+            rs, capture = start_crawl(req, crawl_args, slot, spool_path,
+                                      logger)
+            wait_for_browser(rs, deadline)
+        # The rest: the browser's startup, the time spent on the page, and
+        # writing the graph
+        with timer.phase("browser"):
+            rs.wait(timeout=max(deadline - time.monotonic(), 0))
     except TimeoutExpired:
-        output_text = ""
-        error_text = "Crawl timed out"
-        os.killpg(os.getpgid(rs.pid), signal.SIGTERM)
+        failure = Failure.BROWSER_TIMEOUT
+    finally:
+        # Tears down the browser and anything else it started, but only
+        # for this slot, which also closes any pipes they still held.
+        with timer.phase("reap"):
+            slot.reap(logger)
+
+    if capture:
+        # The crawl has been killed by now, if it was still running.
+        with timer.phase("reap"):
+            rs.wait()
+            capture.close(CAPTURE_CLOSE_TIMEOUT)
+        output_text = capture.text("stdout")
+        error_text = capture.text("stderr")
+    if failure == Failure.BROWSER_TIMEOUT:
+        error_text = f"Crawl timed out\n{error_text}"
+    elif capture and rs.returncode != 0:
+        failure = classify_browser_error(output_text + error_text)
 
     logger.debug("crawl results:")
     logger.debug(output_text)
 
-    if not is_success:
+    if failure:
         write_log(CRAWLING_ERROR_DIR, req, error_text)
         logger.error(error_text)
-        return False
+        return CrawlResult.failed(failure, error_text)
 
     if not output_path.is_file():
         error_message = f"No file at {str(output_path)}"
         write_log(CRAWLING_ERROR_DIR, req, error_message)
         logger.error(error_message)
-        return False
+        return CrawlResult.failed(Failure.NO_GRAPH, error_message)
 
     write_log(CRAWLING_COMPLETE_DIR, req, output_text)
-    return True
+    return CrawlResult(True)
 
 
-def get_from_s3(req: UrlRequest, output_path: "Path", s3_bucket: str,
-                logger: "Logger") -> bool:
-    s3_url = f"s3://{s3_bucket}/{req.graph_name()}"
-    aws_args = ["aws", "s3", "cp", "--no-progress", s3_url, str(output_path)]
-    return call(aws_args, logger)
+def graph_key(object_name: str) -> str:
+    return f"graphs/{object_name}"
 
 
-def write_to_s3(local_file: "Path", s3_url: "Url", logger: "Logger",
-                timeout: int = 30) -> bool:
-    aws_args = ["aws", "s3", "mv", "--no-progress", str(local_file), s3_url]
-    return call(aws_args, logger, timeout)
-
-
-def write_crawl_results_to_s3(req: UrlRequest, local_file: "Path",
-                              s3_bucket: str, logger: "Logger",
-                              timeout: int = 30) -> bool:
-    s3_url = f"s3://{s3_bucket}/graphs/{req.graph_name()}"
+def write_crawl_results(req: UrlRequest, local_file: "Path",
+                        storage: "Storage", logger: "Logger",
+                        timer: Optional[PhaseTimer] = None) -> bool:
+    # The local file is already named for the codec it was compressed with.
+    key = graph_key(local_file.name)
+    # Uploads from the outbox aren't part of any crawl's timings.
+    timer = timer or PhaseTimer()
     write_log(AWS_START_DIR, req,
-              f"from: {str(local_file)} -> {s3_url}")
-    if write_to_s3(local_file, s3_url, logger, timeout):
-        write_log(AWS_COMPLETE_DIR, req)
-        return True
-    write_log(AWS_ERROR_DIR, req)
-    return False
+              f"from: {str(local_file)} -> {storage.url(key)}")
+    try:
+        # The digest is written first, and nothing else ever writes it, so
+        # it's never older than the graph next to it. A digest newer than
+        # the graph (i.e., if the graph can't be written, or is read between
+        # the two writes) only means the graph is queried again, since
+        # results are cached by the digest of what was actually read.
+        with timer.phase("digest"):
+            digest = file_digest(local_file)
+        with timer.phase("upload"):
+            storage.put_bytes(digest.encode("utf8"), digest_key(key))
+            storage.put(local_file, key)
+    except StorageError as e:
+        logger.error(e)
+        write_log(AWS_ERROR_DIR, req)
+        return False
+    local_file.unlink()
+    write_log(AWS_COMPLETE_DIR, req)
+    return True
 
 
-def crawl_and_save(req: UrlRequest, output_path: "Path", binary_path: str,
-                   pagegraph_secs: int, s3_bucket: str, timeout: int,
-                   logger: "Logger") -> bool:
+def crawl_and_save(req: UrlRequest, output_path: "Path",
+                   args: "ClientCrawlArgs", slot: "Slot",
+                   outbox: Optional["Outbox"], timer: PhaseTimer,
+                   logger: "Logger") -> CrawlResult:
     logger.debug(f"1. Recording received {req.file_name()}")
 
     logger.debug(f"2. Starting crawl of {req.url} to {str(output_path)}")
-    crawl_rs = crawl(req, output_path, binary_path, pagegraph_secs,
-                     timeout, logger)
-    if not crawl_rs:
-        return False
-
-    logger.debug("3. Writing results to S3")
-    return write_crawl_results_to_s3(req, output_path, s3_bucket,
-                                     logger, timeout)
-
-
-def run_crawl(request: UrlRequest, binary_path: str,
-              pagegraph_secs: int, s3_bucket: str, timeout: int,
-              logger: "Logger") -> bool:
-    output_path = TMP_DIR / request.graph_name()
-    write_log(RECEIVED_DIR, request)
-    rs = crawl_and_save(request, output_path, binary_path,
-                        pagegraph_secs, s3_bucket, timeout, logger)
-
-    if output_path.is_file():
-        output_path.unlink()
-
-    if not rs:
+    crawl_rs = crawl(req, output_path, args, slot, timer, logger)
+    if not crawl_rs.success:
+        return crawl_rs
+
+    logger.debug(f"3. Compressing results with {args.codec}")
+    with timer.phase("compress"):
+        upload_path, crawl_rs.compression = compress_graph(
+            output_path, Codec(args.codec), args.compress_level)
+
+    if outbox:
+        # The graph is uploaded in the background, so this slot can move on
+        # to its next crawl straight away.
+        logger.debug("4. Queuing results for upload")
+        with timer.phase("queue"):
+            outbox.put(req, upload_path, args.storage)
+        return crawl_rs
+
+    logger.debug("4. Writing results to storage")
+    if not write_crawl_results(req, upload_path, open_storage(args.storage),
+                               logger, timer):
+        return CrawlResult.failed(Failure.UPLOAD,
+                                  f"Unable to upload {req.graph_name()}")
+    return crawl_rs
+
+
+def run_crawl(request: UrlRequest, args: "ClientCrawlArgs", slot: "Slot",
+              outbox: Optional["Outbox"], logger: "Logger") -> CrawlResult:
+    timer = PhaseTimer()
+    with timer.phase("client"):
+        output_path = slot.tmp_dir() / request.graph_name()
+        write_log(RECEIVED_DIR, request)
+        rs = crawl_and_save(request, output_path, args, slot, outbox, timer,
+                            logger)
+
+        # Removes the graph, compressed or not, if it wasn't uploaded.
+        for graph_path in slot.tmp_dir().glob(f"{request.graph_name()}*"):
+            graph_path.unlink()
+    rs.timings = timer.phases
+    if outbox:
+        # Successful crawls are only queued for upload, so the dispatcher
+        # learns which graphs were actually uploaded from later results.
+        rs.outbox = outbox.report()
+
+    if not rs.success:
         write_log(ERROR_DIR, request)
-        return False
+        return rs
     write_log(COMPLETE_DIR, request)
-    return True
-
-
-def make_pg_query_cmd(command: str) -> str:
-    env_activate_path = PAGEGRAPH_QUERY_ENV_DIR / "bin/activate"
-    source_cmd = "source " + str(env_activate_path)
-
-    run_path = PAGEGRAPH_QUERY_PROJECT_DIR / "run.js"
-    target_command = f"{str(run_path)} {command}"
-
-    complete_cmd = " && ".join([
-        source_cmd,
-        target_command
-    ])
-    return complete_cmd
-
-
-def run_pg_query_cmd(command: str, logger: "Logger") -> Optional[str]:
-    pg_cmd = make_pg_query_cmd(command)
-    return call_output(pg_cmd, logger, shell=True)
-
-
-def run_queries(request: UrlRequest, s3_bucket: str,
-                logger: "Logger") -> dict[str, dict[str, str]] | bool:
-    output_path = TMP_DIR / request.graph_name()
-    graph_path_str = str(output_path)
-
+    return rs
+
+
+def query_stream(stream: IO[bytes],
+                 codec: Codec) -> tuple[JSONDict, str]:
+    # Returns the results, and the digest of the graph as stored.
+    with DigestReader(stream) as hashed, \
+            codec.open_reader(cast(IO[bytes], hashed)) as reader:
+        results = query_frames(reader)
+        return results, hashed.hexdigest()
+
+
+def query_graph_object(storage: "Storage", key: str, codec: Codec,
+                       stored_digest: Optional[str],
+                       graph_cache: Optional["GraphCache"],
+                       logger: "Logger"
+                       ) -> tuple[JSONDict, str]:
+    # The graph is decompressed, hashed and queried as it's read, in a
+    # single pass, so it's never decompressed to disk, or read twice.
+    cached_file = graph_cache.open(stored_digest) if graph_cache else None
+    if cached_file:
+        logger.debug(f"Querying cached copy of {storage.url(key)}")
+        with cached_file:
+            return query_stream(cached_file, codec)
+
+    logger.debug(f"Querying {storage.url(key)}")
+    # Graphs stored without a digest are never looked up in the cache, so
+    # aren't copied into it, where they'd only push out graphs that are.
+    if not graph_cache or not stored_digest:
+        with storage.get(key) as stream:
+            return query_stream(stream, codec)
+
+    # Otherwise the graph is also copied into the cache as it's downloaded.
+    with graph_cache.new_part() as part_file:
+        part_path = Path(part_file.name)
+        try:
+            with storage.get(key) as stream:
+                results, digest = query_stream(
+                    cast(IO[bytes], TeeReader(stream, part_file)), codec)
+        except BaseException:
+            part_path.unlink(missing_ok=True)
+            raise
+    if digest == stored_digest:
+        graph_cache.add(part_path, digest, logger)
+    else:
+        # The graph was replaced while it was read.
+        part_path.unlink(missing_ok=True)
+    return results, digest
+
+
+def uncompressed_key(storage: "Storage", request: UrlRequest,
+                     codec: Codec, logger: "Logger") -> Optional[str]:
+    # Graphs crawled before they were compressed are stored without a
+    # codec extension, so if a graph isn't stored under the codec's key,
+    # but is stored there, returns that key instead.
+    if codec == Codec.NONE:
+        return None
+    key = graph_key(request.object_name(Codec.NONE))
     try:
-        get_from_s3(request, output_path, s3_bucket, logger)
+        if storage.exists(graph_key(request.object_name(codec))) \
+                or not storage.exists(key):
+            return None
+    except StorageError as e:
+        logger.debug(e)
+        return None
+    logger.debug(f"Falling back to uncompressed {storage.url(key)}")
+    return key
+
+
+def run_queries(request: UrlRequest, storage: "Storage", codec: Codec,
+                cache: Optional["QueryCache"],
+                graph_cache: Optional["GraphCache"],
+                logger: "Logger") -> JSONDict | bool:
+    key = graph_key(request.object_name(codec))
+    stored_digest = None
+    if cache or graph_cache:
+        stored_digest = read_stored_digest(storage, key, logger)
+    if cache:
+        cached_results = cache.get(storage, stored_digest, logger)
+        if cached_results is not None:
+            logger.debug(f"Using cached results for {storage.url(key)}")
+            return cached_results
 
-        frames_rs = run_pg_query_cmd(
-            f"subframes {graph_path_str} -l | jq -r '.[].\"child frames\".[].id'",
-            logger)
-        if frames_rs is None:
-            return False
-
-        frames_nids = frames_rs.split("\n")
-        results = {}
-        for nid in frames_nids:
-            num_requests = run_pg_query_cmd(
-                f"requests -f {nid} {graph_path_str} | jq length", logger)
-            if num_requests is None:
-                return False
-
-            num_js = run_pg_query_cmd(
-                f"js-calls -f {nid} {graph_path_str} | jq '.[].method.name | length'",
-                logger)
-            if num_js is None:
-                return False
-
-            num_html = run_pg_query_cmd(
-                f"html -b -s -f {nid} {graph_path_str} | jq '.[] | length'",
-                logger)
-            if num_html is None:
-                return False
-            results[nid] = {
-                "requests": num_requests,
-                "js": num_js,
-                "html": num_html
-            }
-        return results
-    finally:
-        if output_path.is_file():
-            output_path.unlink()
+    try:
+        try:
+            results, digest = query_graph_object(storage, key, codec,
+                                                 stored_digest, graph_cache,
+                                                 logger)
+        except StorageError:
+            fallback_key = uncompressed_key(storage, request, codec, logger)
+            if fallback_key is None:
+                raise
+            # The digest, if any, was read for the compressed key, so isn't
+            # used for the uncompressed graph (which predates digests).
+            key = fallback_key
+            results, digest = query_graph_object(storage, key, Codec.NONE,
+                                                 None, graph_cache, logger)
+    except StorageError as e:
+        logger.error(e)
+        return False
+    except DECOMPRESS_ERRORS as e:
+        logger.error(f"Unable to decompress {storage.url(key)}: {e}")
+        return False
+    except ET.ParseError as e:
+        logger.error(f"Unable to parse {storage.url(key)}: {e}")
+        return False
+    # Results are only cached under the digest later lookups will read,
+    # so not for graphs stored without a digest (or read while being
+    # replaced), which would never be served again.
+    if cache and digest == stored_digest:
+        cache.put(storage, digest, results, logger)
+    return results
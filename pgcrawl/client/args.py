@@ -1,38 +1,52 @@
 from dataclasses import dataclass
 
 import pgcrawl
+from pgcrawl.client.compression import Codec, DEFAULT_COMPRESS_LEVEL
+from pgcrawl.client.graph_cache import DEFAULT_GRAPH_CACHE_BYTES
 
 
 @dataclass
 class ClientCrawlArgs:
+    # pylint: disable=too-many-instance-attributes
     client_code_path: str
     binary_path: str
-    # Name of the s3 bucket the client should write results to
-    s3_bucket: str
+    # Where the client should write results to (see open_storage)
+    storage: str
     # Number of seconds to wait on the page before requesting the pagegraph
     # graph
     pagegraph_secs: int
     # Maximum amount of time to wait for a client to complete a task
     # before assuming something has gone wrong.
     timeout: int
+    # How to compress graphs before uploading them (see Codec)
+    codec: str = Codec.GZIP.value
+    compress_level: int = DEFAULT_COMPRESS_LEVEL
+    # Whether to keep the browser's full output, instead of just its tail
+    spool_logs: bool = False
 
 
 DEFAULT_CRAWL_ARGS = ClientCrawlArgs(
     pgcrawl.DEFAULT_CLIENT_CODE_PATH,
     pgcrawl.DEFAULT_CLIENT_BINARY_PATH,
-    pgcrawl.DEFAULT_S3_BUCKET,
+    pgcrawl.DEFAULT_STORAGE,
     10,
     300)
 
 
 @dataclass
 class ClientQueryArgs:
-    # Name of the s3 bucket the client should write results to
-    s3_bucket: str
+    # Where the client should read graphs from (see open_storage)
+    storage: str
     # Number of seconds to wait for the query to complete (0 means unlimited)
     timeout: int
+    # How the graph was compressed when it was uploaded (see Codec)
+    codec: str = Codec.GZIP.value
+    # Whether to use (and add to) earlier results for the same graph
+    use_cache: bool = True
+    # Most bytes of downloaded graphs to keep on the client (0 keeps none)
+    graph_cache_bytes: int = DEFAULT_GRAPH_CACHE_BYTES
 
 
 DEFAULT_QUERY_ARGS = ClientQueryArgs(
-    pgcrawl.DEFAULT_S3_BUCKET,
+    pgcrawl.DEFAULT_STORAGE,
     300)
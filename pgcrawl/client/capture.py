@@ -0,0 +1,93 @@
+from collections import deque
+import gzip
+from pathlib import Path
+import threading
+import time
+from typing import IO, Optional, cast
+
+
+# Only the last this many bytes of each of a crawl's stdout and stderr are
+# kept in memory (e.g., for classifying errors and for the marker files).
+DEFAULT_TAIL_BYTES = 64 * 1024
+READ_SIZE = 64 * 1024
+
+
+# Keeps the last max_bytes written to a stream.
+class RingBuffer:
+    max_bytes: int
+    chunks: deque[bytes]
+    size: int
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.chunks = deque()
+        self.size = 0
+
+    def write(self, chunk: bytes) -> None:
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        while self.size - len(self.chunks[0]) >= self.max_bytes:
+            self.size -= len(self.chunks.popleft())
+
+    def text(self) -> str:
+        data = b"".join(self.chunks)[-self.max_bytes:]
+        return data.decode("utf8", errors="replace")
+
+
+# Reads a child's stdout and stderr as they're written, each on a thread of
+# its own, so the child never blocks on a full pipe, however much it
+# writes. Only the tail of each is kept in memory, but everything can also
+# be spooled to a gzip'ed log file.
+class OutputCapture:
+    streams: dict[str, IO[bytes]]
+    buffers: dict[str, RingBuffer]
+    threads: list[threading.Thread]
+    spool: Optional[IO[bytes]]
+    lock: threading.Lock
+
+    def __init__(self, streams: dict[str, IO[bytes]],
+                 max_bytes: int = DEFAULT_TAIL_BYTES,
+                 spool_path: Optional[Path] = None) -> None:
+        self.streams = streams
+        self.buffers = {name: RingBuffer(max_bytes) for name in streams}
+        self.spool = None
+        if spool_path:
+            self.spool = cast(IO[bytes], gzip.open(spool_path, "wb"))
+        self.lock = threading.Lock()
+        self.threads = [
+            threading.Thread(target=self.read, args=(name, stream),
+                             daemon=True)
+            for name, stream in streams.items()]
+        for thread in self.threads:
+            thread.start()
+
+    def read(self, name: str, stream: IO[bytes]) -> None:
+        buffer = self.buffers[name]
+        read = getattr(stream, "read1", stream.read)
+        while chunk := read(READ_SIZE):
+            with self.lock:
+                buffer.write(chunk)
+                if self.spool:
+                    self.spool.write(chunk)
+
+    def join(self, timeout: float) -> bool:
+        # Returns False if the streams are still open after timeout seconds
+        # (e.g., because something the child started still has them open).
+        deadline = time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        return not any(x.is_alive() for x in self.threads)
+
+    def text(self, name: str) -> str:
+        with self.lock:
+            return self.buffers[name].text()
+
+    def close(self, timeout: float) -> None:
+        # Anything still being read after this is only kept in memory.
+        if self.join(timeout):
+            for stream in self.streams.values():
+                stream.close()
+        with self.lock:
+            if self.spool:
+                self.spool.close()
+                self.spool = None
@@ -1,17 +1,86 @@
+import json
+from typing import Iterator, Optional, TextIO
+
 from pgcrawl.client.actions import UrlRequest, run_crawl, run_queries
+from pgcrawl.client import GRAPH_CACHE_DIR
 from pgcrawl.client.args import ClientCrawlArgs, ClientQueryArgs
+from pgcrawl.client.compression import Codec
+from pgcrawl.client.graph_cache import GraphCache
+from pgcrawl.client.outbox import Outbox
+from pgcrawl.client.query_cache import QUERY_CACHE
+from pgcrawl.client.query_pool import QueryPool
+from pgcrawl.client.queries import QUERY_FORMAT
+from pgcrawl.client.slots import Slot
 from pgcrawl.logging import Logger
+from pgcrawl.results import CrawlResult
+from pgcrawl.storage import open_storage
 from pgcrawl.types import JSONDict, Url
 
 
-def crawl_url(url: Url, rank: int, args: ClientCrawlArgs,
-              logger: Logger) -> bool:
+def crawl_url(url: Url, rank: int, args: ClientCrawlArgs, slot: Slot,
+              outbox: Optional[Outbox], logger: Logger) -> CrawlResult:
     request = UrlRequest(url, rank)
-    return run_crawl(request, args.binary_path,
-                     args.pagegraph_secs, args.s3_bucket, args.timeout, logger)
+    return run_crawl(request, args, slot, outbox, logger)
 
 
 def query_graph(url: Url, rank: int, args: ClientQueryArgs,
                 logger: Logger) -> JSONDict | bool:
     request = UrlRequest(url, rank)
-    return run_queries(request, args.s3_bucket, logger)
+    cache = QUERY_CACHE if args.use_cache else None
+    graph_cache = None
+    if args.graph_cache_bytes > 0:
+        graph_cache = GraphCache(GRAPH_CACHE_DIR, args.graph_cache_bytes)
+    rs = run_queries(request, open_storage(args.storage), Codec(args.codec),
+                     cache, graph_cache, logger)
+    if cache:
+        logger.debug(cache.stats_desc())
+    return rs
+
+
+def query_graphs(graphs: list[tuple[Url, int]], args: ClientQueryArgs,
+                 num_workers: int, logger: Logger, ordered: bool = True
+                 ) -> Iterator[tuple[UrlRequest, JSONDict | bool]]:
+    # Queries the graphs concurrently, yielding their results either in the
+    # order the graphs were given, or as each finishes.
+    requests = [UrlRequest(url, rank) for url, rank in graphs]
+    return QueryPool(query_graph, args, num_workers, logger).run(requests,
+                                                                 ordered)
+
+
+def read_batch(stream: TextIO) -> list[tuple[Url, int]]:
+    # Reads one graph per line, as "RANK URL" or "RANK,URL" (e.g., lines of
+    # a Tranco list), where the URL can also be just the domain.
+    graphs = []
+    for line in stream:
+        fields = line.replace(",", " ").split()
+        if not fields or fields[0].startswith("#"):
+            continue
+        if len(fields) != 2:
+            raise ValueError(f"Expected a rank and URL, not: {line.strip()}")
+        rank, url = int(fields[0]), fields[1]
+        if "://" not in url:
+            url = f"http://{url}"
+        graphs.append((url, rank))
+    return graphs
+
+
+def query_batch(graphs: list[tuple[Url, int]], args: ClientQueryArgs,
+                num_workers: int, out_stream: TextIO, logger: Logger) -> bool:
+    # Writes one JSON line per graph as soon as it's been queried, so
+    # results can be read as they arrive, and only the graphs being
+    # queried are lost if this is interrupted. Returns whether every graph
+    # was queried successfully.
+    all_successful = True
+    for request, result in query_graphs(graphs, args, num_workers, logger,
+                                        ordered=False):
+        success = result is not False
+        all_successful = all_successful and success
+        out_stream.write(json.dumps({
+            "rank": request.rank,
+            "url": request.url,
+            "success": success,
+            "format": QUERY_FORMAT,
+            "results": result if success else None,
+        }) + "\n")
+        out_stream.flush()
+    return all_successful
@@ -0,0 +1,84 @@
+import bz2
+from enum import Enum
+import gzip
+import lzma
+from pathlib import Path
+import time
+from typing import IO, cast
+
+from pgcrawl.results import CompressionStats
+
+
+# Graphs are read and written in chunks of this many bytes, so no graph is
+# ever held in memory whole.
+CHUNK_SIZE = 1 << 20
+DEFAULT_COMPRESS_LEVEL = 6
+# What reading a truncated or corrupt compressed graph can raise
+DECOMPRESS_ERRORS = (OSError, EOFError, lzma.LZMAError)
+
+
+# How graphs are compressed before being uploaded. The codec is recorded
+# in the extension of the object's name (e.g., 1_example.com.graphml.gz).
+class Codec(Enum):
+    NONE = "none"
+    GZIP = "gzip"
+    BZIP2 = "bz2"
+    XZ = "xz"
+
+    def extension(self) -> str:
+        return CODEC_EXTENSIONS[self]
+
+    def open_writer(self, path: Path, level: int) -> IO[bytes]:
+        # pylint: disable=consider-using-with
+        match self:
+            case Codec.GZIP:
+                return cast("IO[bytes]", gzip.open(path, "wb", level))
+            case Codec.BZIP2:
+                return cast("IO[bytes]", bz2.open(path, "wb", level))
+            case Codec.XZ:
+                return cast("IO[bytes]", lzma.open(path, "wb", preset=level))
+        return open(path, "wb")
+
+    def open_reader(self, stream: IO[bytes]) -> IO[bytes]:
+        # The stream is only ever read forward, so it can be a pipe.
+        match self:
+            case Codec.GZIP:
+                return cast("IO[bytes]", gzip.GzipFile(fileobj=stream))
+            case Codec.BZIP2:
+                return cast("IO[bytes]", bz2.BZ2File(stream))
+            case Codec.XZ:
+                return cast("IO[bytes]", lzma.LZMAFile(stream))
+        return stream
+
+
+CODEC_EXTENSIONS = {
+    Codec.NONE: "",
+    Codec.GZIP: ".gz",
+    Codec.BZIP2: ".bz2",
+    Codec.XZ: ".xz",
+}
+
+
+def compress_graph(graph_path: Path, codec: Codec,
+                   level: int) -> tuple[Path, CompressionStats]:
+    # Compresses the graph to a file next to it (and removes the original),
+    # returning the path to the compressed file.
+    if codec == Codec.NONE:
+        size = graph_path.stat().st_size
+        return graph_path, CompressionStats(codec.value, size, size, 0)
+
+    compressed_path = graph_path.with_name(graph_path.name
+                                           + codec.extension())
+    # Only counts the time spent by this thread, so background uploads
+    # aren't counted as compression.
+    start = time.thread_time()
+    with open(graph_path, "rb") as graph_file, \
+            codec.open_writer(compressed_path, level) as compressed_file:
+        while chunk := graph_file.read(CHUNK_SIZE):
+            compressed_file.write(chunk)
+    cpu_secs = time.thread_time() - start
+
+    stats = CompressionStats(codec.value, graph_path.stat().st_size,
+                             compressed_path.stat().st_size, cpu_secs)
+    graph_path.unlink()
+    return compressed_path, stats
@@ -0,0 +1,126 @@
+from contextlib import contextmanager
+import fcntl
+import io
+import os
+from pathlib import Path
+import tempfile
+import time
+from typing import IO, Iterator, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from _typeshed import WriteableBuffer
+    from pgcrawl.logging import Logger
+
+
+DEFAULT_GRAPH_CACHE_BYTES = 2 * 1024 ** 3
+# Partly written graphs older than this were left by a query that died.
+STALE_PART_SECS = 60 * 60
+GRAPH_SUFFIX = ".graph"
+PART_SUFFIX = ".part"
+LOCK_NAME = ".lock"
+
+
+# Copies everything read from a stream to a file, so a graph can be cached
+# in the same pass that queries it.
+class TeeReader(io.RawIOBase):
+    stream: IO[bytes]
+    copy: IO[bytes]
+
+    def __init__(self, stream: IO[bytes], copy: IO[bytes]) -> None:
+        super().__init__()
+        self.stream = stream
+        self.copy = copy
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: "WriteableBuffer") -> int:
+        view = memoryview(buffer).cast("B")
+        data = self.stream.read(len(view))
+        view[:len(data)] = data
+        self.copy.write(data)
+        return len(data)
+
+
+# Graphs (as stored, so still compressed) that have already been downloaded
+# to this client, by their digest, so querying the same graph again doesn't
+# download it again. Once the cache is over its budget, the graphs that
+# were least recently used are removed. The cache is shared by every query
+# process on the client, so graphs only ever appear in it whole (by being
+# renamed into place), and evictions are serialized with a file lock.
+class GraphCache:
+    cache_dir: Path
+    max_bytes: int
+
+    def __init__(self, cache_dir: Path, max_bytes: int) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def path(self, digest: str) -> Path:
+        return self.cache_dir / f"{digest}{GRAPH_SUFFIX}"
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.cache_dir / LOCK_NAME, "wb") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def open(self, digest: Optional[str]) -> Optional[IO[bytes]]:
+        # pylint: disable=consider-using-with
+        if not digest:
+            return None
+        path = self.path(digest)
+        try:
+            graph_file = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        # Graphs are evicted by when they were last used, which is tracked
+        # with their modification time (since access times often aren't).
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return graph_file
+
+    def new_part(self) -> IO[bytes]:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        return tempfile.NamedTemporaryFile(dir=self.cache_dir,
+                                           suffix=PART_SUFFIX, delete=False)
+
+    def add(self, part_path: Path, digest: str, logger: "Logger") -> None:
+        with self.locked():
+            try:
+                os.replace(part_path, self.path(digest))
+            except OSError as e:
+                logger.error(f"Unable to cache graph {digest}: {e}")
+                part_path.unlink(missing_ok=True)
+                return
+            self.evict(logger)
+
+    def evict(self, logger: "Logger") -> None:
+        # Only called with the lock held.
+        graphs = []
+        now = time.time()
+        for path in self.cache_dir.iterdir():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if path.suffix == GRAPH_SUFFIX:
+                graphs.append((stat.st_mtime, stat.st_size, path))
+            elif path.suffix == PART_SUFFIX \
+                    and now - stat.st_mtime > STALE_PART_SECS:
+                path.unlink(missing_ok=True)
+
+        total_bytes = sum(size for _, size, _ in graphs)
+        for _, size, path in sorted(graphs):
+            if total_bytes <= self.max_bytes:
+                break
+            logger.debug(f"Evicting {path.name} from the graph cache")
+            # Queries that already have the graph open can still read it.
+            path.unlink(missing_ok=True)
+            total_bytes -= size
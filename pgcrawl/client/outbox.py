@@ -0,0 +1,156 @@
+from dataclasses import dataclass, replace
+from pathlib import Path
+import queue
+import threading
+import time
+from typing import Optional, TYPE_CHECKING
+import urllib.parse
+
+from pgcrawl.client.actions import UrlRequest, write_crawl_results
+from pgcrawl.results import OutboxStats
+from pgcrawl.storage import open_storage
+
+if TYPE_CHECKING:
+    from pgcrawl.logging import Logger
+
+
+DEFAULT_UPLOAD_WORKERS = 2
+DEFAULT_UPLOAD_RETRIES = 3
+# Seconds to wait before the first retry of a failed upload, doubling after
+# each further failure.
+UPLOAD_BACKOFF_SECS = 5
+
+
+@dataclass
+class Upload:
+    request: UrlRequest
+    path: Path
+    # Where the graph is to be uploaded to (see open_storage)
+    storage: str
+    # When the graph was put in the outbox
+    queued_at: float
+
+
+# Uploads graphs to S3 in the background, so that a slot can start its next
+# crawl as soon as the browser is done, instead of waiting on S3. Graphs
+# wait in the slot's outbox directory (under a directory per storage) until
+# they've been uploaded, so any that a previous worker didn't get to are
+# picked up again when the next one starts. Graphs that can't be uploaded,
+# even after retrying, are dropped, and reported as failed, so that the
+# dispatcher crawls them again.
+class Outbox:
+    # pylint: disable=too-many-instance-attributes
+    outbox_dir: Path
+    num_workers: int
+    max_retries: int
+    logger: "Logger"
+    uploads: "queue.Queue[Optional[Upload]]"
+    threads: list[threading.Thread]
+    lock: threading.Lock
+    stats_: OutboxStats
+    upload_secs: float
+
+    def __init__(self, outbox_dir: Path, num_workers: int, max_retries: int,
+                 logger: "Logger") -> None:
+        self.outbox_dir = outbox_dir
+        self.num_workers = num_workers
+        self.max_retries = max_retries
+        self.logger = logger
+        self.uploads = queue.Queue()
+        self.threads = []
+        self.lock = threading.Lock()
+        self.stats_ = OutboxStats()
+        self.upload_secs = 0
+
+    def start(self) -> None:
+        self.outbox_dir.mkdir(parents=True, exist_ok=True)
+        for graph_path in sorted(self.outbox_dir.rglob("*.graphml*")):
+            storage = urllib.parse.unquote(graph_path.parent.name)
+            try:
+                request = UrlRequest.from_graph_name(graph_path.name)
+            except ValueError:
+                self.logger.error(f"Not a graph, skipping: {graph_path}")
+                continue
+            self.logger.debug(f"Found {graph_path} waiting for upload")
+            self.enqueue(Upload(request, graph_path, storage,
+                                time.monotonic()))
+
+        for _ in range(self.num_workers):
+            thread = threading.Thread(target=self.upload_loop, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def enqueue(self, upload: Upload) -> None:
+        with self.lock:
+            self.stats_.depth += 1
+        self.uploads.put(upload)
+
+    def put(self, request: UrlRequest, graph_path: Path,
+            storage: str) -> None:
+        storage_dir = self.outbox_dir / urllib.parse.quote(storage, safe="")
+        storage_dir.mkdir(parents=True, exist_ok=True)
+        outbox_path = storage_dir / graph_path.name
+        graph_path.replace(outbox_path)
+        self.enqueue(Upload(request, outbox_path, storage,
+                            time.monotonic()))
+
+    def upload(self, upload: Upload) -> bool:
+        # pylint: disable=broad-exception-caught
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                time.sleep(UPLOAD_BACKOFF_SECS * 2 ** (attempt - 1))
+            try:
+                if write_crawl_results(upload.request, upload.path,
+                                       open_storage(upload.storage),
+                                       self.logger):
+                    return True
+            except Exception as e:
+                self.logger.error(f"Unable to upload {upload.path}: {e}")
+        return False
+
+    def upload_loop(self) -> None:
+        while (upload := self.uploads.get()) is not None:
+            start = time.monotonic()
+            is_uploaded = self.upload(upload)
+            end = time.monotonic()
+            with self.lock:
+                self.stats_.depth -= 1
+                if is_uploaded:
+                    self.stats_.uploaded += 1
+                    self.stats_.uploaded_ranks.append(upload.request.rank)
+                    self.stats_.upload_secs.append(end - start)
+                    self.upload_secs += end - start
+                    self.stats_.last_latency_secs = end - upload.queued_at
+                    self.stats_.mean_upload_secs = (
+                        self.upload_secs / self.stats_.uploaded)
+                else:
+                    self.stats_.failed += 1
+                    self.stats_.failed_ranks.append(upload.request.rank)
+            if not is_uploaded:
+                self.logger.error(f"Giving up uploading {upload.path} "
+                                  f"after {self.max_retries + 1} attempts")
+                upload.path.unlink(missing_ok=True)
+            self.uploads.task_done()
+
+    def report(self) -> OutboxStats:
+        # Graphs uploaded (or given up on) are only reported once.
+        with self.lock:
+            stats = replace(self.stats_)
+            self.stats_.uploaded_ranks = []
+            self.stats_.failed_ranks = []
+            self.stats_.upload_secs = []
+        return stats
+
+    def flush(self) -> OutboxStats:
+        # Waits for every graph in the outbox to be uploaded, or given up
+        # on, and reports what became of them.
+        self.uploads.join()
+        return self.report()
+
+    def close(self) -> None:
+        # Waits for everything already in the outbox to be uploaded.
+        for _ in self.threads:
+            self.uploads.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
@@ -0,0 +1,180 @@
+from dataclasses import dataclass, field
+from typing import IO
+import xml.etree.ElementTree as ET
+
+from pgcrawl.types import JSONDict
+
+
+# Version of what the queries compute. It's recorded with every result,
+# and bumped whenever what's computed changes, so results of different
+# versions are never mixed (or served from caches).
+#
+# 1: pagegraph-query's `subframes -l`, `requests`, `js-calls` and
+#    `html -b -s` commands, piped through jq, for each child frame (with
+#    each value being jq's raw output, e.g., "b'3\\n'").
+# 2: one pass over the GraphML, keyed and counted by rules of its own.
+# 3: one pass over the GraphML (see query_frames), keyed like `subframes`
+#    keys child frames, and counting what each of the other commands
+#    reports for the frame (see GraphIndex), as numbers. tests/
+#    test_queries.py checks this against pagegraph-query itself.
+QUERY_FORMAT = 3
+
+GRAPHML_NS = "{http://graphml.graphdrawing.org/xmlns}"
+KEY_TAG = f"{GRAPHML_NS}key"
+GRAPH_TAG = f"{GRAPHML_NS}graph"
+NODE_TAG = f"{GRAPHML_NS}node"
+EDGE_TAG = f"{GRAPHML_NS}edge"
+DATA_TAG = f"{GRAPHML_NS}data"
+
+# Names of the PageGraph attributes (and their values) that queries use.
+NODE_TYPE_ATTR = "node type"
+EDGE_TYPE_ATTR = "edge type"
+FRAME_ID_ATTR = "frame id"
+TAG_NAME_ATTR = "tag name"
+REQUEST_ID_ATTR = "request id"
+DOM_ROOT_TYPE = "DOM root"
+HTML_ELEMENT_TYPE = "HTML element"
+FRAME_OWNER_TYPE = "frame owner"
+CROSS_DOM_EDGE = "cross DOM"
+REQUEST_START_EDGE = "request start"
+JS_CALL_EDGE = "js call"
+CREATE_NODE_EDGE = "create node"
+INSERT_NODE_EDGE = "insert node"
+REMOVE_NODE_EDGE = "remove node"
+DELETE_NODE_EDGE = "delete node"
+ELEMENT_TYPES = {HTML_ELEMENT_TYPE, FRAME_OWNER_TYPE}
+
+
+@dataclass
+class FrameCounts:
+    requests: int = 0
+    js: int = 0
+    html: int = 0
+
+    def to_dict(self) -> dict[str, int]:
+        return {
+            "requests": self.requests,
+            "js": self.js,
+            "html": self.html,
+        }
+
+
+# What's kept about a graph while it's streamed, which is only as much as
+# is needed to attribute edges to frames, instead of the graph itself.
+# Child frames are the DOM roots that <iframe> elements hold (through
+# "cross DOM" edges), keyed by their node ids, as `subframes` keys them.
+# Several DOM roots can belong to the same frame (e.g., an iframe's initial
+# about:blank document, and the one it then loads), and, like pagegraph-
+# query's -f option, everything done in the frame counts for each.
+# For each frame,
+#   - requests are the distinct request ids of its "request start" edges,
+#   - js calls are its "js call" edges, and
+#   - html elements are the elements (including frame owners) created in
+#     it that are still in a document when the graph was serialized (i.e.,
+#     were last inserted, rather than removed or deleted).
+@dataclass
+class GraphIndex:
+    # pylint: disable=too-many-instance-attributes
+    # GraphML key ids, to the names of the attributes they're for
+    key_names: dict[str, str] = field(default_factory=dict)
+    # Ids of DOM root nodes, to the id of the frame they're the root of
+    dom_roots: dict[str, str] = field(default_factory=dict)
+    iframes: set[str] = field(default_factory=set)
+    # Ids of element nodes, to the id of the frame they were created in
+    elements: dict[str, str] = field(default_factory=dict)
+    attached: set[str] = field(default_factory=set)
+    # Ids of the DOM roots of child frames, in the order they're embedded
+    subframe_roots: list[str] = field(default_factory=list)
+    request_ids: dict[str, set[str]] = field(default_factory=dict)
+    js_calls: dict[str, int] = field(default_factory=dict)
+
+    def attrs(self, elm: ET.Element) -> dict[str, str]:
+        return {self.key_names.get(x.get("key", ""), ""): x.text or ""
+                for x in elm.iter(DATA_TAG)}
+
+    def add_node(self, elm: ET.Element) -> None:
+        attrs = self.attrs(elm)
+        node_id = elm.get("id", "")
+        node_type = attrs.get(NODE_TYPE_ATTR)
+        if node_type == DOM_ROOT_TYPE:
+            self.dom_roots[node_id] = attrs.get(FRAME_ID_ATTR, node_id)
+        elif node_type in ELEMENT_TYPES:
+            self.elements[node_id] = ""
+            if attrs.get(TAG_NAME_ATTR, "").lower() == "iframe":
+                self.iframes.add(node_id)
+
+    def add_edge(self, elm: ET.Element) -> None:
+        attrs = self.attrs(elm)
+        edge_type = attrs.get(EDGE_TYPE_ATTR)
+        target = elm.get("target", "")
+        if edge_type == CROSS_DOM_EDGE:
+            if elm.get("source") in self.iframes \
+                    and target in self.dom_roots:
+                self.subframe_roots.append(target)
+            return
+        if edge_type in (INSERT_NODE_EDGE, REMOVE_NODE_EDGE,
+                         DELETE_NODE_EDGE):
+            if target in self.elements:
+                if edge_type == INSERT_NODE_EDGE:
+                    self.attached.add(target)
+                else:
+                    self.attached.discard(target)
+            return
+        frame_id = attrs.get(FRAME_ID_ATTR)
+        if frame_id is None:
+            return
+        if edge_type == REQUEST_START_EDGE:
+            request_id = attrs.get(REQUEST_ID_ATTR, elm.get("id", ""))
+            self.request_ids.setdefault(frame_id, set()).add(request_id)
+        elif edge_type == JS_CALL_EDGE:
+            self.js_calls[frame_id] = self.js_calls.get(frame_id, 0) + 1
+        elif edge_type == CREATE_NODE_EDGE and target in self.elements:
+            self.elements[target] = frame_id
+
+    def frame_counts(self) -> dict[str, FrameCounts]:
+        counts: dict[str, FrameCounts] = {}
+        for frame_id, request_ids in self.request_ids.items():
+            counts.setdefault(frame_id, FrameCounts()).requests = \
+                len(request_ids)
+        for frame_id, num_calls in self.js_calls.items():
+            counts.setdefault(frame_id, FrameCounts()).js = num_calls
+        for node_id in self.attached:
+            frame_id = self.elements[node_id]
+            if frame_id:
+                counts.setdefault(frame_id, FrameCounts()).html += 1
+        return counts
+
+    def subframe_counts(self) -> JSONDict:
+        counts = self.frame_counts()
+        results = {}
+        for root_id in self.subframe_roots:
+            frame_counts = counts.get(self.dom_roots[root_id], FrameCounts())
+            results[root_id] = frame_counts.to_dict()
+        return results
+
+
+def query_frames(stream: IO[bytes]) -> JSONDict:
+    # Counts the requests, JS calls and HTML elements in each of the page's
+    # child frames, reading the graph once, as it's streamed. PageGraph
+    # writes every node before any edge, so nodes are always indexed by
+    # the time an edge refers to them.
+    index = GraphIndex()
+    graph = None
+    for event, elm in ET.iterparse(stream, events=("start", "end")):
+        if event == "start":
+            if elm.tag == GRAPH_TAG:
+                graph = elm
+            continue
+        if elm.tag == KEY_TAG:
+            index.key_names[elm.get("id", "")] = elm.get("attr.name", "")
+        elif elm.tag == NODE_TAG:
+            index.add_node(elm)
+        elif elm.tag == EDGE_TAG:
+            index.add_edge(elm)
+        else:
+            continue
+        # Nodes and edges are dropped as soon as they've been indexed.
+        elm.clear()
+        if graph is not None:
+            graph.clear()
+    return index.subframe_counts()
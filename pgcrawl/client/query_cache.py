@@ -0,0 +1,185 @@
+import hashlib
+import io
+import json
+import os
+from pathlib import Path
+import threading
+from typing import IO, Optional, TYPE_CHECKING, cast
+
+from pgcrawl.client import QUERY_CACHE_DIR
+from pgcrawl.client.queries import QUERY_FORMAT
+from pgcrawl.results import QueryCacheStats
+from pgcrawl.storage import StorageError
+from pgcrawl.types import JSONDict
+
+if TYPE_CHECKING:
+    from _typeshed import WriteableBuffer
+    from pgcrawl.logging import Logger
+    from pgcrawl.storage import Storage
+
+
+# Each graph's SHA-256 digest is stored next to it, under its key plus this
+DIGEST_SUFFIX = ".sha256"
+
+
+def digest_key(graph_key: str) -> str:
+    return graph_key + DIGEST_SUFFIX
+
+
+def results_key(digest: str) -> str:
+    # Results cached by earlier versions of the queries are recomputed.
+    return f"queries/v{QUERY_FORMAT}/{digest}.json"
+
+
+def file_digest(path: Path) -> str:
+    with open(path, "rb") as handle:
+        return hashlib.file_digest(handle, "sha256").hexdigest()
+
+
+def read_stored_digest(storage: "Storage", graph_key: str,
+                       logger: "Logger") -> Optional[str]:
+    # The digest is written (only) when the graph is uploaded, so this
+    # doesn't need the graph itself.
+    try:
+        with storage.get(digest_key(graph_key)) as stream:
+            return stream.read().decode("utf8").strip()
+    except StorageError as e:
+        logger.debug(f"No digest for {storage.url(graph_key)}: {e}")
+    return None
+
+
+# Computes the digest of a stream as it's read, so a graph can be hashed in
+# the same pass that queries it.
+class DigestReader(io.RawIOBase):
+    stream: IO[bytes]
+    hasher: "hashlib._Hash"
+
+    def __init__(self, stream: IO[bytes]) -> None:
+        super().__init__()
+        self.stream = stream
+        self.hasher = hashlib.sha256()
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: "WriteableBuffer") -> int:
+        view = memoryview(buffer).cast("B")
+        data = self.stream.read(len(view))
+        view[:len(data)] = data
+        self.hasher.update(data)
+        return len(data)
+
+    def hexdigest(self) -> str:
+        # Anything left unread (e.g., trailing whitespace after the graph)
+        # is still part of the digest.
+        while self.read(io.DEFAULT_BUFFER_SIZE):
+            pass
+        return self.hasher.hexdigest()
+
+
+# Query results, kept both in a local directory and next to the graphs in
+# storage, and addressed by the digest of the (stored) graph and the
+# version of the queries, so a graph is only ever queried again if it's
+# recrawled or the queries change.
+class QueryCache:
+    cache_dir: Path
+    stats: QueryCacheStats
+    lock: threading.Lock
+
+    def __init__(self, cache_dir: Path) -> None:
+        self.cache_dir = cache_dir
+        self.stats = QueryCacheStats()
+        self.lock = threading.Lock()
+
+    def local_path(self, digest: str) -> Path:
+        return self.cache_dir / results_key(digest)
+
+    def get(self, storage: "Storage", digest: Optional[str],
+            logger: "Logger") -> Optional[JSONDict]:
+        if not digest:
+            self.record()
+            return None
+        local_path = self.local_path(digest)
+        results = self.read_local(local_path, logger)
+        if results is not None:
+            self.record(local_hit=True)
+            return results
+        results = self.read_remote(storage, digest, logger)
+        if results is None:
+            self.record()
+            return None
+        self.record(remote_hit=True)
+        self.write_local(local_path, results, logger)
+        return results
+
+    def put(self, storage: "Storage", digest: str, results: JSONDict,
+            logger: "Logger") -> None:
+        # Only the results are written, never the graph's digest: a query
+        # can't know the graph it read is still the one in storage (e.g.,
+        # if the domain was recrawled while it ran), so a digest written
+        # here could end up next to a newer graph, and its results used for
+        # it. Graphs uploaded without a digest are always queried again, so
+        # nothing is cached for them (see run_queries).
+        local_path = self.local_path(digest)
+        if not self.write_local(local_path, results, logger):
+            return
+        try:
+            storage.put(local_path, results_key(digest))
+        except StorageError as e:
+            logger.error(f"Unable to cache query results: {e}")
+
+    def read_local(self, path: Path, logger: "Logger") -> Optional[JSONDict]:
+        try:
+            with open(path, "rb") as handle:
+                return cast(JSONDict, json.load(handle))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.error(f"Ignoring unreadable cached results {path}: {e}")
+            return None
+
+    def read_remote(self, storage: "Storage", digest: str,
+                    logger: "Logger") -> Optional[JSONDict]:
+        key = results_key(digest)
+        try:
+            with storage.get(key) as stream:
+                return cast(JSONDict, json.load(stream))
+        except StorageError as e:
+            logger.debug(f"No cached results at {storage.url(key)}: {e}")
+        except ValueError as e:
+            logger.error(f"Ignoring unreadable {storage.url(key)}: {e}")
+        return None
+
+    def write_local(self, path: Path, results: JSONDict,
+                    logger: "Logger") -> bool:
+        tmp_path = path.with_name(path.name + ".part")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_text(json.dumps(results), "utf8")
+            os.replace(tmp_path, path)
+            return True
+        except OSError as e:
+            tmp_path.unlink(missing_ok=True)
+            logger.error(f"Unable to cache query results at {path}: {e}")
+            return False
+
+    def record(self, local_hit: bool = False,
+               remote_hit: bool = False) -> None:
+        with self.lock:
+            if local_hit:
+                self.stats.local_hits += 1
+            elif remote_hit:
+                self.stats.remote_hits += 1
+            else:
+                self.stats.misses += 1
+
+    def stats_desc(self) -> str:
+        with self.lock:
+            stats = self.stats
+            return (f"query cache: {stats.local_hits} local hits, "
+                    f"{stats.remote_hits} remote hits, {stats.misses} "
+                    f"misses ({stats.hit_rate():.0%} hit rate)")
+
+
+# The cache shared by every query this process runs
+QUERY_CACHE = QueryCache(QUERY_CACHE_DIR)
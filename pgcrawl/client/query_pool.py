@@ -0,0 +1,187 @@
+from contextlib import redirect_stdout
+from dataclasses import dataclass
+import multiprocessing
+from multiprocessing.connection import Connection, wait
+from multiprocessing.process import BaseProcess
+import os
+import sys
+import time
+from typing import Callable, Iterator, Optional, TYPE_CHECKING, cast
+
+if TYPE_CHECKING:
+    from pgcrawl.client.actions import UrlRequest
+    from pgcrawl.client.args import ClientQueryArgs
+    from pgcrawl.logging import Logger
+    from pgcrawl.types import JSONDict
+
+
+# However many cores the host has, no more than this many graphs are
+# queried at once, since each also holds a download (and its index).
+MAX_QUERY_WORKERS = 16
+# Seconds to wait for idle workers to exit when the pool is closed
+WORKER_EXIT_TIMEOUT = 5
+
+
+def default_query_workers() -> int:
+    return max(1, min(os.cpu_count() or 1, MAX_QUERY_WORKERS))
+
+
+# Queries the graph for a URL and rank (i.e., commands.query_graph)
+QueryFunc = Callable[[str, int, "ClientQueryArgs", "Logger"],
+                     "JSONDict | bool"]
+
+
+def query_worker(conn: Connection, query_func: QueryFunc,
+                 args: "ClientQueryArgs", logger: "Logger") -> None:
+    # Anything the worker logs goes to stderr, so the parent's stdout is
+    # only ever written to by the parent.
+    with redirect_stdout(sys.stderr):
+        while True:
+            try:
+                request = conn.recv()
+            except EOFError:
+                return
+            if request is None:
+                return
+            conn.send(query_func(request.url, request.rank, args, logger))
+
+
+# A worker process, and the graph it's querying, if any.
+@dataclass
+class QueryWorker:
+    process: BaseProcess
+    conn: Connection
+    index: Optional[int] = None
+    deadline: Optional[float] = None
+
+
+# Queries graphs concurrently, each in one of a fixed number of worker
+# processes (so a graph's parse uses a core of its own), and each with a
+# timeout of its own. A worker that's still querying a graph once its
+# timeout has passed is killed and replaced, so a pathological graph only
+# ever costs that graph.
+class QueryPool:
+    query_func: QueryFunc
+    args: "ClientQueryArgs"
+    num_workers: int
+    logger: "Logger"
+    workers: list[QueryWorker]
+
+    def __init__(self, query_func: QueryFunc, args: "ClientQueryArgs",
+                 num_workers: int, logger: "Logger") -> None:
+        self.query_func = query_func
+        self.args = args
+        self.num_workers = num_workers
+        self.logger = logger
+        self.workers = []
+
+    def start_worker(self) -> QueryWorker:
+        # Workers are started from a clean server process, instead of
+        # being forked from this one, so they never inherit its threads
+        # or its (S3) connections.
+        context = multiprocessing.get_context("forkserver")
+        parent_conn, child_conn = context.Pipe()
+        process = context.Process(target=query_worker,
+                                  args=(child_conn, self.query_func,
+                                        self.args, self.logger),
+                                  daemon=True)
+        process.start()
+        child_conn.close()
+        worker = QueryWorker(process, parent_conn)
+        self.workers.append(worker)
+        return worker
+
+    def stop_worker(self, worker: QueryWorker) -> None:
+        worker.process.kill()
+        worker.process.join()
+        worker.conn.close()
+        self.workers.remove(worker)
+
+    def assign(self, worker: QueryWorker, index: int,
+               request: "UrlRequest") -> None:
+        worker.index = index
+        worker.deadline = None
+        if self.args.timeout > 0:
+            worker.deadline = time.monotonic() + self.args.timeout
+        worker.conn.send(request)
+
+    def wait_timeout(self) -> Optional[float]:
+        deadlines = [x.deadline for x in self.workers if x.deadline]
+        if not deadlines:
+            return None
+        return max(min(deadlines) - time.monotonic(), 0)
+
+    def collect(self) -> Iterator[tuple[int, "JSONDict | bool"]]:
+        # Yields the results of whichever graphs finish (or time out)
+        # next, freeing their workers.
+        busy = {x.conn: x for x in self.workers if x.index is not None}
+        ready = wait(list(busy), self.wait_timeout())
+        for conn in cast(list[Connection], ready):
+            worker = busy[conn]
+            assert worker.index is not None
+            index = worker.index
+            result: "JSONDict | bool"
+            try:
+                result = conn.recv()
+                worker.index = None
+                worker.deadline = None
+            except (EOFError, OSError):
+                self.logger.error(f"Query worker {worker.process.pid} died")
+                self.stop_worker(worker)
+                result = False
+            yield index, result
+
+        now = time.monotonic()
+        for worker in list(self.workers):
+            if worker.index is not None and worker.deadline \
+                    and worker.deadline <= now:
+                self.logger.error(
+                    f"Query timed out after {self.args.timeout} seconds")
+                index = worker.index
+                self.stop_worker(worker)
+                yield index, False
+
+    def run(self, requests: list["UrlRequest"], ordered: bool = True
+            ) -> Iterator[tuple["UrlRequest", "JSONDict | bool"]]:
+        # Yields each request with its result, either in the order the
+        # requests were given (whatever order they finish in), as soon as
+        # every request before it has finished, or if not ordered, as soon
+        # as it finishes.
+        results: dict[int, "JSONDict | bool"] = {}
+        next_to_send = 0
+        next_to_yield = 0
+        try:
+            while next_to_yield < len(requests):
+                idle = [x for x in self.workers if x.index is None]
+                while next_to_send < len(requests):
+                    if not idle:
+                        if len(self.workers) >= self.num_workers:
+                            break
+                        idle.append(self.start_worker())
+                    self.assign(idle.pop(), next_to_send,
+                                requests[next_to_send])
+                    next_to_send += 1
+
+                for index, result in self.collect():
+                    if not ordered:
+                        next_to_yield += 1
+                        yield requests[index], result
+                        continue
+                    results[index] = result
+                while next_to_yield in results:
+                    yield (requests[next_to_yield],
+                           results.pop(next_to_yield))
+                    next_to_yield += 1
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        for worker in self.workers:
+            if worker.index is None:
+                try:
+                    worker.conn.send(None)
+                except OSError:
+                    pass
+        for worker in list(self.workers):
+            worker.process.join(WORKER_EXIT_TIMEOUT)
+            self.stop_worker(worker)
@@ -0,0 +1,91 @@
+from contextlib import redirect_stderr, redirect_stdout
+from dataclasses import asdict
+from io import StringIO
+import json
+import sys
+from typing import Any, Optional, TextIO
+
+from pgcrawl.client.args import ClientCrawlArgs, ClientQueryArgs
+from pgcrawl.client.commands import crawl_url, query_graph
+from pgcrawl.client.outbox import Outbox
+from pgcrawl.client.slots import Slot
+from pgcrawl.logging import Logger
+
+
+# Jobs and results are exchanged as one JSON object per line. Jobs look like
+#   {"id": 1, "command": "crawl", "url": "...", "rank": 1, "args": {...}}
+# where "args" are the fields of ClientCrawlArgs or ClientQueryArgs, and
+# results look like
+#   {"id": 1, "success": true, "result": ..., "log": "..."}
+JobDict = dict[str, Any]
+
+
+def run_job(job: JobDict, slot: Slot, outbox: Optional[Outbox],
+            logger: Logger) -> Any:
+    match job["command"]:
+        case "ping":
+            return True
+        case "crawl":
+            crawl_args = ClientCrawlArgs(**job["args"])
+            return crawl_url(job["url"], job["rank"], crawl_args, slot,
+                             outbox, logger).to_dict()
+        case "query":
+            query_args = ClientQueryArgs(**job["args"])
+            return query_graph(job["url"], job["rank"], query_args, logger)
+        case "flush":
+            # Sent by the dispatcher before it stops, so the last graphs
+            # crawled are confirmed as uploaded.
+            return asdict(outbox.flush()) if outbox else True
+        case _:
+            raise ValueError(f"Unknown command: {job['command']}")
+
+
+def is_job_success(result: Any) -> bool:
+    # Crawl jobs return a result that says whether they succeeded, and
+    # other jobs return False on failure.
+    if isinstance(result, dict) and isinstance(result.get("success"), bool):
+        return bool(result["success"])
+    return result is not False
+
+
+def handle_job(line: str, slot: Slot, outbox: Optional[Outbox],
+               logger: Logger) -> JobDict:
+    # pylint: disable=broad-exception-caught
+    job_id = None
+    # Anything the job logs is returned along with the result, so that
+    # nothing but results is ever written to the output stream.
+    log_stream = StringIO()
+    with redirect_stdout(log_stream), redirect_stderr(log_stream):
+        try:
+            job = json.loads(line)
+            job_id = job.get("id")
+            result = run_job(job, slot, outbox, logger)
+        except Exception as e:
+            logger.error(f"Job failed: {e}")
+            result = False
+    return {
+        "id": job_id,
+        "success": is_job_success(result),
+        "result": result,
+        "log": log_stream.getvalue(),
+    }
+
+
+def serve(slot: Slot, in_stream: TextIO, out_stream: TextIO,
+          outbox: Optional[Outbox], logger: Logger) -> bool:
+    # The outbox uploads graphs from other threads, between jobs too, so
+    # anything it logs then goes to stderr instead of the output stream.
+    with redirect_stdout(sys.stderr):
+        if outbox:
+            outbox.start()
+        try:
+            for line in in_stream:
+                if line.strip() == "":
+                    continue
+                response = handle_job(line, slot, outbox, logger)
+                out_stream.write(json.dumps(response) + "\n")
+                out_stream.flush()
+        finally:
+            if outbox:
+                outbox.close()
+    return True
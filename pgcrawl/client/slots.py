@@ -0,0 +1,179 @@
+from dataclasses import dataclass
+import os
+from pathlib import Path
+import shutil
+import signal
+from subprocess import Popen, DEVNULL
+import time
+from typing import Optional, TYPE_CHECKING
+
+from pgcrawl.client import OUTBOX_DIR, TMP_DIR
+
+if TYPE_CHECKING:
+    from pgcrawl.logging import Logger
+
+
+# Slot N uses X display :(XVFB_DISPLAY_BASE + N)
+XVFB_DISPLAY_BASE = 99
+XVFB_SCREEN = "1280x1024x24"
+XVFB_START_TIMEOUT = 10
+# Maximum number of seconds to wait for a killed browser to actually exit
+REAP_TIMEOUT = 10
+# Browser profiles are copied for every crawl, so they're kept in memory
+# when possible.
+SHM_DIR = Path("/dev/shm")
+
+
+def process_group_members(pgid: int) -> list[int]:
+    # Returns the ids of the (non-zombie) processes in the group.
+    members = []
+    for stat_path in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            # The command name (in parentheses) can contain spaces.
+            fields = stat_path.read_text("utf8").rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        state, pgrp = fields[0], int(fields[2])
+        if pgrp == pgid and state != "Z":
+            members.append(int(stat_path.parent.name))
+    return members
+
+
+def process_exe_name(pid: int) -> Optional[str]:
+    # Returns the name of the executable the process is running, if it's
+    # still running.
+    try:
+        return Path(os.readlink(f"/proc/{pid}/exe")).name
+    except OSError:
+        return None
+
+
+def is_process_running(pid: int, name: str) -> bool:
+    try:
+        return Path(f"/proc/{pid}/comm").read_text("utf8").strip() == name
+    except OSError:
+        return False
+
+
+# A slot is one of the (possibly many) concurrent crawls a client host
+# runs. Each slot gets its own X display, which is started once and kept
+# running between crawls, its own temp directory (which the browser also
+# uses for its profile), and its own process group for the browser, so
+# that cleaning up after a crawl in one slot never touches crawls in other
+# slots, or the slot's display.
+@dataclass
+class Slot:
+    index: int = 0
+
+    def display_num(self) -> int:
+        return XVFB_DISPLAY_BASE + self.index
+
+    def display(self) -> str:
+        return f":{self.display_num()}"
+
+    def xvfb_files(self) -> list[Path]:
+        return [Path(f"/tmp/.X{self.display_num()}-lock"),
+                Path(f"/tmp/.X11-unix/X{self.display_num()}")]
+
+    def tmp_dir(self) -> Path:
+        return TMP_DIR / f"slot-{self.index}"
+
+    def outbox_dir(self) -> Path:
+        return OUTBOX_DIR / f"slot-{self.index}"
+
+    def profiles_dir(self) -> Path:
+        if SHM_DIR.is_dir():
+            return SHM_DIR / "pgcrawl" / f"slot-{self.index}"
+        return self.tmp_dir() / "profiles"
+
+    def pgid_file(self) -> Path:
+        return self.tmp_dir() / "pgid"
+
+    def xvfb_pid_file(self) -> Path:
+        return self.tmp_dir() / "xvfb-pid"
+
+    def env(self) -> dict[str, str]:
+        env = dict(os.environ)
+        env["DISPLAY"] = self.display()
+        # pagegraph-crawl (and the browser) create their profile and other
+        # scratch directories under TMPDIR.
+        env["TMPDIR"] = str(self.profiles_dir().absolute())
+        return env
+
+    def prepare(self, logger: "Logger") -> bool:
+        # Returns False if the slot's display couldn't be started.
+        self.tmp_dir().mkdir(parents=True, exist_ok=True)
+        self.reap(logger)
+        self.profiles_dir().mkdir(parents=True, exist_ok=True)
+        return self.ensure_xvfb(logger)
+
+    def record_process_group(self, pgid: int) -> None:
+        self.pgid_file().write_text(str(pgid))
+
+    def kill_process_group(self, pgid: int, logger: "Logger") -> bool:
+        # Returns True once every process in the group has exited.
+        try:
+            os.killpg(pgid, signal.SIGKILL)
+            logger.debug(f"Killed process group {pgid} for slot {self.index}")
+        except ProcessLookupError:
+            return True
+        deadline = time.monotonic() + REAP_TIMEOUT
+        while process_group_members(pgid):
+            if time.monotonic() > deadline:
+                logger.error(f"Process group {pgid} for slot {self.index} "
+                             f"still running after {REAP_TIMEOUT}s")
+                return False
+            time.sleep(0.05)
+        return True
+
+    def reap(self, logger: "Logger") -> bool:
+        # Cleans up the browser (and anything else it started) from the
+        # last crawl in this slot, if it didn't get to clean up after
+        # itself, and returns whether it's all gone. The display is left
+        # running for the next crawl.
+        is_reaped = True
+        pgid_file = self.pgid_file()
+        if pgid_file.is_file():
+            is_reaped = self.kill_process_group(int(pgid_file.read_text()),
+                                                logger)
+            pgid_file.unlink()
+        shutil.rmtree(self.profiles_dir(), ignore_errors=True)
+        return is_reaped
+
+    def running_xvfb_pid(self) -> Optional[int]:
+        pid_file = self.xvfb_pid_file()
+        if not pid_file.is_file():
+            return None
+        pid = int(pid_file.read_text())
+        if is_process_running(pid, "Xvfb") and self.xvfb_files()[1].exists():
+            return pid
+        return None
+
+    def ensure_xvfb(self, logger: "Logger") -> bool:
+        # Starts the slot's display, unless it's already running.
+        # pylint: disable=consider-using-with
+        if self.running_xvfb_pid() is not None:
+            return True
+
+        # A killed Xvfb leaves its lock file behind, which would stop the
+        # next Xvfb from using this display.
+        for xvfb_file in self.xvfb_files():
+            xvfb_file.unlink(missing_ok=True)
+        xvfb_args = ["Xvfb", self.display(), "-screen", "0", XVFB_SCREEN,
+                     "-nolisten", "tcp"]
+        logger.debug(" - " + " ".join(xvfb_args))
+        # Started in a session of its own, so it outlives this process and
+        # is kept for later crawls.
+        xvfb = Popen(xvfb_args, stdout=DEVNULL, stderr=DEVNULL,
+                     start_new_session=True)
+        self.xvfb_pid_file().write_text(str(xvfb.pid))
+
+        socket_path = self.xvfb_files()[1]
+        deadline = time.monotonic() + XVFB_START_TIMEOUT
+        while not socket_path.exists():
+            if xvfb.poll() is not None or time.monotonic() > deadline:
+                logger.error(f"Unable to start Xvfb on {self.display()}")
+                xvfb.kill()
+                return False
+            time.sleep(0.05)
+        return True
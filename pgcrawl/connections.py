@@ -0,0 +1,142 @@
+from dataclasses import dataclass, field
+import threading
+import time
+from typing import Optional
+
+from fabric import Connection
+from paramiko.ssh_exception import SSHException
+
+from pgcrawl.logging import Logger
+from pgcrawl.types import IPAddress, UserName
+
+
+PoolKey = tuple[IPAddress, UserName]
+
+# Connections that have been idle for longer than this many seconds get
+# probed before being handed out again.
+DEFAULT_IDLE_CHECK_SECS = 30
+# How often paramiko should send keepalive packets on pooled connections.
+DEFAULT_KEEPALIVE_SECS = 15
+
+
+@dataclass
+class ConnectionStats:
+    connects: int = 0
+    reconnects: int = 0
+    connect_secs: list[float] = field(default_factory=list)
+
+    def total_connect_secs(self) -> float:
+        return sum(self.connect_secs)
+
+
+@dataclass
+class PoolEntry:
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    conn: Optional[Connection] = None
+    last_used: float = 0
+    stats: ConnectionStats = field(default_factory=ConnectionStats)
+
+
+# Keeps one authenticated SSH connection open per (ip, user) pair, so that
+# the SSH handshake is paid once per client, instead of once per command.
+class ConnectionPool:
+    logger: Logger
+    idle_check_secs: float
+    keepalive_secs: int
+    entries_: dict[PoolKey, PoolEntry]
+    lock_: threading.Lock
+
+    def __init__(self, logger: Logger,
+                 idle_check_secs: float = DEFAULT_IDLE_CHECK_SECS,
+                 keepalive_secs: int = DEFAULT_KEEPALIVE_SECS) -> None:
+        self.logger = logger
+        self.idle_check_secs = idle_check_secs
+        self.keepalive_secs = keepalive_secs
+        self.entries_ = {}
+        self.lock_ = threading.Lock()
+
+    def entry(self, key: PoolKey) -> PoolEntry:
+        with self.lock_:
+            if key not in self.entries_:
+                self.entries_[key] = PoolEntry()
+            return self.entries_[key]
+
+    def is_healthy(self, entry: PoolEntry) -> bool:
+        if not entry.conn or not entry.conn.is_connected:
+            return False
+        if time.monotonic() - entry.last_used < self.idle_check_secs:
+            return True
+        try:
+            entry.conn.transport.send_ignore()
+        except (SSHException, OSError, EOFError):
+            return False
+        return bool(entry.conn.is_connected)
+
+    def open(self, key: PoolKey, entry: PoolEntry) -> Connection:
+        ip, user = key
+        conn = Connection(host=str(ip), user=user)
+        start = time.monotonic()
+        conn.open()
+        elapsed = time.monotonic() - start
+        conn.transport.set_keepalive(self.keepalive_secs)
+
+        if entry.stats.connects > 0:
+            entry.stats.reconnects += 1
+        entry.stats.connects += 1
+        entry.stats.connect_secs.append(elapsed)
+        self.logger.debug(f"*  connected to {user}@{ip} in {elapsed:.2f}s")
+        return conn
+
+    def connection(self, ip: IPAddress, user: UserName) -> Connection:
+        key = (ip, user)
+        entry = self.entry(key)
+        with entry.lock:
+            if entry.conn and not self.is_healthy(entry):
+                self.logger.debug(f"*  connection to {user}@{ip} went stale")
+                entry.conn.close()
+                entry.conn = None
+            if not entry.conn:
+                entry.conn = self.open(key, entry)
+            entry.last_used = time.monotonic()
+            return entry.conn
+
+    def discard(self, ip: IPAddress, user: UserName) -> bool:
+        entry = self.entry((ip, user))
+        with entry.lock:
+            if not entry.conn:
+                return False
+            entry.conn.close()
+            entry.conn = None
+            return True
+
+    def discard_broken(self, ip: IPAddress, user: UserName) -> bool:
+        # Only drops the connection if its transport is no longer active.
+        # Errors on a single channel (e.g., from hitting sshd's MaxSessions)
+        # leave it be, since every slot's commands and resident workers on
+        # the client share it.
+        entry = self.entry((ip, user))
+        with entry.lock:
+            if not entry.conn:
+                return False
+            transport = entry.conn.transport
+            if transport is not None and transport.is_active():
+                return False
+            entry.conn.close()
+            entry.conn = None
+            return True
+
+    def close(self) -> None:
+        for ip, user in list(self.entries_.keys()):
+            self.discard(ip, user)
+
+    def stats(self) -> dict[PoolKey, ConnectionStats]:
+        with self.lock_:
+            return {key: entry.stats for key, entry in self.entries_.items()}
+
+    def summarize(self) -> None:
+        for (ip, user), entry in self.entries_.items():
+            stats = entry.stats
+            self.logger.info(
+                f"{user}@{ip}: {stats.connects} connection(s), "
+                f"{stats.reconnects} reconnect(s), "
+                f"{stats.total_connect_secs():.2f}s spent connecting")
@@ -3,6 +3,13 @@ import pathlib
 
 WORKSPACE_DIR = pathlib.Path("./workspace")
 DISPATCHER_DIR = WORKSPACE_DIR / "dispatcher"
+WORK_DB_PATH = DISPATCHER_DIR / "work.db"
+# Results of `dispatch.py query`, one JSON object per line
+QUERY_OUTPUT_PATH = DISPATCHER_DIR / "queries.ndjson"
+
+# Directories used by the older, file-per-domain, way of tracking crawl
+# state. These are only read now, when importing an existing workspace
+# into the work database.
 TODO_DIR = DISPATCHER_DIR / "todo"
 UNDERWAY_DIR = DISPATCHER_DIR / "underway"
 DONE_DIR = DISPATCHER_DIR / "done"
@@ -10,9 +17,5 @@ ERROR_DIR = DISPATCHER_DIR / "error"
 
 ALL_DIRS = [
     WORKSPACE_DIR,
-    DISPATCHER_DIR,
-    DONE_DIR,
-    ERROR_DIR,
-    TODO_DIR,
-    UNDERWAY_DIR
+    DISPATCHER_DIR
 ]
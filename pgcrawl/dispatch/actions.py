@@ -1,10 +1,22 @@
+from dataclasses import asdict
+import json
 from pathlib import Path
+import time
+from typing import cast, Iterator, Optional
 
 from pgcrawl import GIT_URL
-from pgcrawl.dispatch import TODO_DIR, UNDERWAY_DIR, DONE_DIR, ERROR_DIR
+from pgcrawl.client.args import ClientCrawlArgs, ClientQueryArgs
+from pgcrawl.dispatch.leases import LeaseKeeper
+from pgcrawl.dispatch.output import QueryOutput
+from pgcrawl.dispatch.retries import RetryPolicies
+from pgcrawl.dispatch.store import State, WorkStore
+from pgcrawl.dispatch.workers import JobDict, ResidentWorkers
 from pgcrawl.logging import Logger
-from pgcrawl.subprocesses import run_ssh_cmd
-from pgcrawl.types import ClientServer, TrancoDomain
+from pgcrawl.results import CrawlResult, Failure, OutboxStats
+from pgcrawl.subprocesses import run_ssh_cmd, ssh_cmd_result, SSHResult
+from pgcrawl.subprocesses import ssh_connect
+from pgcrawl.timing import PhaseTimer, Timings
+from pgcrawl.types import ClientServer, JSONDict, TrancoDomain
 
 
 def activate_env_cmd_str(client_path: str) -> str:
@@ -95,6 +107,7 @@ def kill_child_processes(server: ClientServer, timeout: int,
         "killall Xvfb || echo no Xvfb processes;"
         "rm -Rf /tmp/pagegraph-profile-* || echo no profiles to delete;",
         "rm -Rf /tmp/.org.chromium.Chromium* || echo no chromium to delete;",
+        "rm -Rf /dev/shm/pgcrawl || echo no slot profiles to delete;",
     ]
     rs = run_ssh_cmd(server, " ".join(kill_cmd), timeout, logger)
     if not rs:
@@ -103,48 +116,323 @@ def kill_child_processes(server: ClientServer, timeout: int,
     return True
 
 
-def crawl_with_client_server(server: ClientServer, domain: TrancoDomain,
-                             client_code_path: str, binary_path: str,
-                             pagegraph_secs: int, s3_bucket: str,
-                             client_timeout: int, timeout: int,
-                             logger: Logger) -> bool:
-    logger.debug(f"-  crawling {domain.url()} with {server.desc()}.")
-    crawl_cmd = "killall -9 brave; killall Xvfb; sleep 3; "
-    crawl_cmd += activate_env_cmd_str(client_code_path)
+def crawl_cmd_str(domain: TrancoDomain, client_crawl_args: ClientCrawlArgs,
+                  slot: int, logger: Logger) -> str:
+    # Note that cleaning up any browser or display left over from an earlier
+    # crawl is handled by the client, for just this slot.
+    crawl_cmd = activate_env_cmd_str(client_crawl_args.client_code_path)
     crawl_cmd += " && " + " ".join([
         "./client.py",
         "crawl",
         "--rank", str(domain.rank),
         "--url", domain.url(),
-        "--seconds", str(pagegraph_secs),
-        "--timeout", str(client_timeout),
-        "--binary-path", binary_path,
-        "--s3-bucket", s3_bucket
-    ])
+        "--seconds", str(client_crawl_args.pagegraph_secs),
+        "--timeout", str(client_crawl_args.timeout),
+        "--binary-path", client_crawl_args.binary_path,
+        "--storage", client_crawl_args.storage,
+        "--codec", client_crawl_args.codec,
+        "--compress-level", str(client_crawl_args.compress_level),
+        "--slot", str(slot)
+    ] + (["--spool-logs"] if client_crawl_args.spool_logs else []))
     crawl_cmd += logger.to_arg()
-    rs = run_ssh_cmd(server, crawl_cmd, timeout, logger)
-    if not rs:
+    return crawl_cmd
+
+
+def crawl_cmd_result(rs: SSHResult, logger: Logger) -> CrawlResult:
+    if rs.failure:
+        logger.debug("!  but an error occurred!")
+        return CrawlResult.failed(rs.failure)
+    assert rs.exit_code is not None
+    return CrawlResult.from_output(rs.output, rs.exit_code)
+
+
+def crawl_with_client_server(server: ClientServer, domain: TrancoDomain,
+                             client_crawl_args: ClientCrawlArgs,
+                             timeout: int, logger: Logger) -> CrawlResult:
+    logger.debug(f"-  crawling {domain.url()} with {server.desc()}.")
+    crawl_cmd = crawl_cmd_str(domain, client_crawl_args, server.slot, logger)
+    rs = ssh_cmd_result(server, crawl_cmd, timeout, logger)
+    return crawl_cmd_result(rs, logger)
+
+
+def serve_cmd_str(client_code_path: str, slot: int, logger: Logger) -> str:
+    serve_cmd = activate_env_cmd_str(client_code_path)
+    serve_cmd += f" && exec ./client.py serve --slot {slot}"
+    serve_cmd += logger.to_arg()
+    return serve_cmd
+
+
+def crawl_job(domain: TrancoDomain,
+              client_crawl_args: ClientCrawlArgs) -> JobDict:
+    return {
+        "command": "crawl",
+        "url": domain.url(),
+        "rank": domain.rank,
+        "args": asdict(client_crawl_args),
+    }
+
+
+def crawl_job_result(rs: JobDict, logger: Logger) -> CrawlResult:
+    logger.debug(rs["log"])
+    if not rs["success"]:
+        logger.error(rs["log"])
+    if isinstance(rs["result"], dict):
+        return CrawlResult.from_dict(rs["result"])
+    return CrawlResult.failed(Failure.UNKNOWN, rs["log"])
+
+
+def crawl_with_resident_worker(server: ClientServer, domain: TrancoDomain,
+                               workers: ResidentWorkers,
+                               client_crawl_args: ClientCrawlArgs,
+                               timeout: int, logger: Logger) -> CrawlResult:
+    serve_cmd = serve_cmd_str(client_crawl_args.client_code_path,
+                              server.slot, logger)
+    worker = workers.get(server, serve_cmd, timeout, logger)
+    if not worker:
+        logger.debug("!  no resident worker, falling back to client.py crawl")
+        return crawl_with_client_server(server, domain, client_crawl_args,
+                                        timeout, logger)
+
+    logger.debug(f"-  crawling {domain.url()} with {server.desc()} "
+                 f"(slot {server.slot}).")
+    rs = worker.call(crawl_job(domain, client_crawl_args), timeout, logger)
+    if isinstance(rs, Failure):
+        # The worker is either gone, or still busy with a job we've given
+        # up on, so start a fresh one for the next job.
+        workers.discard(server)
         logger.debug("!  but an error occurred!")
+        return CrawlResult.failed(rs)
+    return crawl_job_result(rs, logger)
+
+
+def add_round_trip(result: CrawlResult, secs: float,
+                   phases: Timings) -> CrawlResult:
+    # Adds the time the dispatcher spent on the crawl, and the phases it
+    # timed itself (i.e., connecting to the client), to the client's own
+    # timings. Whatever isn't accounted for by either (activating the
+    # client's environment, and starting the interpreter, when not using a
+    # resident worker) is its "overhead".
+    timings = dict(result.timings or {})
+    timings.update(phases)
+    timings["round_trip"] = secs
+    if "client" in timings:
+        accounted = timings["client"] + timings.get("connect", 0.0)
+        timings["overhead"] = max(secs - accounted, 0.0)
+    result.timings = timings
+    return result
+
+
+def crawl_domain(server: ClientServer, domain: TrancoDomain,
+                 leases: LeaseKeeper, workers: Optional[ResidentWorkers],
+                 client_crawl_args: ClientCrawlArgs, timeout: int,
+                 logger: Logger) -> CrawlResult:
+    # The domain is leased to this client (and slot) for as long as the
+    # crawl is running, so that if the dispatcher dies, a later
+    # `dispatch.py crawl --resume` knows the crawl was never finished.
+    record_as_underway(leases, domain, server.slot_desc())
+    timer = PhaseTimer()
+    start = time.monotonic()
+    try:
+        with timer.phase("connect"):
+            is_connected = ssh_connect(server, logger)
+        if not is_connected:
+            result = CrawlResult.failed(Failure.SSH)
+        elif workers:
+            result = crawl_with_resident_worker(server, domain, workers,
+                                                client_crawl_args, timeout,
+                                                logger)
+        else:
+            result = crawl_with_client_server(server, domain,
+                                              client_crawl_args, timeout,
+                                              logger)
+    finally:
+        leases.release(domain)
+    return add_round_trip(result, time.monotonic() - start, timer.phases)
+
+
+def query_cmd_str(domain: TrancoDomain, client_code_path: str,
+                  client_query_args: ClientQueryArgs, logger: Logger) -> str:
+    query_cmd = activate_env_cmd_str(client_code_path)
+    query_cmd += " && " + " ".join([
+        "./client.py",
+        "query",
+        "--rank", str(domain.rank),
+        "--url", domain.url(),
+        "--timeout", str(client_query_args.timeout),
+        "--storage", client_query_args.storage,
+        "--codec", client_query_args.codec,
+        "--graph-cache-bytes", str(client_query_args.graph_cache_bytes),
+    ] + ([] if client_query_args.use_cache else ["--no-cache"]))
+    query_cmd += logger.to_arg()
+    return query_cmd
+
+
+def query_cmd_result(rs: SSHResult) -> Optional[JSONDict]:
+    # `client.py query` prints its results as JSON on the last line of its
+    # output (after anything it logs), even if there are none (i.e., `{}`),
+    # and exits with an error, printing nothing, if it failed.
+    if not rs.is_success():
+        return None
+    lines = rs.output.strip().splitlines()
+    try:
+        data = json.loads(lines[-1]) if lines else None
+    except ValueError:
+        return None
+    return cast(JSONDict, data) if isinstance(data, dict) else None
+
+
+def query_with_client_server(server: ClientServer, domain: TrancoDomain,
+                             client_code_path: str,
+                             client_query_args: ClientQueryArgs,
+                             timeout: int,
+                             logger: Logger) -> Optional[JSONDict]:
+    logger.debug(f"-  querying {domain.url()} with {server.desc()}.")
+    query_cmd = query_cmd_str(domain, client_code_path, client_query_args,
+                              logger)
+    rs = ssh_cmd_result(server, query_cmd, timeout, logger)
+    return query_cmd_result(rs)
+
+
+def query_job(domain: TrancoDomain,
+              client_query_args: ClientQueryArgs) -> JobDict:
+    return {
+        "command": "query",
+        "url": domain.url(),
+        "rank": domain.rank,
+        "args": asdict(client_query_args),
+    }
+
+
+def query_job_result(rs: JobDict, logger: Logger) -> Optional[JSONDict]:
+    logger.debug(rs["log"])
+    if not rs["success"]:
+        logger.error(rs["log"])
+        return None
+    if isinstance(rs["result"], dict):
+        return cast(JSONDict, rs["result"])
+    return None
+
+
+def query_with_resident_worker(server: ClientServer, domain: TrancoDomain,
+                               workers: ResidentWorkers,
+                               client_code_path: str,
+                               client_query_args: ClientQueryArgs,
+                               timeout: int,
+                               logger: Logger) -> Optional[JSONDict]:
+    serve_cmd = serve_cmd_str(client_code_path, server.slot, logger)
+    worker = workers.get(server, serve_cmd, timeout, logger)
+    if not worker:
+        logger.debug("!  no resident worker, falling back to client.py query")
+        return query_with_client_server(server, domain, client_code_path,
+                                        client_query_args, timeout, logger)
+
+    logger.debug(f"-  querying {domain.url()} with {server.desc()} "
+                 f"(slot {server.slot}).")
+    rs = worker.call(query_job(domain, client_query_args), timeout, logger)
+    if isinstance(rs, Failure):
+        workers.discard(server)
+        logger.debug("!  but an error occurred!")
+        return None
+    return query_job_result(rs, logger)
+
+
+def query_domain(server: ClientServer, domain: TrancoDomain,
+                 workers: Optional[ResidentWorkers], client_code_path: str,
+                 client_query_args: ClientQueryArgs, output: QueryOutput,
+                 timeout: int, logger: Logger) -> bool:
+    # Results are written as soon as they arrive, from whichever thread
+    # got them, and failures are written once the dispatcher has decided
+    # they weren't the client's fault (see record_query_response).
+    if workers:
+        results = query_with_resident_worker(server, domain, workers,
+                                             client_code_path,
+                                             client_query_args, timeout,
+                                             logger)
+    else:
+        results = query_with_client_server(server, domain, client_code_path,
+                                           client_query_args, timeout, logger)
+    if results is None:
         return False
+    output.write(domain, results)
     return True
 
 
-def domains_to_crawl() -> list[TrancoDomain]:
-    domains = []
-    for path in TODO_DIR.iterdir():
-        if not path.is_file():
+def domains_to_crawl(store: WorkStore,
+                     limit: int = 0) -> Iterator[TrancoDomain]:
+    return store.iter_todo(limit)
+
+
+def domains_to_query(store: WorkStore, output: QueryOutput,
+                     limit: int = 0) -> Iterator[TrancoDomain]:
+    # Crawled domains, skipping any that were already queried by an
+    # earlier run writing to the same output.
+    num_yielded = 0
+    for record in store.iter_done():
+        if output.is_done(record):
             continue
-        domains.append(TrancoDomain(path))
-    return domains
+        yield record
+        num_yielded += 1
+        if num_yielded == limit:
+            return
+
 
+def domains_to_retry(store: WorkStore
+                     ) -> Iterator[tuple[TrancoDomain, Optional[Failure]]]:
+    return store.iter_retries()
 
-def record_as_underway(record: TrancoDomain) -> None:
-    record.move_to_dir(UNDERWAY_DIR)
 
+def record_as_underway(leases: LeaseKeeper, record: TrancoDomain,
+                       client: str) -> None:
+    leases.hold(record, client)
 
-def record_as_complete(record: TrancoDomain) -> None:
-    record.move_to_dir(DONE_DIR)
+
+def record_as_todo(store: WorkStore, record: TrancoDomain) -> None:
+    store.requeue(record)
+
+
+def record_as_complete(store: WorkStore, record: TrancoDomain,
+                       result: Optional[CrawlResult] = None) -> None:
+    # Graphs put in a resident worker's outbox aren't done until the worker
+    # reports them uploaded (see record_uploads).
+    state = State.UPLOADING if result and result.outbox else State.DONE
+    store.finish(record, state,
+                 compression=result.compression if result else None,
+                 timings=result.timings if result else None)
+
+
+def record_uploads(store: WorkStore, outbox: OutboxStats,
+                   policies: RetryPolicies, logger: Logger) -> None:
+    # Finishes the domains whose graphs the client's outbox uploaded, and
+    # retries those it gave up on.
+    for rank in outbox.uploaded_ranks:
+        if store.confirm_upload(rank):
+            logger.debug(f"Confirmed upload of the graph for rank {rank}")
+    for rank in outbox.failed_ranks:
+        record = store.find(rank, State.UPLOADING)
+        if record is None:
+            continue
+        message = f"Unable to upload the graph for {str(record)}"
+        logger.error(message)
+        record_as_error(store, record,
+                        CrawlResult.failed(Failure.UPLOAD, message), policies)
 
 
-def record_as_error(record: TrancoDomain) -> None:
-    record.move_to_dir(ERROR_DIR)
+def record_as_error(store: WorkStore, record: TrancoDomain,
+                    result: Optional[CrawlResult],
+                    policies: RetryPolicies) -> Optional[float]:
+    # Either schedules the domain to be tried again, according to the
+    # policy for the kind of failure, or gives up on it. Returns the number
+    # of seconds until the retry, if there is one.
+    failure = result.failure if result else None
+    failure = failure or Failure.UNKNOWN
+    message = result.message if result else None
+    timings = result.timings if result else None
+    policy = policies.get(failure)
+    delay = policy.retry_delay(store.attempts(record)) if policy else None
+    if delay is None:
+        store.finish(record, State.ERROR, failure, message,
+                     timings=timings)
+    else:
+        store.schedule_retry(record, failure, message, time.time() + delay,
+                             timings)
+    return delay
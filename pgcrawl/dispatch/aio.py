@@ -0,0 +1,266 @@
+import asyncio
+from asyncio.subprocess import Process
+import json
+import time
+from typing import Optional
+
+from pgcrawl.aio import AsyncClientServer, AsyncIPManager
+from pgcrawl.client.args import ClientCrawlArgs, ClientQueryArgs
+from pgcrawl.dispatch.actions import add_round_trip
+from pgcrawl.dispatch.actions import crawl_cmd_result, crawl_cmd_str
+from pgcrawl.dispatch.actions import crawl_job, crawl_job_result
+from pgcrawl.dispatch.actions import query_cmd_result, query_cmd_str
+from pgcrawl.dispatch.actions import query_job, query_job_result
+from pgcrawl.dispatch.actions import record_as_underway, serve_cmd_str
+from pgcrawl.dispatch.leases import LeaseKeeper
+from pgcrawl.dispatch.output import QueryOutput
+from pgcrawl.dispatch.workers import JobDict, WorkerKey
+from pgcrawl.logging import Logger
+from pgcrawl.results import CrawlResult, Failure
+from pgcrawl.timing import PhaseTimer
+from pgcrawl.types import JSONDict, TrancoDomain
+
+
+# The asyncio engine's equivalent of ResidentWorker, talking to the
+# `client.py serve` process over the pipes of a local ssh process.
+class AsyncResidentWorker:
+    proc: Process
+    next_id: int
+    stderr_task: "asyncio.Task[None]"
+
+    def __init__(self, proc: Process, logger: Logger) -> None:
+        self.proc = proc
+        self.next_id = 1
+        # The worker's stderr is read as it's written (e.g., by background
+        # uploads between jobs), so the pipe never fills and blocks it.
+        self.stderr_task = asyncio.ensure_future(self.log_stderr(logger))
+
+    def is_alive(self) -> bool:
+        return self.proc.returncode is None
+
+    async def read_response(self, job_id: int) -> Optional[JobDict]:
+        assert self.proc.stdout
+        while True:
+            line = await self.proc.stdout.readline()
+            if not line:
+                return None
+            response: JobDict = json.loads(line)
+            if response.get("id") == job_id:
+                return response
+
+    async def call(self, job: JobDict, timeout: int,
+                   logger: Logger) -> JobDict | Failure:
+        assert self.proc.stdin
+        job_id = self.next_id
+        self.next_id += 1
+        payload = dict(job, id=job_id)
+        try:
+            self.proc.stdin.write((json.dumps(payload) + "\n").encode("utf8"))
+            await self.proc.stdin.drain()
+            response = await asyncio.wait_for(self.read_response(job_id),
+                                              timeout)
+            if response is None:
+                logger.error("Resident worker exited")
+                return Failure.SSH
+            return response
+        except asyncio.TimeoutError:
+            logger.error(f"Timeout: no response after {timeout}s")
+            return Failure.TIMEOUT
+        except (OSError, ValueError) as e:
+            logger.error(f"Resident worker error: {e}")
+        return Failure.SSH
+
+    async def log_stderr(self, logger: Logger) -> None:
+        assert self.proc.stderr
+        while True:
+            try:
+                line = await self.proc.stderr.readline()
+            except ValueError:
+                # The line's dropped, but the pipe's still drained.
+                logger.error("Resident worker wrote a line too long to log")
+                continue
+            if not line:
+                return
+            logger.error(line.decode("utf8", errors="replace").rstrip())
+
+    async def close(self) -> None:
+        if self.is_alive():
+            self.proc.kill()
+        await self.proc.wait()
+        await self.stderr_task
+
+
+class AsyncResidentWorkers:
+    manager: AsyncIPManager
+    workers_: dict[WorkerKey, AsyncResidentWorker]
+
+    def __init__(self, manager: AsyncIPManager) -> None:
+        self.manager = manager
+        self.workers_ = {}
+
+    async def start(self, server: AsyncClientServer, serve_cmd: str,
+                    timeout: int,
+                    logger: Logger) -> Optional[AsyncResidentWorker]:
+        try:
+            proc = await self.manager.ssh.start(server.ip, serve_cmd, logger)
+        except OSError as e:
+            logger.error(f"Unable to start worker on {server.desc()}: {e}")
+            return None
+
+        worker = AsyncResidentWorker(proc, logger)
+        if isinstance(await worker.call({"command": "ping"}, timeout, logger),
+                      Failure):
+            await worker.close()
+            return None
+        return worker
+
+    async def get(self, server: AsyncClientServer, serve_cmd: str,
+                  timeout: int,
+                  logger: Logger) -> Optional[AsyncResidentWorker]:
+        key = (server.ip, server.user, server.slot)
+        worker = self.workers_.get(key)
+        if worker and worker.is_alive():
+            return worker
+
+        worker = await self.start(server, serve_cmd, timeout, logger)
+        if worker:
+            self.workers_[key] = worker
+        else:
+            self.workers_.pop(key, None)
+        return worker
+
+    async def discard(self, server: AsyncClientServer) -> None:
+        key = (server.ip, server.user, server.slot)
+        worker = self.workers_.pop(key, None)
+        if worker:
+            await worker.close()
+
+    def call_all(self, job: JobDict, timeout: int,
+                 logger: Logger) -> list[JobDict]:
+        # Sends the job to every live worker at once, returning the
+        # responses of those that answered.
+        workers = [x for x in self.workers_.values() if x.is_alive()]
+
+        async def call_each() -> list[JobDict | Failure]:
+            return await asyncio.gather(
+                *[x.call(job, timeout, logger) for x in workers])
+        responses = self.manager.loop.run_until_complete(call_each())
+        return [x for x in responses if not isinstance(x, Failure)]
+
+    def close(self) -> None:
+        workers = list(self.workers_.values())
+        self.workers_ = {}
+        for worker in workers:
+            self.manager.loop.run_until_complete(worker.close())
+
+
+async def async_crawl_with_client_server(
+        server: AsyncClientServer, domain: TrancoDomain,
+        client_crawl_args: ClientCrawlArgs, timeout: int,
+        logger: Logger) -> CrawlResult:
+    logger.debug(f"-  crawling {domain.url()} with {server.desc()}.")
+    crawl_cmd = crawl_cmd_str(domain, client_crawl_args, server.slot, logger)
+    rs = await server.run(crawl_cmd, timeout, logger)
+    return crawl_cmd_result(rs, logger)
+
+
+async def async_crawl_with_resident_worker(
+        server: AsyncClientServer, domain: TrancoDomain,
+        workers: AsyncResidentWorkers, client_crawl_args: ClientCrawlArgs,
+        timeout: int, logger: Logger) -> CrawlResult:
+    serve_cmd = serve_cmd_str(client_crawl_args.client_code_path,
+                              server.slot, logger)
+    worker = await workers.get(server, serve_cmd, timeout, logger)
+    if not worker:
+        logger.debug("!  no resident worker, falling back to client.py crawl")
+        return await async_crawl_with_client_server(
+            server, domain, client_crawl_args, timeout, logger)
+
+    logger.debug(f"-  crawling {domain.url()} with {server.desc()} "
+                 f"(slot {server.slot}).")
+    rs = await worker.call(crawl_job(domain, client_crawl_args), timeout,
+                           logger)
+    if isinstance(rs, Failure):
+        await workers.discard(server)
+        logger.debug("!  but an error occurred!")
+        return CrawlResult.failed(rs)
+    return crawl_job_result(rs, logger)
+
+
+async def async_crawl_domain(server: AsyncClientServer, domain: TrancoDomain,
+                             leases: LeaseKeeper,
+                             workers: Optional[AsyncResidentWorkers],
+                             client_crawl_args: ClientCrawlArgs, timeout: int,
+                             logger: Logger) -> CrawlResult:
+    record_as_underway(leases, domain, server.slot_desc())
+    timer = PhaseTimer()
+    start = time.monotonic()
+    try:
+        with timer.phase("connect"):
+            is_connected = await server.connect(timeout, logger)
+        if not is_connected:
+            result = CrawlResult.failed(Failure.SSH)
+        elif workers:
+            result = await async_crawl_with_resident_worker(
+                server, domain, workers, client_crawl_args, timeout, logger)
+        else:
+            result = await async_crawl_with_client_server(
+                server, domain, client_crawl_args, timeout, logger)
+    finally:
+        leases.release(domain)
+    return add_round_trip(result, time.monotonic() - start, timer.phases)
+
+
+async def async_query_with_client_server(
+        server: AsyncClientServer, domain: TrancoDomain,
+        client_code_path: str, client_query_args: ClientQueryArgs,
+        timeout: int, logger: Logger) -> Optional[JSONDict]:
+    logger.debug(f"-  querying {domain.url()} with {server.desc()}.")
+    query_cmd = query_cmd_str(domain, client_code_path, client_query_args,
+                              logger)
+    rs = await server.run(query_cmd, timeout, logger)
+    return query_cmd_result(rs)
+
+
+async def async_query_with_resident_worker(
+        server: AsyncClientServer, domain: TrancoDomain,
+        workers: AsyncResidentWorkers, client_code_path: str,
+        client_query_args: ClientQueryArgs, timeout: int,
+        logger: Logger) -> Optional[JSONDict]:
+    serve_cmd = serve_cmd_str(client_code_path, server.slot, logger)
+    worker = await workers.get(server, serve_cmd, timeout, logger)
+    if not worker:
+        logger.debug("!  no resident worker, falling back to client.py query")
+        return await async_query_with_client_server(
+            server, domain, client_code_path, client_query_args, timeout,
+            logger)
+
+    logger.debug(f"-  querying {domain.url()} with {server.desc()} "
+                 f"(slot {server.slot}).")
+    rs = await worker.call(query_job(domain, client_query_args), timeout,
+                           logger)
+    if isinstance(rs, Failure):
+        await workers.discard(server)
+        logger.debug("!  but an error occurred!")
+        return None
+    return query_job_result(rs, logger)
+
+
+async def async_query_domain(server: AsyncClientServer, domain: TrancoDomain,
+                             workers: Optional[AsyncResidentWorkers],
+                             client_code_path: str,
+                             client_query_args: ClientQueryArgs,
+                             output: QueryOutput, timeout: int,
+                             logger: Logger) -> bool:
+    if workers:
+        results = await async_query_with_resident_worker(
+            server, domain, workers, client_code_path, client_query_args,
+            timeout, logger)
+    else:
+        results = await async_query_with_client_server(
+            server, domain, client_code_path, client_query_args, timeout,
+            logger)
+    if results is None:
+        return False
+    output.write(domain, results)
+    return True
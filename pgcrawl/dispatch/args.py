@@ -0,0 +1,65 @@
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from pgcrawl.client.args import DEFAULT_CRAWL_ARGS, DEFAULT_QUERY_ARGS
+from pgcrawl.dispatch import QUERY_OUTPUT_PATH
+from pgcrawl.dispatch.retries import DEFAULT_RETRY_POLICIES, RetryPolicies
+from pgcrawl.types import Engine
+
+
+@dataclass
+class DispatchCrawlArgs:
+    # pylint: disable=too-many-instance-attributes
+    # Number of concurrent crawls to run on each client
+    slots: int
+    # Whether to keep a resident `client.py serve` process on each slot,
+    # instead of running `client.py crawl` for each domain.
+    resident: bool
+    # Whether to re-queue domains whose leases have expired (i.e., that were
+    # underway when an earlier dispatcher stopped), or whose uploads were
+    # never confirmed, before crawling.
+    resume: bool
+    # Number of seconds a lease on a domain lasts without being renewed
+    lease_secs: int
+    # Maximum number of seconds to wait on a client to complete a crawl,
+    # including the time spent talking to it over SSH.
+    timeout: int
+    # How many times, and how soon, to retry domains after each kind of
+    # failure.
+    retry_policies: RetryPolicies = field(
+        default_factory=lambda: dict(DEFAULT_RETRY_POLICIES))
+    engine: Engine = Engine.THREADS
+    # Whether to keep a live view of the crawl's progress (see RunStatus)
+    show_status: bool = True
+    # Port to serve metrics on, on localhost (see MetricsServer), if any
+    metrics_port: int = 0
+
+
+DEFAULT_DISPATCH_CRAWL_ARGS = DispatchCrawlArgs(
+    1,
+    True,
+    False,
+    60,
+    DEFAULT_CRAWL_ARGS.timeout + 20)
+
+
+@dataclass
+class DispatchQueryArgs:
+    # Number of concurrent queries to run on each client
+    slots: int
+    # Whether to keep a resident `client.py serve` process on each slot,
+    # instead of running `client.py query` for each domain.
+    resident: bool
+    # Maximum number of seconds to wait on a client to complete a query,
+    # including the time spent talking to it over SSH.
+    timeout: int
+    # Where the results of every query are collected (see QueryOutput)
+    output_path: Path
+    engine: Engine = Engine.THREADS
+
+
+DEFAULT_DISPATCH_QUERY_ARGS = DispatchQueryArgs(
+    1,
+    True,
+    DEFAULT_QUERY_ARGS.timeout + 20,
+    QUERY_OUTPUT_PATH)
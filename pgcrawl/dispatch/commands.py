@@ -1,18 +1,47 @@
 from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
 from enum import Enum, auto
-from typing import cast
+from functools import partial
+import time
+from typing import Callable, cast, Iterator, Optional
 
-from pgcrawl.client.args import ClientCrawlArgs
+from pgcrawl.aio import AsyncIPManager, AsyncPullScheduler
+from pgcrawl.client.args import ClientCrawlArgs, ClientQueryArgs
 from pgcrawl.dispatch.actions import test_connection, delete_client_code
 from pgcrawl.dispatch.actions import install_client_code, check_client_code
 from pgcrawl.dispatch.actions import setup_client_code, domains_to_crawl
-from pgcrawl.dispatch.actions import crawl_with_client_server
+from pgcrawl.dispatch.actions import domains_to_retry
+from pgcrawl.dispatch.actions import crawl_domain
 from pgcrawl.dispatch.actions import record_as_complete, record_as_error
+from pgcrawl.dispatch.actions import record_as_todo, record_uploads
 from pgcrawl.dispatch.actions import kill_child_processes
+from pgcrawl.dispatch.actions import domains_to_query, query_domain
+from pgcrawl.dispatch import WORK_DB_PATH
+from pgcrawl.dispatch.aio import AsyncResidentWorkers, async_crawl_domain
+from pgcrawl.dispatch.aio import async_query_domain
+from pgcrawl.dispatch.args import DispatchCrawlArgs, DispatchQueryArgs
+from pgcrawl.dispatch.leases import LeaseKeeper
+from pgcrawl.dispatch.metrics_server import MetricsServer
+from pgcrawl.dispatch.output import QueryOutput
+from pgcrawl.dispatch.retries import RetryPolicies
+from pgcrawl.dispatch.store import State, WorkStore
+from pgcrawl.dispatch.workers import ResidentWorkers
 from pgcrawl.logging import Logger
+from pgcrawl.metrics import DispatchMetrics
+from pgcrawl.results import OutboxStats
+from pgcrawl.scheduler import PullScheduler
+from pgcrawl.status import RunStatus, StatusLogger
 from pgcrawl.threading import ThreadIPManager, exit_with_results
 from pgcrawl.threading import is_all_successful
-from pgcrawl.types import IPAddress, UserName, WorkItem, TrancoDomain
+from pgcrawl.timing import SUMMARY_PERCENTILES, summarize_timings
+from pgcrawl.types import Engine, IPAddress, UserName, WorkItem
+from pgcrawl.types import TrancoDomain, WorkResponse
+
+
+# Whichever the engine uses, see dispatch_engine().
+Workers = ResidentWorkers | AsyncResidentWorkers
+Manager = ThreadIPManager | AsyncIPManager
+Scheduler = PullScheduler | AsyncPullScheduler
 
 
 class Action(Enum):
@@ -25,99 +54,347 @@ class Action(Enum):
     ALL = auto()
 
 
+def setup_steps(client_path: str) -> list[tuple[Action, WorkItem]]:
+    return [
+        (Action.TEST_CONNECTION,
+         WorkItem(test_connection, "Checking connections", [])),
+        (Action.KILL_CHILD_PROCESSES,
+         WorkItem(kill_child_processes, "Killing child processes", [])),
+        (Action.DELETE_CLIENT_CODE,
+         WorkItem(delete_client_code,
+                  f"Deleting client code from {client_path}", [client_path])),
+        (Action.INSTALL_CLIENT_CODE,
+         WorkItem(install_client_code,
+                  f"Installing client code at {client_path}", [client_path])),
+        (Action.CHECK_CLIENT_CODE,
+         WorkItem(check_client_code,
+                  f"Checking if client code is installed at {client_path}",
+                  [client_path])),
+        (Action.SETUP_CLIENT_CODE,
+         WorkItem(setup_client_code,
+                  f"Setting up client code at {client_path}", [client_path])),
+    ]
+
+
+def run_setup_steps(actions: list[Action], client_path: str,
+                    call_on_each: Callable[[WorkItem], list[WorkResponse]],
+                    logger: Logger) -> None:
+    do_all_actions = Action.ALL in actions
+    for action, work_item in setup_steps(client_path):
+        if action in actions or do_all_actions:
+            logger.info(work_item.message)
+            rs = call_on_each(work_item)
+            if not is_all_successful(rs):
+                exit_with_results(work_item.func.__name__, rs, logger)
+
+
 def client_setup(actions: list[Action], ips: list[IPAddress],
                  user: UserName, client_path: str, timeout: int,
-                 logger: Logger) -> None:
+                 logger: Logger, engine: Engine = Engine.THREADS) -> None:
+    if engine == Engine.ASYNCIO:
+        async_manager = AsyncIPManager(ips, user, timeout, logger)
+        run_setup_steps(actions, client_path, async_manager.run_on_each,
+                        logger)
+        async_manager.close()
+        return
+
     manager = ThreadIPManager(ips, user, timeout, logger)
-    do_all_actions = Action.ALL in actions
     with ThreadPoolExecutor(max_workers=manager.num_workers(),
                             initializer=manager.init_thread,) as executor:
-        if Action.TEST_CONNECTION in actions or do_all_actions:
-            message = "Checking connections"
-            logger.info(message)
-            work_item = WorkItem(test_connection, message, [])
-            rs = manager.call_on_each(executor, work_item)
-            if not is_all_successful(rs):
-                exit_with_results("test_connection", rs, logger)
+        run_setup_steps(actions, client_path,
+                        partial(manager.call_on_each, executor), logger)
+    manager.close()
 
-        if Action.KILL_CHILD_PROCESSES in actions or do_all_actions:
-            message = "Killing child processes"
-            logger.info(message)
-            work_item = WorkItem(kill_child_processes, message, [])
-            rs = manager.call_on_each(executor, work_item)
-            if not is_all_successful(rs):
-                exit_with_results("kill_child_processes", rs, logger)
 
-        if Action.DELETE_CLIENT_CODE in actions or do_all_actions:
-            message = f"Deleting client code from {client_path}"
-            logger.info(message)
-            work_item = WorkItem(delete_client_code, message, [client_path])
-            rs = manager.call_on_each(executor, work_item)
-            if not is_all_successful(rs):
-                exit_with_results("delete_client_code", rs, logger)
+def check_expired_leases(store: WorkStore, resume: bool,
+                         logger: Logger) -> None:
+    if resume:
+        num_reclaimed = store.reclaim_expired()
+        logger.info(f"Re-queued {num_reclaimed} unfinished domains.")
+    elif num_expired := store.expired_leases():
+        logger.info(f"{num_expired} domains were left underway (or "
+                    "uploading) by an earlier crawl, pass --resume to "
+                    "re-queue them.")
 
-        if Action.INSTALL_CLIENT_CODE in actions or do_all_actions:
-            message = f"Installing client code at {client_path}"
-            logger.info(message)
-            work_item = WorkItem(install_client_code, message, [client_path])
-            rs = manager.call_on_each(executor, work_item)
-            if not is_all_successful(rs):
-                exit_with_results("install_client_code", rs, logger)
 
-        if Action.CHECK_CLIENT_CODE in actions or do_all_actions:
-            message = f"Checking if client code is installed at {client_path}"
-            logger.info(message)
-            work_item = WorkItem(check_client_code, message, [client_path])
-            rs = manager.call_on_each(executor, work_item)
-            if not is_all_successful(rs):
-                exit_with_results("check_client_code", rs, logger)
+def crawl_work_item(tranco_record: TrancoDomain, leases: LeaseKeeper,
+                    workers: Optional[Workers],
+                    client_crawl_args: ClientCrawlArgs,
+                    verb: str = "Crawling") -> WorkItem:
+    work_args = [tranco_record, leases, workers, client_crawl_args]
+    return WorkItem(crawl_domain, f"{verb} {str(tranco_record)}", work_args,
+                    async_crawl_domain)
 
-        if Action.SETUP_CLIENT_CODE in actions or do_all_actions:
-            message = f"Setting up client code at {client_path}"
-            logger.info(message)
-            work_item = WorkItem(setup_client_code, message, [client_path])
-            rs = manager.call_on_each(executor, work_item)
-            if not is_all_successful(rs):
-                exit_with_results("setup_client_code", rs, logger)
+
+def crawl_work_items(store: WorkStore, limit: int, leases: LeaseKeeper,
+                     workers: Optional[Workers],
+                     client_crawl_args: ClientCrawlArgs
+                     ) -> Iterator[WorkItem]:
+    for tranco_record in domains_to_crawl(store, limit):
+        yield crawl_work_item(tranco_record, leases, workers,
+                              client_crawl_args)
+
+
+def retry_work_items(store: WorkStore, leases: LeaseKeeper,
+                     workers: Optional[Workers],
+                     policies: RetryPolicies,
+                     client_crawl_args: ClientCrawlArgs
+                     ) -> Iterator[WorkItem]:
+    for tranco_record, failure in domains_to_retry(store):
+        policy = policies.get(failure) if failure else None
+        retry_args = client_crawl_args
+        if policy and policy.extra_pagegraph_secs:
+            retry_args = replace(
+                client_crawl_args,
+                pagegraph_secs=(client_crawl_args.pagegraph_secs
+                                + policy.extra_pagegraph_secs))
+        yield crawl_work_item(tranco_record, leases, workers, retry_args,
+                              "Retrying")
+
+
+def record_crawl_response(store: WorkStore, work_response: WorkResponse,
+                          policies: RetryPolicies, logger: Logger) -> None:
+    tranco_record = cast(TrancoDomain, work_response.work_item.args[0])
+    summary = f"{work_response.ip} -> {str(tranco_record)}"
+    if work_response.is_success:
+        record_as_complete(store, tranco_record, work_response.result)
+        compression = (work_response.result
+                       and work_response.result.compression)
+        if compression:
+            summary += (f" ({compression.raw_bytes:,} bytes, "
+                        f"{compression.ratio():.1f}x smaller w/ "
+                        f"{compression.codec} in "
+                        f"{compression.cpu_secs:.2f}s)")
+        outbox = work_response.result and work_response.result.outbox
+        if outbox:
+            summary += (f" (outbox: {outbox.depth} waiting, "
+                        f"{outbox.last_latency_secs:.1f}s to upload")
+            summary += f", {outbox.failed} failed)" if outbox.failed else ")"
+        logger.info(summary)
+    else:
+        result = work_response.result
+        if result and result.failure:
+            summary += f" ({result.failure.value})"
+        delay = record_as_error(store, tranco_record, result, policies)
+        if delay is not None:
+            summary += f", retrying in {delay:.0f}s"
+        logger.error(summary)
+
+    # Results from resident workers also report the graphs their outboxes
+    # uploaded (or gave up on) since, including for other domains.
+    if work_response.result and work_response.result.outbox:
+        record_uploads(store, work_response.result.outbox, policies, logger)
+
+
+def flush_uploads(store: WorkStore, workers: Workers, timeout: int,
+                  policies: RetryPolicies, metrics: DispatchMetrics,
+                  logger: Logger) -> None:
+    # Waits on the resident workers to upload the graphs still in their
+    # outboxes, so the last domains crawled can be confirmed done.
+    for response in workers.call_all({"command": "flush"}, timeout, logger):
+        if isinstance(response.get("result"), dict):
+            outbox = OutboxStats(**response["result"])
+            metrics.uploaded(outbox)
+            record_uploads(store, outbox, policies, logger)
+    if num_uploading := store.counts()[State.UPLOADING]:
+        logger.error(f"{num_uploading} domains were crawled, but their "
+                     "uploads weren't confirmed, pass --resume to the next "
+                     "crawl to re-queue them.")
+
+
+def run_crawl_pass(scheduler: Scheduler, store: WorkStore,
+                   policies: RetryPolicies, logger: Logger) -> bool:
+    # Returns False if every client was retired during the pass.
+    for work_response in scheduler.run():
+        record_crawl_response(store, work_response, policies, logger)
+
+    for work_item in scheduler.unfinished():
+        logger.error(f"No clients left for: {work_item.message}")
+        record_as_todo(store, cast(TrancoDomain, work_item.args[0]))
+    return not scheduler.all_retired()
+
+
+def dispatch_engine(ips: list[IPAddress], user: UserName,
+                    dispatch_args: DispatchCrawlArgs | DispatchQueryArgs,
+                    logger: Logger,
+                    metrics: Optional[DispatchMetrics] = None
+                    ) -> tuple[Manager, Optional[Workers],
+                               Callable[..., Scheduler]]:
+    # Returns the manager and resident workers for the engine, along with
+    # a function that creates schedulers for running work items with them.
+    if dispatch_args.engine == Engine.ASYNCIO:
+        async_manager = AsyncIPManager(ips, user, dispatch_args.timeout,
+                                       logger, dispatch_args.slots,
+                                       metrics=metrics)
+        async_workers = (AsyncResidentWorkers(async_manager)
+                         if dispatch_args.resident else None)
+        return (async_manager, async_workers,
+                partial(AsyncPullScheduler, async_manager))
+    manager = ThreadIPManager(ips, user, dispatch_args.timeout, logger,
+                              dispatch_args.slots, metrics)
+    workers = ResidentWorkers() if dispatch_args.resident else None
+    return manager, workers, partial(PullScheduler, manager)
+
+
+def run_crawl_passes(store: WorkStore, limit: int, leases: LeaseKeeper,
+                     workers: Optional[Workers],
+                     new_scheduler: Callable[..., Scheduler],
+                     dispatch_args: DispatchCrawlArgs,
+                     client_crawl_args: ClientCrawlArgs, status: RunStatus,
+                     logger: Logger) -> None:
+    # Fresh work is crawled first, and then domains that failed are
+    # retried in passes, once their backoff has passed, so that retries
+    # never hold up domains that haven't been tried yet.
+    scheduler = new_scheduler(crawl_work_items(
+        store, limit, leases, workers, client_crawl_args), status=status)
+    while run_crawl_pass(scheduler, store, dispatch_args.retry_policies,
+                         logger):
+        retry_secs = store.next_retry_secs()
+        if retry_secs is None:
+            break
+        logger.info(f"Retrying failed domains in {retry_secs:.0f}s")
+        time.sleep(retry_secs)
+        # Every domain still to do is either retried in this pass, or in a
+        # later one.
+        status.set_remaining(store.counts()[State.TODO])
+        scheduler = new_scheduler(retry_work_items(
+            store, leases, workers, dispatch_args.retry_policies,
+            client_crawl_args), status=status)
+
+
+def run_crawl(store: WorkStore, ips: list[IPAddress], user: UserName,
+              num_todo: int, limit: int, dispatch_args: DispatchCrawlArgs,
+              client_crawl_args: ClientCrawlArgs, logger: Logger) -> None:
+    # Everything started for the crawl is stopped again however it ends,
+    # including by an exception or Ctrl-C.
+    # The metrics are created ahead of the manager, which records to them,
+    # since the live view reading them wraps the manager's logger.
+    status = RunStatus(DispatchMetrics(), num_todo)
+    if dispatch_args.show_status:
+        logger = StatusLogger(logger.level.value, status)
+        logger.start()
+    manager: Optional[Manager] = None
+    workers: Optional[Workers] = None
+    metrics_server = None
+    leases = LeaseKeeper(store, dispatch_args.lease_secs)
+    try:
+        manager, workers, new_scheduler = dispatch_engine(
+            ips, user, dispatch_args, logger, status.metrics)
+        if dispatch_args.metrics_port:
+            metrics_server = MetricsServer(dispatch_args.metrics_port,
+                                           manager.metrics, manager.pool,
+                                           WORK_DB_PATH)
+            metrics_server.start(logger)
+        leases.start()
+        run_crawl_passes(store, limit, leases, workers, new_scheduler,
+                         dispatch_args, client_crawl_args, status, logger)
+        if workers:
+            flush_uploads(store, workers, dispatch_args.timeout,
+                          dispatch_args.retry_policies, status.metrics,
+                          logger)
+    finally:
+        if isinstance(logger, StatusLogger):
+            logger.stop()
+        if metrics_server:
+            metrics_server.stop()
+        if num_released := leases.release_all():
+            logger.info(f"Re-queued {num_released} domains still underway.")
+        if workers:
+            workers.close()
+        if manager:
+            manager.close()
 
 
 def client_crawl(ips: list[IPAddress], user: UserName, summarize: bool,
-                 limit: int, client_crawl_args: ClientCrawlArgs,
-                 timeout: int, logger: Logger) -> None:
-    domains = domains_to_crawl()
-    if limit > 0:
-        domains = domains[:limit]
+                 limit: int, dispatch_args: DispatchCrawlArgs,
+                 client_crawl_args: ClientCrawlArgs, logger: Logger) -> None:
+    store = WorkStore(WORK_DB_PATH)
+    try:
+        check_expired_leases(store, dispatch_args.resume, logger)
+        num_todo = store.counts()[State.TODO]
+        num_todo = min(num_todo, limit) if limit else num_todo
+        if summarize:
+            logger.info(f"Crawling {num_todo} domains w/ {len(ips)} "
+                        f"servers ({dispatch_args.slots} slot(s) each).")
+            return
+        run_crawl(store, ips, user, num_todo, limit, dispatch_args,
+                  client_crawl_args, logger)
+    finally:
+        store.close()
 
-    if summarize:
-        logger.info(f"Crawling {len(domains)} domains w/ {len(ips)} servers.")
+
+def query_work_items(store: WorkStore, output: QueryOutput, limit: int,
+                     workers: Optional[Workers], client_code_path: str,
+                     client_query_args: ClientQueryArgs
+                     ) -> Iterator[WorkItem]:
+    for tranco_record in domains_to_query(store, output, limit):
+        work_args = [tranco_record, workers, client_code_path,
+                     client_query_args, output]
+        yield WorkItem(query_domain, f"Querying {str(tranco_record)}",
+                       work_args, async_query_domain)
+
+
+def record_query_response(output: QueryOutput, work_response: WorkResponse,
+                          logger: Logger) -> None:
+    # Successful results were already written, as they arrived.
+    tranco_record = cast(TrancoDomain, work_response.work_item.args[0])
+    summary = f"{work_response.ip} -> {str(tranco_record)}"
+    if work_response.is_success:
+        logger.info(summary)
         return
+    output.write(tranco_record, None)
+    logger.error(f"{summary} (query failed)")
 
-    manager = ThreadIPManager(ips, user, timeout, logger)
-    with ThreadPoolExecutor(max_workers=manager.num_workers(),
-                            initializer=manager.init_thread,) as executor:
-        logger.debug(f"Crawling {len(domains)} domains")
-
-        work_items = []
-        for tranco_record in domains:
-            work_args = [
-                tranco_record,
-                client_crawl_args.client_code_path,
-                client_crawl_args.binary_path,
-                client_crawl_args.pagegraph_secs,
-                client_crawl_args.s3_bucket,
-                client_crawl_args.timeout
-            ]
-            work_item = WorkItem(crawl_with_client_server,
-                                 f"Crawling {str(tranco_record)} domains",
-                                 work_args)
-            work_items.append(work_item)
-
-        for work_response in manager.call(executor, work_items):
-            work_args = work_response.work_item.args
-            tranco_record = cast(TrancoDomain, work_args[0])
-            if work_response.is_success:
-                record_as_complete(tranco_record)
-                logger.info(str(work_response))
-            else:
-                record_as_error(tranco_record)
-                logger.error(str(work_response))
+
+def run_query_pass(scheduler: Scheduler, output: QueryOutput,
+                   logger: Logger) -> None:
+    for work_response in scheduler.run():
+        record_query_response(output, work_response, logger)
+    for work_item in scheduler.unfinished():
+        logger.error(f"No clients left for: {work_item.message}")
+
+
+def client_query(ips: list[IPAddress], user: UserName, summarize: bool,
+                 limit: int, dispatch_args: DispatchQueryArgs,
+                 client_code_path: str, client_query_args: ClientQueryArgs,
+                 logger: Logger) -> None:
+    store = WorkStore(WORK_DB_PATH)
+    output = QueryOutput(dispatch_args.output_path)
+    if num_done := output.open():
+        logger.info(f"Skipping {num_done} domains already queried in "
+                    f"{dispatch_args.output_path}.")
+
+    if summarize:
+        num_todo = sum(1 for _ in domains_to_query(store, output, limit))
+        logger.info(f"Querying {num_todo} crawled domains w/ {len(ips)} "
+                    f"servers ({dispatch_args.slots} slot(s) each).")
+    else:
+        manager, workers, new_scheduler = dispatch_engine(
+            ips, user, dispatch_args, logger)
+        run_query_pass(new_scheduler(query_work_items(
+            store, output, limit, workers, client_code_path,
+            client_query_args)), output, logger)
+        if workers:
+            workers.close()
+        manager.close()
+    output.close()
+    store.close()
+
+
+def crawl_timings(hours: float, state: Optional[State],
+                  logger: Logger) -> None:
+    # Prints percentiles of the time spent in each phase of the crawls
+    # attempted in the last `hours` hours (or ever, if 0).
+    store = WorkStore(WORK_DB_PATH)
+    since = time.time() - hours * 60 * 60 if hours else 0
+    summary = summarize_timings(list(store.iter_timings(since, state)))
+    store.close()
+    if not summary:
+        logger.info("No crawl timings recorded.")
+        return
+    columns = [f"p{x}" for x in SUMMARY_PERCENTILES]
+    logger.info(f"{'phase':<12} {'count':>7} "
+                + " ".join(f"{x:>9}" for x in columns))
+    for phase, stats in summary.items():
+        logger.info(f"{phase:<12} {stats['count']:>7.0f} "
+                    + " ".join(f"{stats[x]:>8.2f}s" for x in columns))
@@ -0,0 +1,59 @@
+import threading
+from typing import Optional
+
+from pgcrawl.dispatch.store import WorkStore
+from pgcrawl.types import TrancoDomain
+
+
+# Holds leases on the domains currently being crawled, and renews all of
+# them from a single background thread, so that a lease only expires if
+# this dispatcher stops (or stops hearing back from a client).
+class LeaseKeeper:
+    store: WorkStore
+    lease_secs: int
+    held: dict[int, str]
+    lock: threading.Lock
+    stop_event: threading.Event
+    thread: Optional[threading.Thread]
+
+    def __init__(self, store: WorkStore, lease_secs: int) -> None:
+        self.store = store
+        self.lease_secs = lease_secs
+        self.held = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+
+    def release_all(self) -> int:
+        # Stops renewing leases, and re-queues the domains still held (i.e.,
+        # if the crawl was cut short), so the next crawl picks them up
+        # without waiting for their leases to expire.
+        self.stop()
+        with self.lock:
+            held = list(self.held.items())
+            self.held = {}
+        return self.store.release(held)
+
+    def run(self) -> None:
+        while not self.stop_event.wait(self.lease_secs / 3):
+            with self.lock:
+                held = list(self.held.items())
+            self.store.renew(held, self.lease_secs)
+
+    def hold(self, record: TrancoDomain, client: str) -> None:
+        self.store.start(record, client, self.lease_secs)
+        with self.lock:
+            self.held[record.rank] = client
+
+    def release(self, record: TrancoDomain) -> None:
+        with self.lock:
+            self.held.pop(record.rank, None)
@@ -0,0 +1,87 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import threading
+from typing import Any, Callable, Optional
+
+from pgcrawl.connections import ConnectionPool
+from pgcrawl.dispatch.store import WorkStore
+from pgcrawl.logging import Logger
+from pgcrawl.metrics import DispatchMetrics, labels, render_counters
+
+
+METRICS_HOST = "127.0.0.1"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def metrics_handler(page: Callable[[], str]
+                    ) -> type[BaseHTTPRequestHandler]:
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            # pylint: disable=invalid-name
+            body = page().encode("utf8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            # pylint: disable=redefined-builtin
+            # Scrapes would otherwise be logged to stderr, every time.
+            pass
+    return MetricsHandler
+
+
+# Serves the dispatcher's metrics (along with the size of the queue, by
+# state, and SSH reconnects) on localhost, in the Prometheus text format,
+# from a thread of its own. Counters are only read when scraped, and the
+# queue is counted with a database connection of the server's own, so
+# serving them never holds up dispatching.
+class MetricsServer:
+    metrics: DispatchMetrics
+    pool: ConnectionPool
+    store: WorkStore
+    server: ThreadingHTTPServer
+    thread: Optional[threading.Thread]
+
+    def __init__(self, port: int, metrics: DispatchMetrics,
+                 pool: ConnectionPool, store_path: Path) -> None:
+        self.metrics = metrics
+        self.pool = pool
+        self.store = WorkStore(store_path)
+        self.server = ThreadingHTTPServer((METRICS_HOST, port),
+                                          metrics_handler(self.page))
+        self.server.daemon_threads = True
+        self.thread = None
+
+    def page(self) -> str:
+        depths = [(labels(state=state.value), float(count))
+                  for state, count in self.store.counts().items()]
+        pool_stats = sorted(self.pool.stats().items(),
+                            key=lambda x: str(x[0][0]))
+        reconnects = [(labels(client=str(ip)), float(stats.reconnects))
+                      for (ip, _), stats in pool_stats]
+        lines = (
+            self.metrics.render()
+            + render_counters("pgcrawl_ssh_reconnects_total",
+                              "Times a pooled SSH connection to a client "
+                              "was opened again.", "counter", reconnects)
+            + render_counters("pgcrawl_queue_depth",
+                              "Domains in the work store, by state.",
+                              "gauge", depths))
+        return "\n".join(lines) + "\n"
+
+    def start(self, logger: Logger) -> None:
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        host, port = self.server.server_address[:2]
+        logger.info(f"Serving metrics at http://{host!s}:{port}/metrics")
+
+    def stop(self) -> None:
+        if self.thread:
+            self.server.shutdown()
+            self.thread.join()
+            self.thread = None
+        self.server.server_close()
+        self.store.close()
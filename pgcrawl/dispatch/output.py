@@ -0,0 +1,79 @@
+import json
+from pathlib import Path
+import threading
+from typing import IO, Optional
+
+from pgcrawl.client.queries import QUERY_FORMAT
+from pgcrawl.types import JSONDict, TrancoDomain
+
+
+# Collects the query results from every client into a single file, with
+# one JSON object per line, like
+#   {"rank": 1, "domain": "example.com", "success": true, "format": 2,
+#    "results": {...}}
+# where "format" is the QUERY_FORMAT the results were computed with. Lines
+# are appended (and flushed) as results arrive, so an interrupted run can
+# be resumed, skipping every domain that already has results of the
+# current format. When a domain appears more than once, its last line is
+# the one to use.
+class QueryOutput:
+    path: Path
+    done_ranks: set[int]
+    handle: Optional[IO[str]]
+    lock: threading.Lock
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.done_ranks = set()
+        self.handle = None
+        self.lock = threading.Lock()
+
+    def open(self) -> int:
+        # Returns the number of domains that already have results.
+        needs_newline = False
+        if self.path.is_file():
+            with open(self.path, "r", encoding="utf8") as handle:
+                for line in handle:
+                    needs_newline = not line.endswith("\n")
+                    self.read_line(line)
+        # pylint: disable=consider-using-with
+        self.handle = open(self.path, "a", encoding="utf8")
+        # A line that was only partly written before the last run stopped
+        # is left as is, but never continued.
+        if needs_newline:
+            self.handle.write("\n")
+        return len(self.done_ranks)
+
+    def read_line(self, line: str) -> None:
+        try:
+            data = json.loads(line)
+        except ValueError:
+            return
+        if (isinstance(data, dict) and data.get("success")
+                and data.get("format") == QUERY_FORMAT):
+            self.done_ranks.add(int(data["rank"]))
+
+    def is_done(self, record: TrancoDomain) -> bool:
+        return record.rank in self.done_ranks
+
+    def write(self, record: TrancoDomain,
+              results: Optional[JSONDict]) -> None:
+        line = json.dumps({
+            "rank": record.rank,
+            "domain": record.domain,
+            "success": results is not None,
+            "format": QUERY_FORMAT,
+            "results": results,
+        })
+        with self.lock:
+            assert self.handle
+            self.handle.write(line + "\n")
+            self.handle.flush()
+            if results is not None:
+                self.done_ranks.add(record.rank)
+
+    def close(self) -> None:
+        with self.lock:
+            if self.handle:
+                self.handle.close()
+                self.handle = None
@@ -0,0 +1,71 @@
+from argparse import ArgumentTypeError
+from dataclasses import dataclass
+import math
+from typing import Optional
+
+from pgcrawl.results import Failure
+
+
+@dataclass
+class RetryPolicy:
+    # Number of times to retry a domain after a failure of this kind
+    max_retries: int
+    # Number of seconds to wait before the first retry, which doubles for
+    # each retry after that.
+    backoff_secs: float = 0
+    # Number of seconds to add to --pagegraph-secs when retrying
+    extra_pagegraph_secs: int = 0
+
+    def retry_delay(self, attempts: int) -> Optional[float]:
+        # Number of seconds to wait before trying a domain again, after it
+        # has been tried `attempts` times, or None if it shouldn't be.
+        if attempts > self.max_retries:
+            return None
+        return float(self.backoff_secs * 2 ** max(attempts - 1, 0))
+
+
+RetryPolicies = dict[Failure, RetryPolicy]
+
+
+DEFAULT_RETRY_POLICIES: RetryPolicies = {
+    Failure.SSH: RetryPolicy(3, 30),
+    Failure.TIMEOUT: RetryPolicy(1, 60),
+    Failure.DISPLAY: RetryPolicy(2, 10),
+    Failure.BROWSER_TIMEOUT: RetryPolicy(1, 0, 10),
+    Failure.BROWSER_ERROR: RetryPolicy(1),
+    Failure.DNS: RetryPolicy(0),
+    Failure.NO_GRAPH: RetryPolicy(1),
+    Failure.UPLOAD: RetryPolicy(3, 30),
+    Failure.UNKNOWN: RetryPolicy(1, 30),
+}
+
+
+def parse_retry_policy(value: str) -> tuple[Failure, RetryPolicy]:
+    # Parses policies given on the command line, in the form
+    # "<failure>=<max retries>[:<backoff secs>[:<extra pagegraph secs>]]",
+    # e.g., "ssh=3:30" or "browser-timeout=1:0:20". None of which can be
+    # negative.
+    try:
+        name, policy_str = value.split("=", 1)
+        failure = Failure(name)
+        parts = policy_str.split(":")
+        if len(parts) > 3:
+            raise ValueError(value)
+        max_retries = int(parts[0])
+        backoff_secs = float(parts[1]) if len(parts) > 1 else 0
+        extra_secs = int(parts[2]) if len(parts) > 2 else 0
+        if min(max_retries, extra_secs) < 0 or \
+                not 0 <= backoff_secs < math.inf:
+            raise ValueError(value)
+    except ValueError as e:
+        choices = ", ".join(x.value for x in Failure)
+        raise ArgumentTypeError(
+            f"Invalid retry policy '{value}', expected "
+            "<failure>=<retries>[:<backoff>[:<extra secs>]], where "
+            f"<failure> is one of {choices}") from e
+    return failure, RetryPolicy(max_retries, backoff_secs, extra_secs)
+
+
+def retry_policies(overrides: list[tuple[Failure, RetryPolicy]]
+                   ) -> RetryPolicies:
+    return {**DEFAULT_RETRY_POLICIES, **dict(overrides)}
@@ -0,0 +1,338 @@
+from enum import Enum
+import json
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from typing import Iterable, Iterator, Optional
+
+from pgcrawl.results import CompressionStats, Failure
+from pgcrawl.timing import Timings
+from pgcrawl.types import TrancoDomain
+
+
+class State(Enum):
+    TODO = "todo"
+    UNDERWAY = "underway"
+    # Crawled, but the graph is still waiting in the client's outbox (see
+    # Outbox), and isn't done until the client reports it uploaded.
+    UPLOADING = "uploading"
+    DONE = "done"
+    ERROR = "error"
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS domains (
+    rank INTEGER PRIMARY KEY,
+    domain TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'todo',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    client TEXT,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    lease_expires REAL,
+    failure TEXT,
+    retry_after REAL,
+    graph_bytes INTEGER,
+    stored_bytes INTEGER,
+    compress_secs REAL,
+    timings TEXT
+);
+CREATE INDEX IF NOT EXISTS domains_state_rank ON domains (state, rank);
+"""
+
+# Number of rows to read at a time when iterating over domains to crawl
+TODO_BATCH_SIZE = 256
+
+# Columns added after the table was first created, which need to be added
+# to databases created by earlier versions of this code.
+ADDED_COLUMNS = {
+    "lease_expires": "REAL",
+    "failure": "TEXT",
+    "retry_after": "REAL",
+    "graph_bytes": "INTEGER",
+    "stored_bytes": "INTEGER",
+    "compress_secs": "REAL",
+    # JSON object of the seconds spent in each phase of the last attempt
+    "timings": "TEXT",
+}
+
+
+# Tracks the crawl state of every domain in a single SQLite database file.
+# One connection is shared by all dispatcher threads, and every statement
+# runs under a lock, so claiming and finishing work is always atomic.
+class WorkStore:
+    path: Path
+    conn: sqlite3.Connection
+    lock: threading.Lock
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False,
+                                    isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.migrate()
+        self.lock = threading.Lock()
+
+    def migrate(self) -> None:
+        rows = self.conn.execute("PRAGMA table_info(domains)").fetchall()
+        present_columns = {x[1] for x in rows}
+        for column, column_type in ADDED_COLUMNS.items():
+            if column not in present_columns:
+                self.conn.execute(
+                    f"ALTER TABLE domains ADD COLUMN {column} {column_type}")
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+    def add(self, domains: Iterable[TrancoDomain],
+            state: State = State.TODO) -> int:
+        now = time.time()
+        rows = ((x.rank, x.domain, state.value, now, now) for x in domains)
+        with self.lock, self.conn:
+            before = self.conn.total_changes
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO domains "
+                "(rank, domain, state, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)", rows)
+            return self.conn.total_changes - before
+
+    def iter_rows(self, condition: str, params: tuple[float, ...],
+                  batch_size: int, state: State = State.TODO
+                  ) -> Iterator[tuple[int, str, Optional[str]]]:
+        last_rank = -1
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT rank, domain, failure FROM domains WHERE "
+                    f"state = ? AND rank > ? AND {condition} "
+                    "ORDER BY rank LIMIT ?",
+                    (state.value, last_rank, *params,
+                     batch_size)).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last_rank = rows[-1][0]
+
+    def iter_todo(self, limit: int = 0,
+                  batch_size: int = TODO_BATCH_SIZE) -> Iterator[TrancoDomain]:
+        # Lazily yields domains that have never been tried, in rank order,
+        # reading them from the database a batch at a time.
+        rows = self.iter_rows("retry_after IS NULL", (), batch_size)
+        for num_yielded, (rank, domain, _) in enumerate(rows, start=1):
+            yield TrancoDomain(rank, domain)
+            if num_yielded == limit:
+                return
+
+    def iter_done(self, batch_size: int = TODO_BATCH_SIZE
+                  ) -> Iterator[TrancoDomain]:
+        # Lazily yields domains that were crawled successfully, in rank
+        # order.
+        rows = self.iter_rows("1", (), batch_size, State.DONE)
+        for rank, domain, _ in rows:
+            yield TrancoDomain(rank, domain)
+
+    def iter_retries(self, batch_size: int = TODO_BATCH_SIZE
+                     ) -> Iterator[tuple[TrancoDomain, Optional[Failure]]]:
+        # Lazily yields domains whose retries are due, along with the
+        # reason their last attempt failed.
+        rows = self.iter_rows("retry_after <= ?", (time.time(),), batch_size)
+        for rank, domain, failure in rows:
+            yield (TrancoDomain(rank, domain),
+                   Failure(failure) if failure else None)
+
+    def next_retry_secs(self) -> Optional[float]:
+        # Number of seconds until the next retry is due, or None if there
+        # are no retries waiting.
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT MIN(retry_after) FROM domains WHERE state = ? AND "
+                "retry_after IS NOT NULL", (State.TODO.value,)).fetchone()
+        if row[0] is None:
+            return None
+        return max(0.0, float(row[0]) - time.time())
+
+    def attempts(self, record: TrancoDomain) -> int:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT attempts FROM domains WHERE rank = ?",
+                (record.rank,)).fetchone()
+        return int(row[0]) if row else 0
+
+    def claim(self, client: str,
+              lease_secs: int) -> Optional[TrancoDomain]:
+        # Leases the first domain to do, skipping retries that aren't due.
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "UPDATE domains SET state = ?, attempts = attempts + 1, "
+                "client = ?, started_at = ?, updated_at = ?, "
+                "lease_expires = ? "
+                "WHERE rank = (SELECT rank FROM domains WHERE state = ? "
+                "AND (retry_after IS NULL OR retry_after <= ?) "
+                "ORDER BY rank LIMIT 1) RETURNING rank, domain",
+                (State.UNDERWAY.value, client, now, now, now + lease_secs,
+                 State.TODO.value, now)).fetchone()
+        if row is None:
+            return None
+        return TrancoDomain(row[0], row[1])
+
+    def start(self, record: TrancoDomain, client: str,
+              lease_secs: int) -> None:
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "UPDATE domains SET state = ?, attempts = attempts + 1, "
+                "client = ?, started_at = ?, updated_at = ?, "
+                "lease_expires = ? WHERE rank = ?",
+                (State.UNDERWAY.value, client, now, now, now + lease_secs,
+                 record.rank))
+
+    def renew(self, leases: list[tuple[int, str]], lease_secs: int) -> None:
+        # Extends the leases on the given (rank, client) pairs, as long as
+        # the domain is still underway by the same client.
+        now = time.time()
+        rows = ((now + lease_secs, now, rank, client, State.UNDERWAY.value)
+                for rank, client in leases)
+        with self.lock, self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany(
+                "UPDATE domains SET lease_expires = ?, updated_at = ? "
+                "WHERE rank = ? AND client = ? AND state = ?", rows)
+
+    def release(self, leases: list[tuple[int, str]]) -> int:
+        # Re-queues the domains of the given (rank, client) pairs, as long
+        # as they're still underway by the same client, returning how many
+        # were.
+        now = time.time()
+        rows = ((State.TODO.value, now, rank, client, State.UNDERWAY.value)
+                for rank, client in leases)
+        with self.lock, self.conn:
+            rs = self.conn.executemany(
+                "UPDATE domains SET state = ?, client = NULL, "
+                "lease_expires = NULL, updated_at = ? "
+                "WHERE rank = ? AND client = ? AND state = ?", rows)
+        return rs.rowcount
+
+    def expired_leases(self) -> int:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT COUNT(*) FROM domains WHERE (state = ? AND "
+                "(lease_expires IS NULL OR lease_expires < ?)) OR state = ?",
+                (State.UNDERWAY.value, time.time(),
+                 State.UPLOADING.value)).fetchone()
+        return int(row[0])
+
+    def reclaim_expired(self) -> int:
+        # Re-queues domains that were underway when the dispatcher
+        # crawling them stopped, and so will never be finished, along with
+        # those whose uploads were never confirmed.
+        now = time.time()
+        with self.lock:
+            rs = self.conn.execute(
+                "UPDATE domains SET state = ?, client = NULL, "
+                "lease_expires = NULL, updated_at = ? WHERE (state = ? AND "
+                "(lease_expires IS NULL OR lease_expires < ?)) OR state = ?",
+                (State.TODO.value, now, State.UNDERWAY.value, now,
+                 State.UPLOADING.value))
+        return rs.rowcount
+
+    def requeue(self, record: TrancoDomain) -> None:
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "UPDATE domains SET state = ?, client = NULL, "
+                "lease_expires = NULL, updated_at = ? WHERE rank = ?",
+                (State.TODO.value, now, record.rank))
+
+    def finish(self, record: TrancoDomain, state: State,
+               failure: Optional[Failure] = None,
+               error: Optional[str] = None,
+               compression: Optional[CompressionStats] = None,
+               timings: Optional[Timings] = None) -> None:
+        now = time.time()
+        sizes: tuple[Optional[int], Optional[int], Optional[float]] = (
+            None, None, None)
+        if compression:
+            sizes = (compression.raw_bytes, compression.compressed_bytes,
+                     compression.cpu_secs)
+        with self.lock:
+            self.conn.execute(
+                "UPDATE domains SET state = ?, failure = ?, last_error = ?, "
+                "finished_at = ?, updated_at = ?, lease_expires = NULL, "
+                "retry_after = NULL, graph_bytes = ?, stored_bytes = ?, "
+                "compress_secs = ?, timings = ? WHERE rank = ?",
+                (state.value, failure.value if failure else None, error, now,
+                 now, *sizes, json.dumps(timings) if timings else None,
+                 record.rank))
+
+    def find(self, rank: int, state: State) -> Optional[TrancoDomain]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT rank, domain FROM domains WHERE rank = ? AND "
+                "state = ?", (rank, state.value)).fetchone()
+        return TrancoDomain(row[0], row[1]) if row else None
+
+    def confirm_upload(self, rank: int) -> bool:
+        # Returns False if the domain wasn't waiting on its upload (e.g.,
+        # if it was re-queued since).
+        now = time.time()
+        with self.lock:
+            rs = self.conn.execute(
+                "UPDATE domains SET state = ?, updated_at = ? WHERE "
+                "rank = ? AND state = ?",
+                (State.DONE.value, now, rank, State.UPLOADING.value))
+        return rs.rowcount > 0
+
+    def schedule_retry(self, record: TrancoDomain, failure: Failure,
+                       error: Optional[str], retry_after: float,
+                       timings: Optional[Timings] = None) -> None:
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "UPDATE domains SET state = ?, failure = ?, last_error = ?, "
+                "updated_at = ?, lease_expires = NULL, client = NULL, "
+                "retry_after = ?, timings = ? WHERE rank = ?",
+                (State.TODO.value, failure.value, error, now, retry_after,
+                 json.dumps(timings) if timings else None, record.rank))
+
+    def iter_timings(self, since: float = 0,
+                     state: Optional[State] = None) -> Iterator[Timings]:
+        # Yields the timings of every domain last attempted since the given
+        # time, optionally only those in the given state.
+        query = ("SELECT timings FROM domains WHERE timings IS NOT NULL "
+                 "AND updated_at >= ?")
+        params: tuple[float | str, ...] = (since,)
+        if state:
+            query += " AND state = ?"
+            params += (state.value,)
+        with self.lock:
+            rows = self.conn.execute(query, params).fetchall()
+        for (timings,) in rows:
+            try:
+                yield json.loads(timings)
+            except ValueError:
+                continue
+
+    def counts(self) -> dict[State, int]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT state, COUNT(*) FROM domains GROUP BY state")
+            counts = {State(state): count for state, count in rows}
+        return {x: counts.get(x, 0) for x in State}
+
+    def import_dir(self, dir_path: Path, state: State) -> int:
+        # Imports the state tracked by one of the older, file-per-domain,
+        # workspace directories (e.g., TODO_DIR).
+        if not dir_path.is_dir():
+            return 0
+        records = (TrancoDomain.from_path(x) for x in dir_path.iterdir()
+                   if x.is_file())
+        return self.add(records, state)
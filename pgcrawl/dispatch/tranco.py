@@ -0,0 +1,100 @@
+from contextlib import contextmanager
+import csv
+import gzip
+from io import TextIOWrapper
+from itertools import islice
+from pathlib import Path
+import random
+import time
+from typing import Iterable, Iterator, Optional, TextIO
+import zipfile
+
+from pgcrawl.dispatch.store import State, WorkStore
+from pgcrawl.logging import Logger
+from pgcrawl.types import TrancoDomain
+
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZIP_MAGIC = b"PK\x03\x04"
+
+# Tranco lists are UTF-8, but a leading byte order mark (e.g., from a list
+# saved by a spreadsheet) is skipped, rather than read as part of a rank.
+TRANCO_ENCODING = "utf-8-sig"
+
+# Number of domains to insert into the work database per transaction
+IMPORT_BATCH_SIZE = 50_000
+
+
+@contextmanager
+def open_tranco_file(path: Path) -> Iterator[TextIO]:
+    # Opens a Tranco CSV for reading, whether it's plain text, gzip'ed, or
+    # a zip archive (as downloaded from tranco-list.eu), in which case the
+    # first CSV in the archive is read.
+    with open(path, "rb") as raw_file:
+        magic = raw_file.read(4)
+    if magic.startswith(GZIP_MAGIC):
+        with gzip.open(path, "rt", encoding=TRANCO_ENCODING,
+                       newline="") as text:
+            yield text
+    elif magic.startswith(ZIP_MAGIC):
+        with zipfile.ZipFile(path) as archive:
+            names = [x for x in archive.namelist() if x.endswith(".csv")]
+            if not names:
+                raise ValueError(f"No CSV file in {path}")
+            with archive.open(names[0]) as member:
+                yield TextIOWrapper(member, encoding=TRANCO_ENCODING,
+                                    newline="")
+    else:
+        with open(path, "r", encoding=TRANCO_ENCODING, newline="") as text:
+            yield text
+
+
+def read_tranco(stream: TextIO, from_rank: int = 1,
+                to_rank: Optional[int] = None,
+                sample: float = 1.0,
+                seed: Optional[int] = None) -> Iterator[TrancoDomain]:
+    # Lazily yields the records in a Tranco CSV whose ranks fall in
+    # [from_rank, to_rank], keeping only the first (i.e., best ranked) row
+    # for any domain listed more than once, and, if sample is less than
+    # one, only that fraction of rows (chosen at random).
+    rng = random.Random(seed)
+    seen_domains: set[str] = set()
+    for row in csv.reader(stream):
+        if len(row) < 2 or not row[0].strip().isdecimal():
+            continue
+        rank = int(row[0])
+        if rank < from_rank:
+            continue
+        if to_rank is not None and rank > to_rank:
+            # Tranco lists are sorted by rank
+            return
+        domain = row[1].strip().lower()
+        if not domain or domain in seen_domains:
+            continue
+        seen_domains.add(domain)
+        if sample < 1.0 and rng.random() >= sample:
+            continue
+        yield TrancoDomain(rank, domain)
+
+
+def import_tranco(store: WorkStore, records: Iterable[TrancoDomain],
+                  logger: Logger,
+                  batch_size: int = IMPORT_BATCH_SIZE) -> tuple[int, int]:
+    # Adds the records to the work database a batch at a time, so that
+    # neither the file or the database need to be held in memory, and
+    # returns the number of records read and the number actually added.
+    start = time.monotonic()
+    num_read = 0
+    num_added = 0
+    records_iter = iter(records)
+    while batch := list(islice(records_iter, batch_size)):
+        num_read += len(batch)
+        num_added += store.add(batch, State.TODO)
+        rate = num_read / max(time.monotonic() - start, 1e-6)
+        logger.progress(f"Read {num_read:,} domains, added {num_added:,} "
+                        f"({rate:,.0f} rows/s)")
+    elapsed = time.monotonic() - start
+    rate = num_read / max(elapsed, 1e-6)
+    logger.progress(f"Read {num_read:,} domains, added {num_added:,} in "
+                    f"{elapsed:.1f}s ({rate:,.0f} rows/s)", done=True)
+    return num_read, num_added
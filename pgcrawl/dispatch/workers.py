@@ -0,0 +1,138 @@
+import json
+import socket
+import threading
+from typing import Any, Optional
+
+from paramiko.channel import Channel
+
+from pgcrawl.logging import Logger
+from pgcrawl.results import Failure
+from pgcrawl.types import ClientServer, IPAddress, UserName
+
+
+JobDict = dict[str, Any]
+WorkerKey = tuple[IPAddress, UserName, int]
+
+
+# A `client.py serve` process running on a client, for one slot, reached
+# through a channel on the (pooled) SSH connection to that client.
+class ResidentWorker:
+    channel: Channel
+    reader: Any
+    next_id: int
+
+    def __init__(self, channel: Channel) -> None:
+        self.channel = channel
+        self.reader = channel.makefile("r")
+        self.next_id = 1
+
+    def is_alive(self) -> bool:
+        return not self.channel.closed and not self.channel.exit_status_ready()
+
+    def call(self, job: JobDict, timeout: int,
+             logger: Logger) -> JobDict | Failure:
+        job_id = self.next_id
+        self.next_id += 1
+        payload = dict(job, id=job_id)
+        self.channel.settimeout(timeout)
+        try:
+            self.channel.sendall((json.dumps(payload) + "\n").encode("utf8"))
+            while True:
+                line = self.reader.readline()
+                if not line:
+                    logger.error("Resident worker exited")
+                    self.log_stderr(logger)
+                    return Failure.SSH
+                response: JobDict = json.loads(line)
+                if response.get("id") == job_id:
+                    # Reading what the worker logged between jobs (e.g.,
+                    # from background uploads) keeps it from filling the
+                    # channel's window.
+                    self.log_stderr(logger)
+                    return response
+        except socket.timeout:
+            logger.error(f"Timeout: no response after {timeout}s")
+            return Failure.TIMEOUT
+        except (OSError, EOFError, ValueError) as e:
+            logger.error(f"Resident worker error: {e}")
+        return Failure.SSH
+
+    def log_stderr(self, logger: Logger) -> None:
+        while self.channel.recv_stderr_ready():
+            logger.error(self.channel.recv_stderr(4096))
+
+    def close(self) -> None:
+        self.channel.close()
+
+
+class ResidentWorkers:
+    workers_: dict[WorkerKey, ResidentWorker]
+    lock_: threading.Lock
+
+    def __init__(self) -> None:
+        self.workers_ = {}
+        self.lock_ = threading.Lock()
+
+    def start(self, server: ClientServer, serve_cmd: str, timeout: int,
+              logger: Logger) -> Optional[ResidentWorker]:
+        # pylint: disable=broad-exception-caught
+        logger.debug(f"*  starting worker on {server.desc()}: {serve_cmd}")
+        try:
+            channel = server.connection().transport.open_session()
+            channel.exec_command(serve_cmd)
+        except Exception as e:
+            logger.error(f"Unable to start worker on {server.desc()}: {e}")
+            server.discard()
+            return None
+
+        worker = ResidentWorker(channel)
+        if isinstance(worker.call({"command": "ping"}, timeout, logger),
+                      Failure):
+            worker.close()
+            return None
+        return worker
+
+    def get(self, server: ClientServer, serve_cmd: str, timeout: int,
+            logger: Logger) -> Optional[ResidentWorker]:
+        key = (server.ip, server.user, server.slot)
+        with self.lock_:
+            worker = self.workers_.get(key)
+        if worker and worker.is_alive():
+            return worker
+
+        worker = self.start(server, serve_cmd, timeout, logger)
+        with self.lock_:
+            if worker:
+                self.workers_[key] = worker
+            else:
+                self.workers_.pop(key, None)
+        return worker
+
+    def discard(self, server: ClientServer) -> None:
+        key = (server.ip, server.user, server.slot)
+        with self.lock_:
+            worker = self.workers_.pop(key, None)
+        if worker:
+            worker.close()
+
+    def call_all(self, job: JobDict, timeout: int,
+                 logger: Logger) -> list[JobDict]:
+        # Sends the job to every live worker, returning the responses of
+        # those that answered.
+        with self.lock_:
+            workers = list(self.workers_.values())
+        responses = []
+        for worker in workers:
+            if not worker.is_alive():
+                continue
+            response = worker.call(job, timeout, logger)
+            if not isinstance(response, Failure):
+                responses.append(response)
+        return responses
+
+    def close(self) -> None:
+        with self.lock_:
+            workers = list(self.workers_.values())
+            self.workers_ = {}
+        for worker in workers:
+            worker.close()
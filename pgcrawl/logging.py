@@ -58,6 +58,16 @@ class Logger:
                 return True
         return False
 
+    def progress(self, msg: Any, done: bool = False) -> bool:
+        # Keeps rewriting a single line on the terminal until done is True.
+        # When not writing to a terminal, only the final message is printed.
+        if not self.print_info or not (text := as_string(msg)):
+            return False
+        if not sys.stdout.isatty():
+            return self.info(text) if done else False
+        print(f"\r\033[KINFO: {text}", end="\n" if done else "", flush=True)
+        return True
+
     def error(self, msg: Any) -> bool:
         if text := as_string(msg):
             print(f"ERROR: {text}", file=sys.stderr)
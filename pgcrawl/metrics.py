@@ -0,0 +1,214 @@
+from bisect import bisect_left
+from dataclasses import dataclass, field
+import threading
+from typing import Iterable
+
+from pgcrawl.results import CrawlResult, OutboxStats
+from pgcrawl.types import IPAddress, WorkOutcome, is_success
+
+
+# Upper bounds (in seconds) of the buckets of each latency histogram
+CRAWL_SECS_BUCKETS = [5.0, 10.0, 20.0, 30.0, 45.0, 60.0, 90.0, 120.0, 180.0,
+                      300.0]
+UPLOAD_SECS_BUCKETS = [0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+
+
+@dataclass
+class Histogram:
+    bounds: list[float]
+    # Not cumulative, with one more count than bounds, for +Inf
+    counts: list[int]
+    total: float = 0.0
+
+    @staticmethod
+    def empty(bounds: list[float]) -> "Histogram":
+        return Histogram(bounds, [0] * (len(bounds) + 1))
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+
+    def add(self, other: "Histogram") -> None:
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.total += other.total
+
+
+# What's been run on one client
+@dataclass
+class ClientCounts:
+    started: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    total_secs: float = 0.0
+    # Number of failures of each kind (see Failure)
+    failures: dict[str, int] = field(default_factory=dict)
+
+    def add(self, other: "ClientCounts") -> None:
+        # Finished work is read before started work, so if other is being
+        # recorded to at the same time, work is never counted as finished
+        # without having been started.
+        self.succeeded += other.succeeded
+        self.failed += other.failed
+        self.total_secs += other.total_secs
+        for reason, count in other.failures.copy().items():
+            self.failures[reason] = self.failures.get(reason, 0) + count
+        self.started += other.started
+
+    def in_flight(self) -> int:
+        return self.started - self.num_done()
+
+    def num_done(self) -> int:
+        return self.succeeded + self.failed
+
+    def success_rate(self) -> float:
+        return self.succeeded / max(self.num_done(), 1)
+
+    def mean_secs(self) -> float:
+        return self.total_secs / max(self.num_done(), 1)
+
+
+# The metrics recorded by one thread. Only that thread ever writes to it,
+# so recording never waits on a lock, and readers sum every shard.
+@dataclass
+class MetricsShard:
+    clients: dict[IPAddress, ClientCounts] = field(default_factory=dict)
+    crawl_secs: Histogram = field(
+        default_factory=lambda: Histogram.empty(CRAWL_SECS_BUCKETS))
+    upload_secs: Histogram = field(
+        default_factory=lambda: Histogram.empty(UPLOAD_SECS_BUCKETS))
+
+    def client(self, ip: IPAddress) -> ClientCounts:
+        return self.clients.setdefault(ip, ClientCounts())
+
+
+def labels(**values: str) -> str:
+    return ",".join(f'{name}="{value}"' for name, value in values.items())
+
+
+def render_counters(name: str, help_text: str, metric_type: str,
+                    values: Iterable[tuple[str, float]]) -> list[str]:
+    # Renders a metric in the Prometheus text format.
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for label_str, value in values:
+        label_part = f"{{{label_str}}}" if label_str else ""
+        lines.append(f"{name}{label_part} {value:g}")
+    return lines
+
+
+def render_histogram(name: str, help_text: str,
+                     histogram: Histogram) -> list[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    cumulative = 0
+    bounds = [f"{x:g}" for x in histogram.bounds] + ["+Inf"]
+    for bound, count in zip(bounds, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+    lines.append(f"{name}_sum {histogram.total:g}")
+    lines.append(f"{name}_count {cumulative}")
+    return lines
+
+
+# Counters and histograms of the work run by a manager, recorded from its
+# worker threads (see MetricsShard). They're the only counts kept of the
+# work, both rendered in the Prometheus text format for MetricsServer, and
+# shown by RunStatus.
+class DispatchMetrics:
+    shards: list[MetricsShard]
+    local: threading.local
+    lock: threading.Lock
+
+    def __init__(self) -> None:
+        self.shards = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def shard(self) -> MetricsShard:
+        shard: MetricsShard | None = getattr(self.local, "shard", None)
+        if shard is None:
+            # Only taken the first time each thread records anything.
+            shard = MetricsShard()
+            with self.lock:
+                self.shards.append(shard)
+            self.local.shard = shard
+        return shard
+
+    def started(self, ip: IPAddress) -> None:
+        self.shard().client(ip).started += 1
+
+    def finished(self, ip: IPAddress, outcome: WorkOutcome,
+                 secs: float) -> None:
+        shard = self.shard()
+        client = shard.client(ip)
+        result = outcome if isinstance(outcome, CrawlResult) else None
+        shard.crawl_secs.observe(secs)
+        # Graphs are either uploaded as part of the crawl, or later, by the
+        # client's outbox, which reports them with the crawls that follow.
+        if result and result.timings and "upload" in result.timings:
+            shard.upload_secs.observe(result.timings["upload"])
+        if result and result.outbox:
+            self.uploaded(result.outbox)
+        client.total_secs += secs
+        if is_success(outcome):
+            client.succeeded += 1
+            return
+        reason = (result.failure.value if result and result.failure
+                  else "unknown")
+        client.failures[reason] = client.failures.get(reason, 0) + 1
+        client.failed += 1
+
+    def uploaded(self, outbox: OutboxStats) -> None:
+        shard = self.shard()
+        for secs in outbox.upload_secs:
+            shard.upload_secs.observe(secs)
+
+    def totals(self) -> tuple[dict[IPAddress, ClientCounts], Histogram,
+                              Histogram]:
+        clients: dict[IPAddress, ClientCounts] = {}
+        crawl_secs = Histogram.empty(CRAWL_SECS_BUCKETS)
+        upload_secs = Histogram.empty(UPLOAD_SECS_BUCKETS)
+        with self.lock:
+            shards = list(self.shards)
+        for shard in shards:
+            # Copying a dict happens all at once (under the GIL), so no
+            # client is missed, if its counts are a moment out of date.
+            for ip, counts in shard.clients.copy().items():
+                clients.setdefault(ip, ClientCounts()).add(counts)
+            crawl_secs.add(shard.crawl_secs)
+            upload_secs.add(shard.upload_secs)
+        return clients, crawl_secs, upload_secs
+
+    def clients(self) -> dict[IPAddress, ClientCounts]:
+        return self.totals()[0]
+
+    def render(self) -> list[str]:
+        clients, crawl_secs, upload_secs = self.totals()
+        by_client = sorted(((labels(client=str(ip)), counts)
+                            for ip, counts in clients.items()),
+                           key=lambda x: x[0])
+        failed = sorted(
+            (labels(client=str(ip), reason=reason), float(count))
+            for ip, counts in clients.items()
+            for reason, count in counts.failures.items())
+
+        return (
+            render_counters("pgcrawl_crawls_started_total",
+                            "Crawls started, by client.", "counter",
+                            [(x, y.started) for x, y in by_client])
+            + render_counters("pgcrawl_crawls_succeeded_total",
+                              "Crawls that succeeded, by client.",
+                              "counter",
+                              [(x, y.succeeded) for x, y in by_client])
+            + render_counters("pgcrawl_crawls_failed_total",
+                              "Crawls that failed, by client and reason.",
+                              "counter", failed)
+            + render_counters("pgcrawl_crawls_in_flight",
+                              "Crawls currently running, by client.",
+                              "gauge",
+                              [(x, y.in_flight()) for x, y in by_client])
+            + render_histogram("pgcrawl_crawl_seconds",
+                               "Seconds from starting a crawl to its "
+                               "result.", crawl_secs)
+            + render_histogram("pgcrawl_upload_seconds",
+                               "Seconds clients spent uploading graphs.",
+                               upload_secs))
@@ -0,0 +1,141 @@
+from dataclasses import asdict, dataclass, field
+from enum import Enum
+import json
+from typing import Any, Optional
+
+from pgcrawl.timing import Timings
+
+
+class Failure(Enum):
+    # The dispatcher couldn't reach the client, or lost the connection
+    SSH = "ssh"
+    # The dispatcher gave up waiting on the client
+    TIMEOUT = "timeout"
+    # The client couldn't start a display for the browser
+    DISPLAY = "display"
+    # The browser didn't finish the crawl in time
+    BROWSER_TIMEOUT = "browser-timeout"
+    # The browser (or pagegraph-crawl) exited with an error
+    BROWSER_ERROR = "browser-error"
+    # The domain didn't resolve
+    DNS = "dns"
+    # The crawl seemed to succeed, but didn't write a graph
+    NO_GRAPH = "no-graph"
+    # The graph couldn't be uploaded
+    UPLOAD = "upload"
+    UNKNOWN = "unknown"
+
+
+# Failures that suggest something is wrong with the client, rather than with
+# the domain being crawled.
+CLIENT_FAILURES = [Failure.SSH, Failure.TIMEOUT, Failure.UNKNOWN]
+
+# Substrings in browser output that mean the domain didn't resolve.
+DNS_ERROR_MARKERS = ["ERR_NAME_NOT_RESOLVED", "ERR_NAME_RESOLUTION_FAILED"]
+
+
+# How much compressing a graph saved, and what it cost.
+@dataclass
+class CompressionStats:
+    codec: str
+    raw_bytes: int
+    compressed_bytes: int
+    # CPU time spent compressing the graph
+    cpu_secs: float
+
+    def ratio(self) -> float:
+        return self.raw_bytes / max(self.compressed_bytes, 1)
+
+
+# The state of a client's upload outbox, as of the end of a crawl.
+@dataclass
+class OutboxStats:
+    # pylint: disable=too-many-instance-attributes
+    # Number of graphs waiting to be (or being) uploaded
+    depth: int = 0
+    uploaded: int = 0
+    # Number of graphs that couldn't be uploaded, even after retrying
+    failed: int = 0
+    # Seconds from the last uploaded graph being put in the outbox to it
+    # being in S3, and the mean time spent uploading each graph.
+    last_latency_secs: float = 0
+    mean_upload_secs: float = 0
+    # Ranks of the graphs uploaded, and given up on, since the outbox last
+    # reported them (see Outbox.report), so the dispatcher can confirm
+    # them, and the seconds spent uploading each graph uploaded.
+    uploaded_ranks: list[int] = field(default_factory=list)
+    failed_ranks: list[int] = field(default_factory=list)
+    upload_secs: list[float] = field(default_factory=list)
+
+
+# How often query results were already cached, either on this client or
+# next to the graph in storage, since the client started.
+@dataclass
+class QueryCacheStats:
+    local_hits: int = 0
+    remote_hits: int = 0
+    misses: int = 0
+
+    def hit_rate(self) -> float:
+        hits = self.local_hits + self.remote_hits
+        return hits / max(hits + self.misses, 1)
+
+
+@dataclass
+class CrawlResult:
+    success: bool
+    failure: Optional[Failure] = None
+    message: str = ""
+    outbox: Optional[OutboxStats] = None
+    compression: Optional[CompressionStats] = None
+    # Seconds spent in each phase of the crawl (see PhaseTimer), by the
+    # client, and then by the dispatcher.
+    timings: Optional[Timings] = None
+
+    @staticmethod
+    def failed(failure: Failure, message: str = "") -> "CrawlResult":
+        return CrawlResult(False, failure, message)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "success": self.success,
+            "failure": self.failure.value if self.failure else None,
+            "message": self.message,
+            "outbox": asdict(self.outbox) if self.outbox else None,
+            "compression": (asdict(self.compression) if self.compression
+                            else None),
+            "timings": self.timings,
+        }
+
+    @staticmethod
+    def from_dict(data: dict[str, Any]) -> "CrawlResult":
+        failure = Failure(data["failure"]) if data.get("failure") else None
+        outbox = OutboxStats(**data["outbox"]) if data.get("outbox") else None
+        compression = None
+        if data.get("compression"):
+            compression = CompressionStats(**data["compression"])
+        return CrawlResult(bool(data["success"]), failure,
+                           data.get("message", ""), outbox, compression,
+                           data.get("timings"))
+
+    @staticmethod
+    def from_output(output: str, exit_code: int) -> "CrawlResult":
+        # `client.py crawl` prints its result as JSON on the last line of
+        # its output (after anything it logs).
+        lines = output.strip().splitlines()
+        try:
+            data = json.loads(lines[-1]) if lines else None
+            if isinstance(data, dict):
+                return CrawlResult.from_dict(data)
+        except (ValueError, KeyError):
+            pass
+        if exit_code == 0:
+            return CrawlResult(True)
+        return CrawlResult.failed(Failure.UNKNOWN, output)
+
+
+def classify_browser_error(output: str) -> Failure:
+    for marker in DNS_ERROR_MARKERS:
+        if marker in output:
+            return Failure.DNS
+    return Failure.BROWSER_ERROR
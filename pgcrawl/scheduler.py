@@ -0,0 +1,136 @@
+from collections import deque
+import queue
+import threading
+from typing import Iterable, Iterator, Optional
+
+from pgcrawl.status import RunStatus
+from pgcrawl.threading import ThreadIPManager
+from pgcrawl.types import IPAddress, WorkItem, WorkResponse
+
+
+# Maximum number of finished, but not yet recorded, responses to hold
+# before workers wait on the caller to catch up.
+DEFAULT_RESPONSE_WINDOW = 64
+
+
+# Runs work items across every (ip, slot) the manager knows about, where
+# each slot pulls its next work item only once it is free. Work items are
+# drawn from a (possibly lazy) iterator as needed, so only the work
+# currently in flight is ever held in memory, and faster clients simply
+# end up pulling more work than slower ones.
+#
+# If a work item fails and its client then can't be reached, the client is
+# retired for the rest of the run, and the work item is re-queued for the
+# remaining clients. So once the source runs out, slots wait for the work
+# still in flight, instead of stopping, in case any of it is re-queued.
+class PullScheduler:
+    # pylint: disable=too-many-instance-attributes
+    manager: ThreadIPManager
+    source: Iterator[WorkItem]
+    is_exhausted: bool
+    requeued: deque[WorkItem]
+    num_in_flight: int
+    dead_ips: set[IPAddress]
+    responses: queue.Queue[Optional[WorkResponse]]
+    lock: threading.Lock
+    changed: threading.Condition
+    status: RunStatus
+
+    def __init__(self, manager: ThreadIPManager, source: Iterable[WorkItem],
+                 window: int = DEFAULT_RESPONSE_WINDOW,
+                 status: Optional[RunStatus] = None) -> None:
+        self.manager = manager
+        self.source = iter(source)
+        self.is_exhausted = False
+        self.requeued = deque()
+        self.num_in_flight = 0
+        self.dead_ips = set()
+        self.responses = queue.Queue(maxsize=window)
+        self.lock = threading.Lock()
+        # Notified whenever work is finished or re-queued.
+        self.changed = threading.Condition(self.lock)
+        self.status = status or RunStatus(manager.metrics)
+
+    def next_item(self, ip: IPAddress) -> Optional[WorkItem]:
+        # Returns None once there's no work left for the client, i.e., when
+        # it's been retired, or nothing is left to do, or in flight.
+        with self.changed:
+            while ip not in self.dead_ips:
+                work_item = self.requeued.popleft() if self.requeued else None
+                if work_item is None and not self.is_exhausted:
+                    work_item = next(self.source, None)
+                    self.is_exhausted = work_item is None
+                if work_item is not None:
+                    self.num_in_flight += 1
+                    return work_item
+                if self.num_in_flight == 0:
+                    return None
+                self.changed.wait()
+            return None
+
+    def finish(self, work_item: WorkItem, requeue: bool) -> None:
+        with self.changed:
+            self.num_in_flight -= 1
+            if requeue:
+                self.requeued.append(work_item)
+            self.changed.notify_all()
+
+    def retire(self, ip: IPAddress) -> None:
+        with self.lock:
+            self.dead_ips.add(ip)
+
+    def all_retired(self) -> bool:
+        with self.lock:
+            return len(self.dead_ips) == len(self.manager.ip_addresses)
+
+    def work(self, ip: IPAddress, slot: int) -> None:
+        try:
+            while (work_item := self.next_item(ip)) is not None:
+                is_requeued = False
+                try:
+                    is_requeued = self.run_item(ip, slot, work_item)
+                finally:
+                    self.finish(work_item, is_requeued)
+        finally:
+            self.responses.put(None)
+
+    def run_item(self, ip: IPAddress, slot: int, work_item: WorkItem) -> bool:
+        # Returns True if the client was retired, and the work item is to
+        # be re-queued.
+        outcome = self.manager.call_on_slot(ip, slot, work_item)
+        work_response = WorkResponse.from_outcome(ip, work_item, outcome)
+        if (work_response.may_be_client_failure()
+                and not self.manager.is_reachable(ip)):
+            self.manager.logger.error(
+                f"({ip}) -> retiring client, re-queuing {work_item.message}")
+            self.status.finished(requeued=True)
+            self.retire(ip)
+            return True
+        self.status.finished()
+        self.responses.put(work_response)
+        return False
+
+    def run(self) -> Iterable[WorkResponse]:
+        threads = []
+        for ip, slot in self.manager.worker_slots():
+            thread = threading.Thread(target=self.work, args=(ip, slot),
+                                      daemon=True)
+            thread.start()
+            threads.append(thread)
+
+        num_running = len(threads)
+        while num_running > 0:
+            work_response = self.responses.get()
+            if work_response is None:
+                num_running -= 1
+                continue
+            yield work_response
+
+        for thread in threads:
+            thread.join()
+
+    def unfinished(self) -> list[WorkItem]:
+        # Work items that were re-queued, but never picked up again,
+        # because every client was retired.
+        with self.lock:
+            return list(self.requeued)
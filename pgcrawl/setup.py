@@ -3,10 +3,15 @@ import pathlib
 from pgcrawl.logging import Logger
 from pgcrawl import PG_CRAWL_GIT_URL, BRAVE_INSTALL_SCRIPT
 from pgcrawl.client import PAGEGRAPH_QUERY_ENV_DIR, PAGEGRAPH_QUERY_PROJECT_DIR
-from pgcrawl.client import PAGEGRAPH_CRAWL_DIR
+from pgcrawl.client import PAGEGRAPH_CRAWL_DIR, PROFILE_TEMPLATE_DIR
 from pgcrawl.subprocesses import call
 
 
+# Number of seconds to let the browser run for, when creating the profile
+# template.
+PROFILE_SEED_SECS = 15
+
+
 def mkdirs(dirs: list[pathlib.Path], logger: Logger) -> None:
     logger.debug("Setting up the crawling workspace.")
     for a_dir in dirs:
@@ -51,6 +56,31 @@ def clone_brave_crawl(logger: Logger) -> bool:
     return call(install_args, logger, cwd=str(path))
 
 
+def check_for_profile_template(logger: Logger) -> bool:
+    check_args = ["test", "-d", str(PROFILE_TEMPLATE_DIR / "Default")]
+    return call(check_args, logger)
+
+
+def seed_profile_template(binary_path: str, logger: Logger) -> bool:
+    # Runs the browser once against a new profile, so that crawls can start
+    # from a copy of a profile that's already done its first run setup.
+    seed_args = [
+        "timeout", str(PROFILE_SEED_SECS),
+        binary_path,
+        "--headless",
+        f"--user-data-dir={PROFILE_TEMPLATE_DIR.absolute()}",
+        "--no-first-run",
+        "--no-default-browser-check",
+        "about:blank",
+    ]
+    # The browser runs until it's killed, so the exit code doesn't matter.
+    call(seed_args, logger, timeout=PROFILE_SEED_SECS + 10)
+    # These would make each copy look like it was already in use.
+    for lock_path in PROFILE_TEMPLATE_DIR.glob("Singleton*"):
+        lock_path.unlink()
+    return check_for_profile_template(logger)
+
+
 def check_for_pagegraph_query(logger: Logger) -> bool:
     requirements_file_path = PAGEGRAPH_QUERY_PROJECT_DIR / "requirements.txt"
     check_cmd_args = ["test", "-d", str(requirements_file_path)]
@@ -0,0 +1,208 @@
+from collections import deque
+import shutil
+import sys
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from pgcrawl.logging import Logger
+from pgcrawl.metrics import DispatchMetrics
+
+
+# The rate is measured over the work finished in this many past seconds.
+STATUS_WINDOW_SECS = 5 * 60
+# How often the status is redrawn, when writing to a terminal
+STATUS_REFRESH_SECS = 1.0
+# How often the status is logged instead, when not writing to a terminal
+STATUS_LOG_SECS = 60.0
+# Only this many clients (the worst performing ones) are shown.
+MAX_STATUS_CLIENTS = 10
+
+
+def format_secs(secs: Optional[float]) -> str:
+    if secs is None:
+        return "?"
+    minutes, secs = divmod(int(secs), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m"
+    if minutes:
+        return f"{minutes}m{secs:02d}s"
+    return f"{secs}s"
+
+
+# How far a run has got, kept in memory and updated by the scheduler as
+# each work item finishes. What's been run on each client (and how it
+# went) is read from the manager's metrics, which count it already.
+class RunStatus:
+    metrics: DispatchMetrics
+    # Number of work items still to be finished, as far as is known
+    remaining: int
+    started_at: float
+    # When each work item finished in the last STATUS_WINDOW_SECS
+    finished_at: deque[float]
+    lock: threading.Lock
+
+    def __init__(self, metrics: DispatchMetrics, remaining: int = 0) -> None:
+        self.metrics = metrics
+        self.remaining = remaining
+        self.started_at = time.monotonic()
+        self.finished_at = deque()
+        self.lock = threading.Lock()
+
+    def set_remaining(self, remaining: int) -> None:
+        with self.lock:
+            self.remaining = remaining
+
+    def finished(self, requeued: bool = False) -> None:
+        # Work items that are requeued (since their client was retired)
+        # are still remaining.
+        if requeued:
+            return
+        now = time.monotonic()
+        with self.lock:
+            self.remaining = max(self.remaining - 1, 0)
+            self.finished_at.append(now)
+            self.prune(now)
+
+    def prune(self, now: float) -> None:
+        # Only called with the lock held.
+        while self.finished_at \
+                and self.finished_at[0] < now - STATUS_WINDOW_SECS:
+            self.finished_at.popleft()
+
+    def rate_per_min(self, now: float) -> float:
+        # Only called with the lock held.
+        self.prune(now)
+        window = min(now - self.started_at, STATUS_WINDOW_SECS)
+        return len(self.finished_at) / max(window, 1.0) * 60
+
+    def summary(self) -> str:
+        now = time.monotonic()
+        in_flight = sum(x.in_flight()
+                        for x in self.metrics.clients().values())
+        with self.lock:
+            rate = self.rate_per_min(now)
+            eta = self.remaining / rate * 60 if rate else None
+            window = min(now - self.started_at, STATUS_WINDOW_SECS)
+            return (f"{rate:.1f}/min over the last {format_secs(window)}, "
+                    f"{self.remaining:,} remaining, ETA {format_secs(eta)}, "
+                    f"{in_flight} in flight")
+
+    def lines(self) -> list[str]:
+        lines = [self.summary()]
+        clients = self.metrics.clients()
+        failures: dict[str, int] = {}
+        for client in clients.values():
+            for name, count in client.failures.items():
+                failures[name] = failures.get(name, 0) + count
+        errors = ", ".join(f"{name} {count:,}" for name, count
+                           in sorted(failures.items()))
+        lines.append(f"errors: {errors or 'none'}")
+        # Clients are listed from worst to best, so a client that has
+        # slowed down (or keeps failing) is always shown.
+        ranked = sorted(clients.items(),
+                        key=lambda x: (x[1].success_rate(),
+                                       -x[1].mean_secs()))
+        for ip, client in ranked[:MAX_STATUS_CLIENTS]:
+            lines.append(
+                f"  {ip}: {client.succeeded:,}/{client.num_done():,} "
+                f"ok ({client.success_rate():.0%}), "
+                f"{client.mean_secs():.1f}s mean, "
+                f"{client.in_flight()} in flight")
+        if len(ranked) > MAX_STATUS_CLIENTS:
+            lines.append(f"  ... and {len(ranked) - MAX_STATUS_CLIENTS} "
+                         "more clients")
+        return lines
+
+
+# Logs as usual, but keeps a live view of a RunStatus below everything it
+# logs, redrawing it in place. When not writing to a terminal, the
+# status is logged every STATUS_LOG_SECS instead.
+class StatusLogger(Logger):
+    # pylint: disable=too-many-instance-attributes
+    status: RunStatus
+    # Held while writing, so lines never land in the middle of the view.
+    lock: threading.RLock
+    # Number of lines the view takes up on the terminal, if drawn
+    num_lines: int
+    stop_event: threading.Event
+    thread: Optional[threading.Thread]
+
+    def __init__(self, log_level: str, status: RunStatus) -> None:
+        super().__init__(log_level)
+        self.status = status
+        self.lock = threading.RLock()
+        self.num_lines = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.refresh_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        if not self.thread:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        with self.lock:
+            self.clear()
+        super().info(self.status.summary())
+
+    def refresh_loop(self) -> None:
+        is_tty = sys.stdout.isatty()
+        interval = STATUS_REFRESH_SECS if is_tty else STATUS_LOG_SECS
+        while not self.stop_event.wait(interval):
+            if is_tty:
+                self.refresh()
+            else:
+                super().info(self.status.summary())
+
+    def refresh(self) -> None:
+        with self.lock:
+            self.clear()
+            self.draw()
+
+    def clear(self) -> None:
+        if self.num_lines:
+            # Moves to the first line of the view, and erases to the end.
+            sys.stdout.write(f"\033[{self.num_lines}F\033[J")
+            sys.stdout.flush()
+            self.num_lines = 0
+
+    def draw(self) -> None:
+        if not self.thread or not self.print_info or not sys.stdout.isatty():
+            return
+        # Lines are cut to fit, since wrapped lines would throw off how
+        # many lines clear() erases.
+        width = shutil.get_terminal_size().columns - 1
+        lines = [x[:width] for x in self.status.lines()]
+        print("\n".join(lines), flush=True)
+        self.num_lines = len(lines)
+
+    def with_view(self, log: Callable[[Any], bool], msg: Any) -> bool:
+        with self.lock:
+            self.clear()
+            is_logged = log(msg)
+            self.draw()
+        return is_logged
+
+    def debug(self, msg: Any) -> bool:
+        return self.with_view(super().debug, msg)
+
+    def info(self, msg: Any) -> bool:
+        return self.with_view(super().info, msg)
+
+    def progress(self, msg: Any, done: bool = False) -> bool:
+        # The view is only drawn again once the progress line is done.
+        with self.lock:
+            self.clear()
+            is_logged = super().progress(msg, done)
+            if done:
+                self.draw()
+        return is_logged
+
+    def error(self, msg: Any) -> bool:
+        return self.with_view(super().error, msg)
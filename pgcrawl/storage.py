@@ -0,0 +1,265 @@
+from abc import ABC, abstractmethod
+import io
+import os
+from pathlib import Path
+import shutil
+import threading
+from typing import Any, IO, Iterator, TYPE_CHECKING, cast
+import urllib.parse
+
+if TYPE_CHECKING:
+    from _typeshed import WriteableBuffer
+
+
+# Maximum number of connections the S3 client keeps open at once, which
+# bounds how many transfers can run concurrently.
+S3_MAX_POOL_CONNECTIONS = 16
+S3_CONNECT_TIMEOUT = 10
+S3_READ_TIMEOUT = 60
+
+
+class StorageError(Exception):
+    pass
+
+
+# Where crawled graphs are kept, addressed by keys like
+# "graphs/1_example.com.graphml.gz".
+class Storage(ABC):
+    @abstractmethod
+    def put(self, local_path: Path, key: str) -> None:
+        pass
+
+    @abstractmethod
+    def put_bytes(self, data: bytes, key: str) -> None:
+        pass
+
+    @abstractmethod
+    def get(self, key: str) -> IO[bytes]:
+        # Returns a stream of the stored object, which the caller closes.
+        pass
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        pass
+
+    @abstractmethod
+    def list(self, prefix: str = "") -> Iterator[str]:
+        # Yields the keys starting with the prefix, fetching them in
+        # batches, so any number of objects can be listed.
+        pass
+
+    @abstractmethod
+    def url(self, key: str = "") -> str:
+        pass
+
+
+# Stores objects under a directory, for running crawls, queries and
+# benchmarks without S3.
+class FileStorage(Storage):
+    root: Path
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+
+    def path(self, key: str) -> Path:
+        return self.root / key
+
+    def put(self, local_path: Path, key: str) -> None:
+        dest_path = self.path(key)
+        tmp_path = dest_path.with_name(dest_path.name + ".part")
+        try:
+            dest_path.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(local_path, tmp_path)
+            # So no one ever reads a partly written object
+            os.replace(tmp_path, dest_path)
+        except OSError as e:
+            tmp_path.unlink(missing_ok=True)
+            raise StorageError(f"Unable to write {self.url(key)}: {e}") from e
+
+    def put_bytes(self, data: bytes, key: str) -> None:
+        dest_path = self.path(key)
+        tmp_path = dest_path.with_name(dest_path.name + ".part")
+        try:
+            dest_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, dest_path)
+        except OSError as e:
+            tmp_path.unlink(missing_ok=True)
+            raise StorageError(f"Unable to write {self.url(key)}: {e}") from e
+
+    def get(self, key: str) -> IO[bytes]:
+        try:
+            return open(self.path(key), "rb")
+        except OSError as e:
+            raise StorageError(f"Unable to read {self.url(key)}: {e}") from e
+
+    def exists(self, key: str) -> bool:
+        return self.path(key).is_file()
+
+    def list(self, prefix: str = "") -> Iterator[str]:
+        for path in sorted(self.root.rglob("*")):
+            key = str(path.relative_to(self.root))
+            if path.is_file() and key.startswith(prefix) \
+                    and not key.endswith(".part"):
+                yield key
+
+    def url(self, key: str = "") -> str:
+        return self.path(key).absolute().as_uri()
+
+
+# The body of an S3 object, which raises StorageError if it can't be read
+# (e.g., if the connection times out, or drops, partway through), like
+# reading from any other storage, instead of botocore's own errors.
+class S3Body(io.RawIOBase):
+    body: Any
+    url: str
+    errors: tuple[type[Exception], ...]
+
+    def __init__(self, body: Any, url: str,
+                 errors: tuple[type[Exception], ...]) -> None:
+        super().__init__()
+        self.body = body
+        self.url = url
+        self.errors = errors
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        try:
+            return cast(bytes, self.body.read(size if size >= 0 else None))
+        except self.errors as e:
+            raise StorageError(f"Unable to read {self.url}: {e}") from e
+
+    def readall(self) -> bytes:
+        return self.read()
+
+    def readinto(self, buffer: "WriteableBuffer") -> int:
+        view = memoryview(buffer).cast("B")
+        data = self.read(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    def close(self) -> None:
+        if not self.closed:
+            self.body.close()
+        super().close()
+
+
+# Stores objects in an S3 bucket (under an optional prefix). Transfers all
+# share one client, and so one pool of connections, instead of paying for
+# starting the aws CLI (and a new connection) for each one.
+class S3Storage(Storage):
+    bucket: str
+    prefix: str
+    client: Any
+
+    def __init__(self, bucket: str, prefix: str = "") -> None:
+        # boto3 is only needed on hosts that actually talk to S3.
+        # pylint: disable=import-outside-toplevel
+        import boto3
+        from botocore.config import Config
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        config = Config(max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                        connect_timeout=S3_CONNECT_TIMEOUT,
+                        read_timeout=S3_READ_TIMEOUT,
+                        retries={"mode": "standard"})
+        self.client = boto3.client("s3", config=config)
+
+    def object_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def put(self, local_path: Path, key: str) -> None:
+        # pylint: disable=import-outside-toplevel
+        from boto3.exceptions import S3UploadFailedError
+        from botocore.exceptions import BotoCoreError, ClientError
+        try:
+            self.client.upload_file(str(local_path), self.bucket,
+                                    self.object_key(key))
+        except (BotoCoreError, ClientError, S3UploadFailedError,
+                OSError) as e:
+            raise StorageError(f"Unable to write {self.url(key)}: {e}") from e
+
+    def put_bytes(self, data: bytes, key: str) -> None:
+        # pylint: disable=import-outside-toplevel
+        from botocore.exceptions import BotoCoreError, ClientError
+        try:
+            self.client.put_object(Bucket=self.bucket,
+                                   Key=self.object_key(key), Body=data)
+        except (BotoCoreError, ClientError) as e:
+            raise StorageError(f"Unable to write {self.url(key)}: {e}") from e
+
+    def get(self, key: str) -> IO[bytes]:
+        # pylint: disable=import-outside-toplevel
+        from botocore.exceptions import BotoCoreError, ClientError
+        try:
+            rs = self.client.get_object(Bucket=self.bucket,
+                                        Key=self.object_key(key))
+        except (BotoCoreError, ClientError) as e:
+            raise StorageError(f"Unable to read {self.url(key)}: {e}") from e
+        return cast(IO[bytes], S3Body(rs["Body"], self.url(key),
+                                      (BotoCoreError, OSError)))
+
+    def exists(self, key: str) -> bool:
+        # pylint: disable=import-outside-toplevel
+        from botocore.exceptions import BotoCoreError, ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket,
+                                    Key=self.object_key(key))
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ["404", "NoSuchKey"]:
+                return False
+            raise StorageError(f"Unable to check {self.url(key)}: {e}") from e
+        except BotoCoreError as e:
+            raise StorageError(f"Unable to check {self.url(key)}: {e}") from e
+
+    def list(self, prefix: str = "") -> Iterator[str]:
+        # pylint: disable=import-outside-toplevel
+        from botocore.exceptions import BotoCoreError, ClientError
+        paginator = self.client.get_paginator("list_objects_v2")
+        skip = len(self.object_key(""))
+        try:
+            for page in paginator.paginate(Bucket=self.bucket,
+                                           Prefix=self.object_key(prefix)):
+                for item in page.get("Contents", []):
+                    yield str(item["Key"])[skip:]
+        except (BotoCoreError, ClientError) as e:
+            raise StorageError(
+                f"Unable to list {self.url(prefix)}: {e}") from e
+
+    def url(self, key: str = "") -> str:
+        return f"s3://{self.bucket}/{self.object_key(key)}"
+
+
+# Every storage opened so far, by its URL
+OPENED_STORAGE: dict[str, Storage] = {}
+OPEN_STORAGE_LOCK = threading.Lock()
+
+
+def new_storage(storage_url: str) -> Storage:
+    # Accepts s3://bucket[/prefix], file:///path, or (as --s3-bucket always
+    # has) just the name of an S3 bucket.
+    parts = urllib.parse.urlparse(storage_url)
+    match parts.scheme:
+        case "s3":
+            if not parts.netloc:
+                raise ValueError(f"No bucket in {storage_url}")
+            return S3Storage(parts.netloc, parts.path)
+        case "file":
+            return FileStorage(Path(urllib.parse.unquote(parts.path)))
+        case "":
+            bucket, _, prefix = storage_url.partition("/")
+            return S3Storage(bucket, prefix)
+    raise ValueError(f"Unsupported storage: {storage_url}")
+
+
+def open_storage(storage_url: str) -> Storage:
+    # Each storage is only opened once per process (and boto3 clients
+    # can't safely be created from several threads at once), so that every
+    # transfer to it shares the same client.
+    with OPEN_STORAGE_LOCK:
+        if storage_url not in OPENED_STORAGE:
+            OPENED_STORAGE[storage_url] = new_storage(storage_url)
+        return OPENED_STORAGE[storage_url]
@@ -1,3 +1,4 @@
+from dataclasses import dataclass
 from io import StringIO
 import subprocess
 from typing import Any, Optional
@@ -5,6 +6,7 @@ from typing import Any, Optional
 from invoke.exceptions import CommandTimedOut
 
 from pgcrawl.logging import Logger
+from pgcrawl.results import Failure
 from pgcrawl.types import ClientServer
 
 
@@ -31,12 +33,23 @@ def call(args: list[str], logger: Logger, timeout: int = 30,
     return False
 
 
-def run_ssh_cmd(server: ClientServer, cmd: str, timeout: int,
-                logger: Logger) -> bool:
+@dataclass
+class SSHResult:
+    exit_code: Optional[int]
+    output: str
+    # Set if the command couldn't be run to completion at all
+    failure: Optional[Failure] = None
+
+    def is_success(self) -> bool:
+        return self.failure is None and self.exit_code == 0
+
+
+def ssh_cmd_result(server: ClientServer, cmd: str, timeout: int,
+                   logger: Logger) -> SSHResult:
     # pylint: disable=broad-exception-caught
-    conn = server.connection()
-    logger.debug(f"*  calling {conn.user}@{conn.host}: {cmd}")
+    logger.debug(f"*  calling {server.desc()}: {cmd}")
     try:
+        conn = server.connection()
         stdout_stream = StringIO()
         stderr_stream = StringIO()
         rs = conn.run(cmd, warn=True, hide=True, out_stream=stdout_stream,
@@ -44,13 +57,32 @@ def run_ssh_cmd(server: ClientServer, cmd: str, timeout: int,
         logger.debug(stdout_stream.getvalue())
         if rs.exited != 0:
             logger.error(stdout_stream.getvalue())
-            return False
-        return True
+        return SSHResult(rs.exited, stdout_stream.getvalue())
     except CommandTimedOut as e:
         logger.error("Timeout: " + str(e))
-        return False
+        return SSHResult(None, "", Failure.TIMEOUT)
     except Exception as e:
         logger.error(str(e))
-        return False
+        server.discard()
+        return SSHResult(None, "", Failure.SSH)
     finally:
         server.close()
+
+
+def ssh_connect(server: ClientServer, logger: Logger) -> bool:
+    # Opens the connection to the client, if it isn't open already (or
+    # waits on another slot that is opening it), so the handshake can be
+    # timed apart from the commands run over it.
+    # pylint: disable=broad-exception-caught
+    try:
+        server.connection().open()
+        return True
+    except Exception as e:
+        logger.error(f"Unable to connect to {server.desc()}: {e}")
+        server.discard()
+        return False
+
+
+def run_ssh_cmd(server: ClientServer, cmd: str, timeout: int,
+                logger: Logger) -> bool:
+    return ssh_cmd_result(server, cmd, timeout, logger).is_success()
@@ -1,52 +1,92 @@
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import sys
 import threading
-from typing import Iterable
+import time
+from typing import Iterable, Optional
 
+from pgcrawl.connections import ConnectionPool
+from pgcrawl.metrics import DispatchMetrics
 from pgcrawl.types import ClientServer, IPAddress, UserName, WorkItem
-from pgcrawl.types import WorkResponse
+from pgcrawl.types import WorkOutcome, WorkResponse, is_success
 from pgcrawl.logging import Logger
 
 
 class ThreadIPManager:
+    # pylint: disable=too-many-instance-attributes
     ip_addresses: list[IPAddress]
     user: UserName
     timeout: int
     logger: Logger
-    mapping_dict: dict[threading.Thread, IPAddress] = {}
+    pool: ConnectionPool
+    # Number of concurrent workers (i.e., threads) to run per IP
+    slots: int
+    mapping_dict: dict[threading.Thread, tuple[IPAddress, int]]
+    mapping_lock: threading.Lock
+    metrics: DispatchMetrics
 
     def __init__(self, ips: list[IPAddress], user: UserName, timeout: int,
-                 logger: Logger) -> None:
+                 logger: Logger, slots: int = 1,
+                 metrics: Optional[DispatchMetrics] = None) -> None:
         self.ip_addresses = ips
         self.user = user
         self.logger = logger
         self.timeout = timeout
+        self.pool = ConnectionPool(logger)
+        self.slots = slots
+        self.mapping_dict = {}
+        self.mapping_lock = threading.Lock()
+        self.metrics = metrics or DispatchMetrics()
+
+    def worker_slots(self) -> list[tuple[IPAddress, int]]:
+        # Ordered round-robin over the IPs, so that the first slot of every
+        # client is filled before the second slot of any.
+        return [(ip, slot) for slot in range(self.slots)
+                for ip in self.ip_addresses]
 
     def init_thread(self) -> None:
         thread = threading.current_thread()
-        current_index = len(self.mapping_dict)
-        self.mapping_dict[thread] = self.ip_addresses[current_index]
+        with self.mapping_lock:
+            current_index = len(self.mapping_dict)
+            self.mapping_dict[thread] = self.worker_slots()[current_index]
 
     def call_on_thread(self, work: WorkItem) -> tuple[IPAddress, bool]:
+        thread = threading.current_thread()
+        ip, slot = self.mapping_dict[thread]
+        return ip, is_success(self.call_on_slot(ip, slot, work))
+
+    def call_on_slot(self, ip: IPAddress, slot: int,
+                     work: WorkItem) -> WorkOutcome:
         # pylint: disable=broad-exception-caught
         func = work.func
         args = work.args
-        thread = threading.current_thread()
-        ip = self.mapping_dict[thread]
         self.logger.info(f"({ip}) -> {work.message}")
-        server_desc = ClientServer(ip, self.user)
+        server_desc = ClientServer(ip, self.user, self.pool, slot)
+        self.metrics.started(ip)
+        start = time.monotonic()
         try:
-            is_success = func(server_desc, *args, timeout=self.timeout,
-                              logger=self.logger)
+            outcome = func(server_desc, *args, timeout=self.timeout,
+                           logger=self.logger)
         except Exception as e:
             self.logger.error(f"({ip}) -> {e}")
-            is_success = False
+            outcome = False
         finally:
             server_desc.close()
-        return ip, is_success
+        self.metrics.finished(ip, outcome, time.monotonic() - start)
+        return outcome
+
+    def is_reachable(self, ip: IPAddress) -> bool:
+        # pylint: disable=broad-exception-caught
+        try:
+            self.pool.connection(ip, self.user)
+            return True
+        except Exception as e:
+            self.logger.error(f"({ip}) -> unreachable: {e}")
+            return False
 
     def call_on_each(self, executor: ThreadPoolExecutor,
                      work_item: WorkItem) -> list[WorkResponse]:
+        # Note that this is only guaranteed to run once per IP address
+        # when there is one slot per IP.
         work_items = [work_item for _ in self.ip_addresses]
         results = []
         for work_response in self.call(executor, work_items):
@@ -66,7 +106,11 @@ class ThreadIPManager:
             yield WorkResponse(ip_address, was_success, work_item)
 
     def num_workers(self) -> int:
-        return len(self.ip_addresses)
+        return len(self.ip_addresses) * self.slots
+
+    def close(self) -> None:
+        self.pool.summarize()
+        self.pool.close()
 
 
 def exit_with_results(func_name: str, results: list[WorkResponse],
@@ -0,0 +1,55 @@
+from contextlib import contextmanager
+import math
+import time
+from typing import Iterator
+
+
+# Seconds spent in each phase of a crawl, by the phase's name (e.g.,
+# "browser" or "upload").
+Timings = dict[str, float]
+
+# Percentiles that timing summaries report
+SUMMARY_PERCENTILES = [50, 95, 99]
+
+
+# Times the phases of some work with a monotonic clock, adding up the time
+# spent in phases that are entered more than once.
+class PhaseTimer:
+    phases: Timings
+
+    def __init__(self) -> None:
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, time.monotonic() - start)
+
+    def add(self, name: str, secs: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + secs
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    # Nearest-rank percentile, of values that are already sorted
+    index = max(math.ceil(pct / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[index]
+
+
+def summarize_timings(all_timings: list[Timings]
+                      ) -> dict[str, dict[str, float]]:
+    # For each phase, the number of times it was timed, and the
+    # SUMMARY_PERCENTILES of the time spent in it.
+    by_phase: dict[str, list[float]] = {}
+    for timings in all_timings:
+        for name, secs in timings.items():
+            by_phase.setdefault(name, []).append(secs)
+    summary = {}
+    for name, values in sorted(by_phase.items()):
+        values.sort()
+        summary[name] = {"count": float(len(values))}
+        for pct in SUMMARY_PERCENTILES:
+            summary[name][f"p{pct}"] = percentile(values, pct)
+    return summary
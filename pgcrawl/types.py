@@ -1,25 +1,49 @@
 from dataclasses import dataclass
+from enum import Enum
 from ipaddress import IPv4Address, IPv6Address
 from pathlib import Path
 import re
-from typing import Any, Callable, Optional
-
-from fabric import Connection
+from typing import Any, Awaitable, Callable, Optional, TYPE_CHECKING
 
 from pgcrawl.logging import Logger
+from pgcrawl.results import CLIENT_FAILURES, CrawlResult
+
+if TYPE_CHECKING:
+    from fabric import Connection
+    from pgcrawl.connections import ConnectionPool
 
 
 Url = str
 UserName = str
 IPAddress = IPv4Address | IPv6Address
-JSONDict = dict[str, dict[str, str]]
+JSONDict = dict[str, dict[str, int]]
+# Work functions either just report whether they succeeded, or (for crawls)
+# return a result that also says why they failed.
+WorkOutcome = bool | CrawlResult
+
+
+# How the dispatcher talks to clients: either with one thread (and one
+# fabric connection) per client slot, or with every SSH session multiplexed
+# on a single asyncio event loop.
+class Engine(Enum):
+    THREADS = "threads"
+    ASYNCIO = "asyncio"
+
+
+def is_success(outcome: WorkOutcome) -> bool:
+    if isinstance(outcome, CrawlResult):
+        return outcome.success
+    return outcome
 
 
 @dataclass
 class WorkItem:
-    func: Callable[..., bool]
+    func: Callable[..., WorkOutcome]
     message: str
     args: list[Any]
+    # Version of func to use with the asyncio engine, which otherwise runs
+    # func in a thread.
+    async_func: Optional[Callable[..., Awaitable[WorkOutcome]]] = None
 
     def desc(self) -> str:
         args_str = ", ".join([str(x) for x in self.args])
@@ -31,6 +55,21 @@ class WorkResponse:
     ip: IPAddress
     is_success: bool
     work_item: WorkItem
+    result: Optional[CrawlResult] = None
+
+    @staticmethod
+    def from_outcome(ip: IPAddress, work_item: WorkItem,
+                     outcome: WorkOutcome) -> "WorkResponse":
+        if isinstance(outcome, CrawlResult):
+            return WorkResponse(ip, outcome.success, work_item, outcome)
+        return WorkResponse(ip, outcome, work_item)
+
+    def may_be_client_failure(self) -> bool:
+        if self.is_success:
+            return False
+        if self.result is None or self.result.failure is None:
+            return True
+        return self.result.failure in CLIENT_FAILURES
 
     def log(self, logger: Logger) -> None:
         if self.is_success:
@@ -46,15 +85,35 @@ class WorkResponse:
 class ClientServer:
     ip: IPAddress
     user: UserName
-    conn_: Optional[Connection] = None
-
-    def connection(self) -> Connection:
+    pool: Optional["ConnectionPool"] = None
+    # Which of the client's concurrent crawl slots this handle is for.
+    slot: int = 0
+    conn_: Optional["Connection"] = None
+
+    def connection(self) -> "Connection":
+        # fabric is only imported once it's needed, since clients (which
+        # import this module too) never need it, and it's slow to import.
+        from fabric import Connection
+        if self.pool:
+            return self.pool.connection(self.ip, self.user)
         if self.conn_:
             return self.conn_
         self.conn_ = Connection(host=str(self.ip), user=self.user)
         return self.conn_
 
+    def discard(self) -> bool:
+        # Drops the underlying connection (pooled or not), for when it is
+        # suspected to be broken. Pooled connections are only dropped if
+        # they're actually broken, since they're shared by every slot.
+        if self.pool:
+            return self.pool.discard_broken(self.ip, self.user)
+        return self.close()
+
     def close(self) -> bool:
+        # Pooled connections outlive any single command, and are closed
+        # by the pool when the dispatcher is done with all clients.
+        if self.pool:
+            return False
         if self.conn_:
             self.conn_.close()
             self.conn_ = None
@@ -64,29 +123,24 @@ class ClientServer:
     def desc(self) -> str:
         return f"{self.user}@{str(self.ip)}"
 
+    def slot_desc(self) -> str:
+        return f"{self.desc()}#{self.slot}"
 
+
+@dataclass
 class TrancoDomain:
-    file: Path
     rank: int
     domain: str
 
-    def __init__(self, filepath: Path) -> None:
-        self.file = filepath
-        self.rank, self.domain = self.parse()
-
     def __str__(self) -> str:
-        return str(self.file)
+        return f"{self.rank}_{self.domain}"
 
-    def parse(self) -> tuple[int, str]:
-        match = re.match(r"([0-9]+)_(.*)", self.file.name)
+    @staticmethod
+    def from_path(filepath: Path) -> "TrancoDomain":
+        match = re.match(r"([0-9]+)_(.*)", filepath.name)
         if not match:
-            raise ValueError(f"Invalid tranco record: {self.file}")
-        return int(match.group(1)), match.group(2)
+            raise ValueError(f"Invalid tranco record: {filepath}")
+        return TrancoDomain(int(match.group(1)), match.group(2))
 
     def url(self) -> Url:
         return f"http://{self.domain}"
-
-    def move_to_dir(self, new_dir: Path) -> None:
-        new_path = new_dir / self.file.name
-        self.file.rename(str(new_path))
-        self.file = new_path
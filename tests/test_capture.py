@@ -0,0 +1,60 @@
+import gzip
+import io
+from pathlib import Path
+
+from pgcrawl.client.capture import OutputCapture, RingBuffer
+
+
+def test_keeps_the_last_bytes_written() -> None:
+    buffer = RingBuffer(10)
+    for chunk in [b"0123", b"4567", b"89ab", b"cdef"]:
+        buffer.write(chunk)
+    assert buffer.text() == "6789abcdef"
+    # Only as many chunks as are needed to hold the last 10 bytes
+    assert list(buffer.chunks) == [b"4567", b"89ab", b"cdef"]
+
+
+def test_keeps_everything_until_full() -> None:
+    buffer = RingBuffer(10)
+    assert buffer.text() == ""
+    buffer.write(b"abc")
+    buffer.write(b"")
+    buffer.write(b"def")
+    assert buffer.text() == "abcdef"
+    assert buffer.size == 6
+
+
+def test_keeps_the_tail_of_chunks_bigger_than_it() -> None:
+    buffer = RingBuffer(4)
+    buffer.write(b"ab")
+    buffer.write(b"0123456789")
+    assert buffer.text() == "6789"
+    assert list(buffer.chunks) == [b"0123456789"]
+
+
+def test_memory_stays_bounded() -> None:
+    buffer = RingBuffer(1000)
+    for _ in range(10_000):
+        buffer.write(b"x" * 7)
+    assert buffer.size < 1000 + 7
+    assert buffer.size == sum(len(x) for x in buffer.chunks)
+    assert len(buffer.text()) == 1000
+
+
+def test_replaces_characters_split_by_the_cutoff() -> None:
+    buffer = RingBuffer(3)
+    buffer.write("abécd".encode("utf8"))
+    # Only the second of the two bytes of "é" is kept.
+    assert buffer.text() == "\ufffdcd"
+
+
+def test_capture_spools_everything_but_keeps_the_tail(tmp_path: Path) -> None:
+    output = b"".join(b"line %d\n" % x for x in range(10_000))
+    spool_path = tmp_path / "crawl.log.gz"
+    capture = OutputCapture({"stdout": io.BytesIO(output),
+                             "stderr": io.BytesIO(b"")},
+                            max_bytes=100, spool_path=spool_path)
+    capture.close(5)
+    assert capture.text("stdout") == output[-100:].decode("utf8")
+    assert capture.text("stderr") == ""
+    assert gzip.decompress(spool_path.read_bytes()) == output
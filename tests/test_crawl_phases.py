@@ -0,0 +1,46 @@
+from pathlib import Path
+from subprocess import Popen
+import time
+
+from pgcrawl.client.actions import wait_for_browser
+from pgcrawl.dispatch.actions import add_round_trip
+from pgcrawl.results import CrawlResult
+
+
+def test_waits_until_the_browser_starts(tmp_path: Path) -> None:
+    # pylint: disable=consider-using-with
+    # Stands in for node, busy (with shell builtins only) until it's told
+    # to start the "browser".
+    flag_path = tmp_path / "start"
+    script = f"while [ ! -e {flag_path} ]; do :; done; exec sleep 10"
+    rs = Popen(["sh", "-c", script], start_new_session=True)
+    try:
+        start = time.monotonic()
+        wait_for_browser(rs, start + 0.3)
+        assert time.monotonic() - start >= 0.3
+
+        flag_path.touch()
+        start = time.monotonic()
+        wait_for_browser(rs, start + 10)
+        assert time.monotonic() - start < 5
+        assert rs.poll() is None
+    finally:
+        rs.kill()
+        rs.wait()
+
+
+def test_returns_once_the_crawl_exits() -> None:
+    with Popen(["sh", "-c", "exit 1"], start_new_session=True) as rs:
+        start = time.monotonic()
+        wait_for_browser(rs, start + 10)
+        assert time.monotonic() - start < 5
+        assert rs.returncode == 1
+
+
+def test_overhead_excludes_connecting() -> None:
+    result = CrawlResult(True, timings={"client": 6.0, "browser": 5.0})
+    result = add_round_trip(result, 10.0, {"connect": 1.5})
+    assert result.timings == {
+        "client": 6.0, "browser": 5.0, "connect": 1.5, "round_trip": 10.0,
+        "overhead": 2.5,
+    }
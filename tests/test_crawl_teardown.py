@@ -0,0 +1,43 @@
+from ipaddress import ip_address
+from pathlib import Path
+import threading
+from typing import Any
+
+import pytest
+
+from pgcrawl.client.args import DEFAULT_CRAWL_ARGS
+from pgcrawl.dispatch import commands
+from pgcrawl.dispatch.args import DispatchCrawlArgs
+from pgcrawl.dispatch.leases import LeaseKeeper
+from pgcrawl.dispatch.store import State, WorkStore
+from pgcrawl.logging import Logger
+from pgcrawl.types import TrancoDomain
+
+
+def test_interrupted_crawls_release_everything(
+        tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    db_path = tmp_path / "work.db"
+    store = WorkStore(db_path)
+    store.add([TrancoDomain(1, "a.test"), TrancoDomain(2, "b.test")])
+    store.close()
+
+    def interrupted_passes(_store: WorkStore, _limit: int,
+                           leases: LeaseKeeper, *_args: Any) -> None:
+        leases.hold(TrancoDomain(1, "a.test"), "10.0.0.1")
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(commands, "WORK_DB_PATH", db_path)
+    monkeypatch.setattr(commands, "run_crawl_passes", interrupted_passes)
+    args = DispatchCrawlArgs(1, False, False, 60, 30, show_status=False)
+    threads_before = set(threading.enumerate())
+    with pytest.raises(KeyboardInterrupt):
+        commands.client_crawl([ip_address("10.0.0.1")], "user", False, 0,
+                              args, DEFAULT_CRAWL_ARGS, Logger("error"))
+
+    # The lease keeper's thread is stopped, and the domain it held is
+    # back to do, rather than left underway until its lease expires.
+    assert set(threading.enumerate()) <= threads_before
+    store = WorkStore(db_path)
+    assert store.counts()[State.TODO] == 2
+    assert store.counts()[State.UNDERWAY] == 0
+    store.close()
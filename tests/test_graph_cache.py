@@ -0,0 +1,67 @@
+import gzip
+import os
+from pathlib import Path
+
+from pgcrawl.client.actions import UrlRequest, graph_key, run_queries
+from pgcrawl.client.compression import Codec
+from pgcrawl.client.graph_cache import GRAPH_SUFFIX, GraphCache
+from pgcrawl.client.query_cache import digest_key, file_digest
+from pgcrawl.logging import Logger
+from pgcrawl.storage import FileStorage
+
+
+GRAPH_PATH = Path(__file__).parent / "fixtures" / "pagegraph" / \
+    "iframes.graphml"
+REQUEST = UrlRequest("https://example.test", 1)
+KEY = graph_key(REQUEST.object_name(Codec.GZIP))
+
+
+def store_graph(root: Path, with_digest: bool) -> FileStorage:
+    storage = FileStorage(root / "storage")
+    path = storage.path(KEY)
+    path.parent.mkdir(parents=True)
+    path.write_bytes(gzip.compress(GRAPH_PATH.read_bytes()))
+    if with_digest:
+        storage.path(digest_key(KEY)).write_text(file_digest(path), "utf8")
+    return storage
+
+
+def cached_graphs(cache: GraphCache) -> list[Path]:
+    return sorted(cache.cache_dir.glob(f"*{GRAPH_SUFFIX}"))
+
+
+def test_queries_cached_graphs_without_downloading(tmp_path: Path) -> None:
+    storage = store_graph(tmp_path, with_digest=True)
+    cache = GraphCache(tmp_path / "graphs", 1 << 20)
+    logger = Logger("error")
+    first = run_queries(REQUEST, storage, Codec.GZIP, None, cache, logger)
+    assert first and len(cached_graphs(cache)) == 1
+
+    # Only the digest is still read from storage.
+    storage.path(KEY).unlink()
+    assert run_queries(REQUEST, storage, Codec.GZIP, None, cache,
+                       logger) == first
+
+
+def test_skips_graphs_without_digests(tmp_path: Path) -> None:
+    storage = store_graph(tmp_path, with_digest=False)
+    cache = GraphCache(tmp_path / "graphs", 1 << 20)
+    assert run_queries(REQUEST, storage, Codec.GZIP, None, cache,
+                       Logger("error"))
+    assert not cached_graphs(cache)
+
+
+def test_evicts_least_recently_used_graphs(tmp_path: Path) -> None:
+    cache = GraphCache(tmp_path / "graphs", 250)
+    logger = Logger("error")
+    for index, digest in enumerate(["a", "b", "c"]):
+        with cache.new_part() as part_file:
+            part_file.write(b"x" * 100)
+        cache.add(Path(part_file.name), digest, logger)
+        os.utime(cache.path(digest), (index, index))
+        # Using "a" makes "b" the least recently used.
+        if digest == "b":
+            graph_file = cache.open("a")
+            assert graph_file is not None
+            graph_file.close()
+    assert cached_graphs(cache) == [cache.path("a"), cache.path("c")]
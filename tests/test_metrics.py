@@ -0,0 +1,54 @@
+from ipaddress import ip_address
+
+from pgcrawl.metrics import DispatchMetrics
+from pgcrawl.results import CrawlResult, Failure, OutboxStats
+from pgcrawl.status import RunStatus
+from pgcrawl.types import WorkOutcome
+
+
+CLIENT = ip_address("10.0.0.1")
+
+
+def test_counts_work_by_client() -> None:
+    metrics = DispatchMetrics()
+    outcomes: list[WorkOutcome] = [True, CrawlResult.failed(Failure.DNS),
+                                   False]
+    for outcome in outcomes:
+        metrics.started(CLIENT)
+        metrics.finished(CLIENT, outcome, 1.0)
+    metrics.started(CLIENT)
+
+    counts = metrics.clients()[CLIENT]
+    assert (counts.started, counts.succeeded, counts.failed) == (4, 1, 2)
+    assert counts.failures == {"dns": 1, "unknown": 1}
+    assert counts.in_flight() == 1
+
+    page = metrics.render()
+    assert 'pgcrawl_crawls_started_total{client="10.0.0.1"} 4' in page
+    assert ('pgcrawl_crawls_failed_total{client="10.0.0.1",reason="dns"} 1'
+            in page)
+    assert 'pgcrawl_crawls_in_flight{client="10.0.0.1"} 1' in page
+
+
+def test_status_reads_the_same_counts() -> None:
+    metrics = DispatchMetrics()
+    status = RunStatus(metrics, remaining=2)
+    metrics.started(CLIENT)
+    metrics.finished(CLIENT, CrawlResult.failed(Failure.TIMEOUT), 2.0)
+    status.finished()
+    lines = status.lines()
+    assert "1 remaining" in lines[0]
+    assert lines[1] == "errors: timeout 1"
+    assert lines[2].startswith("  10.0.0.1: 0/1 ok")
+
+
+def test_observes_outbox_uploads() -> None:
+    metrics = DispatchMetrics()
+    result = CrawlResult(True, outbox=OutboxStats(upload_secs=[0.2, 3.0]))
+    metrics.started(CLIENT)
+    metrics.finished(CLIENT, result, 10.0)
+    # And those the outbox reports when flushed, after the last crawl
+    metrics.uploaded(OutboxStats(upload_secs=[0.05]))
+    _, _, upload_secs = metrics.totals()
+    assert sum(upload_secs.counts) == 3
+    assert upload_secs.total == 3.25
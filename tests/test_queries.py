@@ -0,0 +1,81 @@
+import gzip
+import io
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+from typing import Any
+
+import pytest
+
+from pgcrawl.client import PAGEGRAPH_QUERY_ENV_DIR
+from pgcrawl.client import PAGEGRAPH_QUERY_PROJECT_DIR
+from pgcrawl.client.compression import Codec
+from pgcrawl.client.queries import query_frames
+
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures" / "pagegraph"
+GRAPHS = sorted(FIXTURES_DIR.glob("*.graphml"))
+# A checkout of pagegraph-query to check results against, if not the one
+# client_setup.py installs
+PAGEGRAPH_QUERY_DIR = Path(os.environ.get("PAGEGRAPH_QUERY_DIR",
+                                          PAGEGRAPH_QUERY_PROJECT_DIR))
+
+
+def test_counts_each_child_frame() -> None:
+    with open(FIXTURES_DIR / "iframes.graphml", "rb") as handle:
+        results = query_frames(handle)
+    # Both of the first iframe's documents are in frame F2, so both count
+    # everything done in it.
+    assert results == {
+        "n3": {"requests": 2, "js": 3, "html": 2},
+        "n4": {"requests": 2, "js": 3, "html": 2},
+        "n6": {"requests": 1, "js": 1, "html": 1},
+    }
+
+
+def test_reads_compressed_graphs() -> None:
+    path = FIXTURES_DIR / "iframes.graphml"
+    compressed = io.BytesIO(gzip.compress(path.read_bytes()))
+    with open(path, "rb") as handle:
+        expected = query_frames(handle)
+    with Codec.GZIP.open_reader(compressed) as reader:
+        assert query_frames(reader) == expected
+
+
+def pagegraph_query(*args: str) -> Any:
+    python = PAGEGRAPH_QUERY_ENV_DIR / "bin" / "python3"
+    cmd = [str(python) if python.is_file() else sys.executable,
+           str(PAGEGRAPH_QUERY_DIR / "run.py"), *args]
+    rs = subprocess.run(cmd, capture_output=True, check=True,
+                        cwd=PAGEGRAPH_QUERY_DIR)
+    return json.loads(rs.stdout)
+
+
+def num_reported(report: Any) -> int:
+    if isinstance(report, dict):
+        return sum(len(x) for x in report.values() if isinstance(x, list))
+    return len(report)
+
+
+@pytest.mark.skipif(not (PAGEGRAPH_QUERY_DIR / "run.py").is_file(),
+                    reason="pagegraph-query isn't installed")
+@pytest.mark.parametrize("path", GRAPHS, ids=lambda x: x.name)
+def test_matches_pagegraph_query(path: Path) -> None:
+    # Any graph in the fixtures directory (e.g., a real crawl's) is checked
+    # against what pagegraph-query reports for it.
+    expected = {}
+    for report in pagegraph_query("subframes", str(path), "-l"):
+        for frame in report["child frames"]:
+            nid = frame["id"]
+            expected[nid] = {
+                "requests": num_reported(pagegraph_query(
+                    "requests", "-f", nid, str(path))),
+                "js": num_reported(pagegraph_query(
+                    "js-calls", "-f", nid, str(path))),
+                "html": num_reported(pagegraph_query(
+                    "html", "-b", "-s", "-f", nid, str(path))),
+            }
+    with open(path, "rb") as handle:
+        assert query_frames(handle) == expected
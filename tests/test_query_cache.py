@@ -0,0 +1,54 @@
+import gzip
+from pathlib import Path
+import shutil
+
+from pgcrawl.client.actions import UrlRequest, graph_key, run_queries
+from pgcrawl.client.compression import Codec
+from pgcrawl.client.query_cache import QueryCache, digest_key, file_digest
+from pgcrawl.logging import Logger
+from pgcrawl.storage import FileStorage
+
+
+GRAPH_PATH = Path(__file__).parent / "fixtures" / "pagegraph" / \
+    "iframes.graphml"
+REQUEST = UrlRequest("https://example.test", 1)
+
+
+def store_graph(root: Path, with_digest: bool) -> FileStorage:
+    storage = FileStorage(root / "storage")
+    path = storage.path(graph_key(REQUEST.object_name(Codec.GZIP)))
+    path.parent.mkdir(parents=True)
+    path.write_bytes(gzip.compress(GRAPH_PATH.read_bytes()))
+    if with_digest:
+        digest_path = storage.path(digest_key(graph_key(
+            REQUEST.object_name(Codec.GZIP))))
+        digest_path.write_text(file_digest(path), "utf8")
+    return storage
+
+
+def test_reuses_results_for_graphs_with_digests(tmp_path: Path) -> None:
+    storage = store_graph(tmp_path, with_digest=True)
+    cache = QueryCache(tmp_path / "cache")
+    logger = Logger("error")
+    first = run_queries(REQUEST, storage, Codec.GZIP, cache, None, logger)
+    second = run_queries(REQUEST, storage, Codec.GZIP, cache, None, logger)
+    assert first and first == second
+    assert (cache.stats.misses, cache.stats.local_hits) == (1, 1)
+
+    # Other clients find the results in storage.
+    shutil.rmtree(tmp_path / "cache")
+    other_cache = QueryCache(tmp_path / "cache")
+    assert run_queries(REQUEST, storage, Codec.GZIP, other_cache, None,
+                       logger) == first
+    assert other_cache.stats.remote_hits == 1
+
+
+def test_caches_nothing_for_graphs_without_digests(tmp_path: Path) -> None:
+    # Their results could never be looked up, since lookups need the
+    # stored digest.
+    storage = store_graph(tmp_path, with_digest=False)
+    cache = QueryCache(tmp_path / "cache")
+    assert run_queries(REQUEST, storage, Codec.GZIP, cache, None,
+                       Logger("error"))
+    assert not list(storage.list("queries/"))
+    assert not (tmp_path / "cache").exists()
@@ -0,0 +1,68 @@
+import os
+import time
+
+from pgcrawl.client.actions import UrlRequest
+from pgcrawl.client.args import ClientQueryArgs
+from pgcrawl.client.query_pool import QueryPool
+from pgcrawl.logging import Logger
+from pgcrawl.types import JSONDict
+
+
+# What each fake query does, by the rank of the graph it's given
+HANG_RANK = 100
+CRASH_RANK = 200
+
+
+def fake_query(_url: str, rank: int, _args: ClientQueryArgs,
+               _logger: Logger) -> JSONDict | bool:
+    if rank == HANG_RANK:
+        time.sleep(60)
+    if rank == CRASH_RANK:
+        os._exit(1)
+    # Later graphs finish first, and those ranked past 3 right away.
+    time.sleep(max(1.5 - rank * 0.5, 0))
+    return {"n1": {"pid": os.getpid(), "rank": rank}}
+
+
+def run_pool(ranks: list[int], num_workers: int, timeout: int = 0,
+             ordered: bool = True) -> list[tuple[int, JSONDict | bool]]:
+    pool = QueryPool(fake_query, ClientQueryArgs("file:///tmp", timeout),
+                     num_workers, Logger("error"))
+    requests = [UrlRequest(f"https://{x}.test", x) for x in ranks]
+    results = [(x.rank, y) for x, y in pool.run(requests, ordered)]
+    assert not pool.workers
+    return results
+
+
+def ranks_queried(results: list[tuple[int, JSONDict | bool]]) -> list[int]:
+    return [x for x, y in results if y]
+
+
+def test_yields_results_in_order() -> None:
+    results = run_pool([1, 2, 3], 3)
+    assert [x for x, _ in results] == [1, 2, 3]
+    assert ranks_queried(results) == [1, 2, 3]
+    for rank, result in results:
+        assert isinstance(result, dict) and result["n1"]["rank"] == rank
+
+
+def test_yields_results_as_they_finish() -> None:
+    results = run_pool([1, 2, 3], 3, ordered=False)
+    assert [x for x, _ in results] == [3, 2, 1]
+
+
+def test_times_out_and_replaces_stuck_workers() -> None:
+    start = time.monotonic()
+    results = run_pool([4, HANG_RANK, 5], 1, timeout=2)
+    assert time.monotonic() - start < 30
+    assert results[1] == (HANG_RANK, False)
+    assert ranks_queried(results) == [4, 5]
+    # The last graph was queried by a new worker.
+    pids = [y["n1"]["pid"] for _, y in results if isinstance(y, dict)]
+    assert pids[0] != pids[1]
+
+
+def test_replaces_workers_that_die() -> None:
+    results = run_pool([4, CRASH_RANK, 5, 6], 2)
+    assert results[1] == (CRASH_RANK, False)
+    assert ranks_queried(results) == [4, 5, 6]
@@ -0,0 +1,53 @@
+from argparse import ArgumentTypeError
+
+import pytest
+
+from pgcrawl.dispatch.retries import DEFAULT_RETRY_POLICIES, RetryPolicy
+from pgcrawl.dispatch.retries import parse_retry_policy, retry_policies
+from pgcrawl.results import Failure
+
+
+def test_backs_off_exponentially() -> None:
+    policy = RetryPolicy(3, 30)
+    # After the first attempt, the second, and so on
+    assert [policy.retry_delay(x) for x in range(1, 5)] == [
+        30.0, 60.0, 120.0, None]
+
+
+def test_never_retries_without_retries() -> None:
+    assert RetryPolicy(0, 30).retry_delay(1) is None
+    assert RetryPolicy(1).retry_delay(1) == 0.0
+    assert RetryPolicy(1).retry_delay(2) is None
+
+
+def test_waits_at_most_the_backoff_before_any_attempt() -> None:
+    # e.g., domains imported from earlier crawls, without their attempts
+    assert RetryPolicy(2, 30).retry_delay(0) == 30.0
+
+
+@pytest.mark.parametrize("value,expected", [
+    ("ssh=5", (Failure.SSH, RetryPolicy(5, 0, 0))),
+    ("dns=2:7.5", (Failure.DNS, RetryPolicy(2, 7.5, 0))),
+    ("browser-timeout=1:0:20",
+     (Failure.BROWSER_TIMEOUT, RetryPolicy(1, 0, 20))),
+])
+def test_parses_policies(value: str,
+                         expected: tuple[Failure, RetryPolicy]) -> None:
+    assert parse_retry_policy(value) == expected
+
+
+@pytest.mark.parametrize("value", [
+    "ssh", "ssh=", "nope=1", "ssh=x", "ssh=1:x", "ssh=1:2:3.5",
+    "ssh=1:2:3:4", "ssh=-1", "ssh=1:-30", "ssh=1:nan", "ssh=1:inf",
+    "ssh=1:0:-5",
+])
+def test_rejects_invalid_policies(value: str) -> None:
+    with pytest.raises(ArgumentTypeError):
+        parse_retry_policy(value)
+
+
+def test_overrides_only_the_given_policies() -> None:
+    policies = retry_policies([parse_retry_policy("dns=2:10")])
+    assert policies[Failure.DNS] == RetryPolicy(2, 10)
+    assert policies[Failure.SSH] == DEFAULT_RETRY_POLICIES[Failure.SSH]
+    assert DEFAULT_RETRY_POLICIES[Failure.DNS] == RetryPolicy(0)
@@ -0,0 +1,116 @@
+from pathlib import Path
+import time
+from typing import Any, Iterator
+
+import pytest
+
+from pgcrawl.dispatch.leases import LeaseKeeper
+from pgcrawl.dispatch.store import State, WorkStore
+from pgcrawl.results import Failure
+from pgcrawl.types import TrancoDomain
+
+
+DOMAINS = [TrancoDomain(3, "c.test"), TrancoDomain(1, "a.test"),
+           TrancoDomain(2, "b.test")]
+
+
+@pytest.fixture(name="store")
+def fixture_store(tmp_path: Path) -> Iterator[WorkStore]:
+    store = WorkStore(tmp_path / "work.db")
+    store.add(DOMAINS)
+    yield store
+    store.close()
+
+
+def row(store: WorkStore, rank: int, *columns: str) -> tuple[Any, ...]:
+    return tuple(store.conn.execute(
+        f"SELECT {', '.join(columns)} FROM domains WHERE rank = ?",
+        (rank,)).fetchone())
+
+
+def test_claims_domains_in_rank_order(store: WorkStore) -> None:
+    claimed = [store.claim("10.0.0.1#0", 60) for _ in DOMAINS]
+    assert [x.rank for x in claimed if x] == [1, 2, 3]
+    assert store.claim("10.0.0.1#0", 60) is None
+    assert store.counts()[State.UNDERWAY] == 3
+
+    state, attempts, client, lease_expires = row(
+        store, 1, "state", "attempts", "client", "lease_expires")
+    assert (state, attempts, client) == ("underway", 1, "10.0.0.1#0")
+    assert lease_expires == pytest.approx(time.time() + 60, abs=5)
+
+
+def test_reclaims_only_expired_leases(store: WorkStore) -> None:
+    expired = store.claim("10.0.0.1#0", -1)
+    leased = store.claim("10.0.0.1#1", 60)
+    uploading = store.claim("10.0.0.1#0", 60)
+    assert expired and leased and uploading
+    # Uploads that were never confirmed are redone too.
+    store.finish(uploading, State.UPLOADING)
+
+    assert store.expired_leases() == 2
+    assert store.reclaim_expired() == 2
+    assert row(store, expired.rank, "state", "client") == ("todo", None)
+    assert row(store, leased.rank, "state") == ("underway",)
+    assert row(store, uploading.rank, "state") == ("todo",)
+    # And are claimed again, as another attempt.
+    assert store.claim("10.0.0.1#0", 60) == expired
+    assert store.attempts(expired) == 2
+
+
+def test_renews_only_leases_still_held(store: WorkStore) -> None:
+    first = store.claim("10.0.0.1#0", -1)
+    second = store.claim("10.0.0.1#1", -1)
+    assert first and second
+    store.renew([(first.rank, "10.0.0.1#0"), (second.rank, "10.0.0.2#0")],
+                60)
+    assert store.reclaim_expired() == 1
+    assert row(store, first.rank, "state") == ("underway",)
+    assert row(store, second.rank, "state") == ("todo",)
+
+
+def test_lease_keeper_releases_what_it_holds(store: WorkStore) -> None:
+    leases = LeaseKeeper(store, 60)
+    leases.hold(TrancoDomain(1, "a.test"), "10.0.0.1#0")
+    leases.hold(TrancoDomain(2, "b.test"), "10.0.0.1#1")
+    leases.release(TrancoDomain(2, "b.test"))
+    store.finish(TrancoDomain(2, "b.test"), State.DONE)
+    # Held by another dispatcher's client, as far as this one knows
+    store.start(TrancoDomain(3, "c.test"), "10.0.0.2#0", 60)
+
+    assert leases.release_all() == 1
+    assert store.counts() == {State.TODO: 1, State.UNDERWAY: 1,
+                              State.UPLOADING: 0, State.DONE: 1,
+                              State.ERROR: 0}
+
+
+def test_schedules_retries(store: WorkStore) -> None:
+    record = store.claim("10.0.0.1#0", 60)
+    assert record
+    store.schedule_retry(record, Failure.DNS, "no such host",
+                         time.time() + 60, {"browser": 1.0})
+    state, failure, client, lease_expires = row(
+        store, record.rank, "state", "failure", "client", "lease_expires")
+    assert (state, failure, client, lease_expires) == (
+        "todo", "dns", None, None)
+    # Neither new work, nor due yet
+    assert record not in store.iter_todo()
+    assert not list(store.iter_retries())
+    assert store.next_retry_secs() == pytest.approx(60, abs=5)
+    assert list(store.iter_timings()) == [{"browser": 1.0}]
+
+    store.schedule_retry(record, Failure.DNS, "no such host", time.time())
+    assert list(store.iter_retries()) == [(record, Failure.DNS)]
+    assert store.next_retry_secs() == 0
+    assert store.attempts(record) == 1
+
+
+def test_claims_retries_once_due(store: WorkStore) -> None:
+    first = store.claim("10.0.0.1#0", 60)
+    second = store.claim("10.0.0.1#0", 60)
+    assert first and second
+    store.schedule_retry(first, Failure.SSH, None, time.time() + 60)
+    store.schedule_retry(second, Failure.SSH, None, time.time() - 1)
+    assert store.claim("10.0.0.1#0", 60) == second
+    assert store.claim("10.0.0.1#0", 60) == TrancoDomain(3, "c.test")
+    assert store.claim("10.0.0.1#0", 60) is None
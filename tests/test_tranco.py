@@ -0,0 +1,72 @@
+import gzip
+import io
+from pathlib import Path
+from typing import Any
+import zipfile
+
+import pytest
+
+from pgcrawl.dispatch.tranco import open_tranco_file, read_tranco
+from pgcrawl.types import TrancoDomain
+
+
+TRANCO_CSV = """1,google.com
+2,Example.COM
+3,example.com
+bad,row
+²,squared.test
+4
+5,""
+6,  wikipedia.org
+7,apple.com
+"""
+
+
+def read_all(text: str, **kwargs: Any) -> list[TrancoDomain]:
+    return list(read_tranco(io.StringIO(text), **kwargs))
+
+
+def test_reads_ranks_and_domains() -> None:
+    # Skipping rows that aren't records, and domains already listed at a
+    # better rank
+    assert read_all(TRANCO_CSV) == [
+        TrancoDomain(1, "google.com"), TrancoDomain(2, "example.com"),
+        TrancoDomain(6, "wikipedia.org"), TrancoDomain(7, "apple.com")]
+
+
+def test_reads_only_the_given_ranks() -> None:
+    assert read_all(TRANCO_CSV, from_rank=2, to_rank=6) == [
+        TrancoDomain(2, "example.com"), TrancoDomain(6, "wikipedia.org")]
+    assert not read_all(TRANCO_CSV, from_rank=8)
+
+
+def test_stops_reading_past_the_last_rank() -> None:
+    # Tranco lists are sorted by rank, so nothing past it is read.
+    stream = io.StringIO(TRANCO_CSV)
+    assert [x.rank for x in read_tranco(stream, to_rank=1)] == [1]
+    assert stream.readline() == "3,example.com\n"
+
+
+def test_samples_reproducibly() -> None:
+    text = "".join(f"{x},site{x}.test\n" for x in range(1, 1001))
+    sample = read_all(text, sample=0.1, seed=1)
+    assert 50 < len(sample) < 150
+    assert sample == read_all(text, sample=0.1, seed=1)
+    assert sample != read_all(text, sample=0.1, seed=2)
+
+
+@pytest.mark.parametrize("kind", ["plain", "bom", "gzip", "zip"])
+def test_opens_any_kind_of_list(tmp_path: Path, kind: str) -> None:
+    data = TRANCO_CSV.encode("utf8")
+    path = tmp_path / "top-1m.csv"
+    if kind == "bom":
+        path.write_bytes(b"\xef\xbb\xbf" + data)
+    elif kind == "gzip":
+        path.write_bytes(gzip.compress(data))
+    elif kind == "zip":
+        with zipfile.ZipFile(path, "w") as archive:
+            archive.writestr("top-1m.csv", data)
+    else:
+        path.write_bytes(data)
+    with open_tranco_file(path) as stream:
+        assert next(read_tranco(stream)) == TrancoDomain(1, "google.com")